@@ -0,0 +1,97 @@
+# Benchmark viewport (bounding-box) queries against the locations R*Tree
+#
+# Fills a throwaway database through the real schema and migrations (so the
+# R*Tree triggers populate the index), then times map-viewport queries for one
+# user with the R*Tree and with only the (user_id, id) index:
+#
+#   python bench/bench_bbox.py --rows 2000000 --users 4
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from database import Base  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+RTREE_SQL = """
+    SELECT id, latitude, longitude FROM locations
+    WHERE user_id = :user AND id IN (
+        SELECT id FROM locations_rtree
+        WHERE min_user >= :user AND max_user <= :user
+          AND max_lon >= :min_lon AND min_lon <= :max_lon AND max_lat >= :min_lat AND min_lat <= :max_lat
+    )
+    AND latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lon AND :max_lon
+"""
+SCAN_SQL = """
+    SELECT id, latitude, longitude FROM locations INDEXED BY ix_locations_user_id_id
+    WHERE user_id = :user AND latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lon AND :max_lon
+"""
+
+
+def build_database(path: str, rows: int, users: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (id, email, password_hash) VALUES (?, ?, 'x')",
+        ((i, f"user{i}@example.com") for i in range(1, users + 1))
+    )
+    conn.executemany(
+        "INSERT INTO locations (id, user_id, name, latitude, longitude) VALUES (?, ?, ?, ?, ?)",
+        (
+            (i, random.randint(1, users), f"Place {i}", random.uniform(-60, 70), random.uniform(-180, 180))
+            for i in range(1, rows + 1)
+        )
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def time_viewports(conn, sql: str, users: int, span: float, samples: int):
+    latencies, found = [], 0
+    for _ in range(samples):
+        lat, lon = random.uniform(-60, 70 - span), random.uniform(-180, 180 - span)
+        params = {"user": random.randint(1, users), "min_lat": lat, "max_lat": lat + span,
+                  "min_lon": lon, "max_lon": lon + span}
+        started = time.perf_counter()
+        found += len(conn.execute(sql, params).fetchall())
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000, found / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bounding-box location queries")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=4, help="users sharing the rows")
+    parser.add_argument("--spans", default="0.1,1,10", help="viewport sizes in degrees")
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        conn = build_database(os.path.join(tmp, "bench.db"), args.rows, args.users)
+        print(f"Built {args.rows} locations for {args.users} users in {time.perf_counter() - started:.1f}s")
+        print(f"{'span':>6}  {'index':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'rows':>8}")
+        for span in (float(value) for value in args.spans.split(",")):
+            for label, sql, samples in (("rtree", RTREE_SQL, args.samples), ("user_id", SCAN_SQL, max(1, args.samples // 20))):
+                p50, p95, rows = time_viewports(conn, sql, args.users, span, samples)
+                print(f"{span:>6}  {label:>8}  {p50:>8.3f}  {p95:>8.3f}  {rows:>8.1f}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
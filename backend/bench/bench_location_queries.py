@@ -0,0 +1,98 @@
+# Benchmark per-user location queries as the locations table grows
+#
+# Builds a throwaway SQLite database from the models, fills it with locations
+# spread over many users and times the queries behind GET /locations,
+# /locations/refresh and the delete ownership check, with and without the
+# per-user indexes added by migration 1:
+#
+#   python bench/bench_location_queries.py --sizes 10000,100000,1000000
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from database import Base  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+LOCATIONS_PER_USER = 50
+
+QUERIES = {
+    "list": "SELECT * FROM locations WHERE user_id = ? ORDER BY id",
+    "recent": "SELECT * FROM locations WHERE user_id = ? ORDER BY updated_at DESC LIMIT 20",
+    "ownership": "SELECT id FROM locations WHERE id = ? AND user_id = ?",
+}
+INDEXES = ["ix_locations_user_id_id", "ix_locations_user_id_updated_at"]
+
+
+def build_database(path: str, rows: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    engine.dispose()
+
+    users = max(1, rows // LOCATIONS_PER_USER)
+    start = datetime(2024, 1, 1)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (id, email, password_hash, name, created_at, updated_at) VALUES (?, ?, 'x', ?, ?, ?)",
+        ((i, f"user{i}@example.com", f"User {i}", start, start) for i in range(1, users + 1))
+    )
+    # Insert in random user order so one user's rows are scattered through the table
+    conn.executemany(
+        "INSERT INTO locations (id, user_id, name, latitude, longitude, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (i, random.randint(1, users), f"Place {i}", random.uniform(-90, 90), random.uniform(-180, 180),
+             start + timedelta(seconds=i), start + timedelta(seconds=i))
+            for i in range(1, rows + 1)
+        )
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn, users
+
+
+def time_queries(conn, users: int, samples: int) -> dict:
+    results = {}
+    user_ids = [random.randint(1, users) for _ in range(samples)]
+    for name, sql in QUERIES.items():
+        started = time.perf_counter()
+        for user_id in user_ids:
+            params = (user_id * LOCATIONS_PER_USER, user_id) if name == "ownership" else (user_id,)
+            conn.execute(sql, params).fetchall()
+        results[name] = round((time.perf_counter() - started) / samples * 1000, 3)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-user location queries")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated table sizes")
+    parser.add_argument("--samples", type=int, default=200, help="queries per measurement")
+    args = parser.parse_args()
+
+    random.seed(42)
+    print(f"{'rows':>10}  {'indexes':>8}  " + "  ".join(f"{name + ' ms':>12}" for name in QUERIES))
+    for rows in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn, users = build_database(os.path.join(tmp, "bench.db"), rows)
+            indexed = time_queries(conn, users, args.samples)
+            for index in INDEXES:
+                conn.execute(f"DROP INDEX {index}")
+            # Without the indexes a full scan is slow, so sample less
+            unindexed = time_queries(conn, users, max(1, args.samples // 20))
+            conn.close()
+        for label, result in (("yes", indexed), ("no", unindexed)):
+            print(f"{rows:>10}  {label:>8}  " + "  ".join(f"{result[name]:>12}" for name in QUERIES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Benchmark location text search: FTS5 index versus a LIKE scan
+#
+# Fills a throwaway database through the real schema and migrations (so the
+# FTS5 triggers populate the index), then times /locations/search-style queries
+# for one user with the locations_fts index and with a naive LIKE scan over the
+# user's rows. "rare" queries pick words uniformly from the vocabulary, as when
+# looking for one specific place; "common" ones pick them by frequency:
+#
+#   python bench/bench_search.py --rows 1000000 --users 4
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from database import Base  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "sa", "to", "vel", "ba", "dor", "ni", "que", "ra", "zu", "fen", "ho", "li"]
+# Synthetic vocabulary with a Zipf-like word frequency, like real place names
+WORDS = sorted({"".join(random.Random(i).choices(SYLLABLES, k=3)) for i in range(5000)})
+WORD_WEIGHTS = [1.0 / rank for rank in range(1, len(WORDS) + 1)]
+STREETS = ["Main St", "Market St", "Ocean Ave", "Rue de Rivoli", "Shibuya", "King St", "Broadway", "High St"]
+CITIES = ["Paris", "Tokyo", "New York", "London", "Lisbon", "Mexico City", "Seoul", "Berlin", "Sydney", "Oslo"]
+
+FTS_SQL = """
+    SELECT l.id, l.name FROM locations l
+    JOIN (
+        SELECT rowid AS id, bm25(locations_fts, 10.0, 2.0, 4.0, 0.0) AS rank FROM locations_fts
+        WHERE locations_fts MATCH :match ORDER BY rank LIMIT :limit
+    ) AS ranked ON ranked.id = l.id
+    WHERE l.user_id = :user ORDER BY ranked.rank
+"""
+LIKE_TERM_SQL = "(name LIKE :like{i} OR description LIKE :like{i} OR address LIKE :like{i})"
+LIKE_SQL = """
+    SELECT id, name FROM locations
+    WHERE user_id = :user AND {terms}
+    ORDER BY id LIMIT :limit
+"""
+
+
+def build_database(path: str, rows: int, users: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (id, email, password_hash) VALUES (?, ?, 'x')",
+        ((i, f"user{i}@example.com") for i in range(1, users + 1))
+    )
+    conn.executemany(
+        "INSERT INTO locations (id, user_id, name, description, address, latitude, longitude) "
+        "VALUES (?, ?, ?, ?, ?, 0, 0)",
+        (
+            (
+                i, random.randint(1, users),
+                " ".join(random.choices(WORDS, WORD_WEIGHTS, k=2)).title(),
+                " ".join(random.choices(WORDS, WORD_WEIGHTS, k=6)),
+                f"{random.randint(1, 999)} {random.choice(STREETS)}, {random.choice(CITIES)}",
+            )
+            for i in range(1, rows + 1)
+        )
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def time_queries(conn, sql: str, users: int, words: int, prefix: bool, uniform: bool, samples: int, limit: int):
+    latencies, found = [], 0
+    for _ in range(samples):
+        terms = random.sample(WORDS, words) if uniform else random.choices(WORDS, WORD_WEIGHTS, k=words)
+        if prefix:
+            terms[-1] = terms[-1][:3]
+        user = random.randint(1, users)
+        quoted = [f'"{term}"' for term in terms]
+        if prefix:
+            quoted[-1] += "*"
+        params = {"user": user, "limit": limit, "match": f"owner:u{user} AND " + " AND ".join(quoted)}
+        params.update({f"like{i}": f"%{term}%" for i, term in enumerate(terms)})
+        statement = sql.format(terms=" AND ".join(LIKE_TERM_SQL.format(i=i) for i in range(len(terms))))
+        started = time.perf_counter()
+        found += len(conn.execute(statement, params).fetchall())
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000, found / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark location text search")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=4, help="users sharing the rows")
+    parser.add_argument("--limit", type=int, default=20, help="results per query")
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        conn = build_database(os.path.join(tmp, "bench.db"), args.rows, args.users)
+        print(f"Built {args.rows} locations for {args.users} users in {time.perf_counter() - started:.1f}s")
+        print(f"{'query':>15}  {'method':>6}  {'p50 ms':>8}  {'p95 ms':>8}  {'rows':>6}")
+        queries = (("1 word", 1, False), ("2 words", 2, False), ("prefix", 1, True))
+        for words_label, uniform in (("rare", True), ("common", False)):
+            for label, words, prefix in queries:
+                for method, sql, samples in (("fts5", FTS_SQL, args.samples), ("like", LIKE_SQL, max(1, args.samples // 20))):
+                    p50, p95, rows = time_queries(conn, sql, args.users, words, prefix, uniform, samples, args.limit)
+                    print(f"{words_label + ' ' + label:>15}  {method:>6}  {p50:>8.3f}  {p95:>8.3f}  {rows:>6.1f}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# SQLite-backed caches for screenshot parsing and geocoding
+#
+# The cache lives in its own SQLite file next to vibesy.db so every uvicorn
+# worker shares it, and clearing it never touches user data.
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger("vibesy")
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "./vibesy_cache.db")
+
+# Screenshot cache key mode: pixels | perceptual | off
+SCREENSHOT_CACHE_MODE = os.getenv("SCREENSHOT_CACHE_MODE", "pixels")
+SCREENSHOT_CACHE_TTL = int(os.getenv("SCREENSHOT_CACHE_TTL", str(7 * 24 * 3600)))
+SCREENSHOT_CACHE_MAX_ENTRIES = int(os.getenv("SCREENSHOT_CACHE_MAX_ENTRIES", "5000"))
+SCREENSHOT_CACHE_MAX_BYTES = int(os.getenv("SCREENSHOT_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+_local = threading.local()
+
+
+def get_cache_connection() -> sqlite3.Connection:
+    """Return this thread's connection to the cache database"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_DB_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+
+class ScreenshotCache:
+    """Content-addressed cache of OCR text and extracted location candidates
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    evicted once the cache exceeds ``max_entries`` or ``max_bytes``.
+    """
+
+    def __init__(self, ttl: int, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._schema_ready = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = get_cache_connection()
+        if not self._schema_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS screenshot_cache (
+                    key TEXT PRIMARY KEY,
+                    ocr_text TEXT NOT NULL,
+                    candidates TEXT NOT NULL,
+                    meta TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    signature BLOB
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(screenshot_cache)")}
+            if "signature" not in columns:
+                # Cache files created before perceptual keys were confirmed
+                conn.execute("ALTER TABLE screenshot_cache ADD COLUMN signature BLOB")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_screenshot_cache_accessed_at ON screenshot_cache (accessed_at)")
+            self._schema_ready = True
+        return conn
+
+    def get(self, key: str) -> Optional[dict]:
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(
+            "SELECT ocr_text, candidates, meta, created_at, signature FROM screenshot_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        ocr_text, candidates, meta, created_at, signature = row
+        if now - created_at > self.ttl:
+            conn.execute("DELETE FROM screenshot_cache WHERE key = ?", (key,))
+            return None
+        conn.execute(
+            "UPDATE screenshot_cache SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (now, key)
+        )
+        return {
+            "ocr_text": ocr_text,
+            "candidates": json.loads(candidates),
+            "meta": json.loads(meta),
+            "signature": signature,
+        }
+
+    def put(self, key: str, ocr_text: str, candidates: list, meta: dict, signature: Optional[bytes] = None):
+        conn = self._connection()
+        now = time.time()
+        candidates_json = json.dumps(candidates)
+        meta_json = json.dumps(meta)
+        size_bytes = len(key) + len(ocr_text.encode()) + len(candidates_json) + len(meta_json) + len(signature or b"")
+        conn.execute(
+            "INSERT OR REPLACE INTO screenshot_cache "
+            "(key, ocr_text, candidates, meta, size_bytes, created_at, accessed_at, hits, signature) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)",
+            (key, ocr_text, candidates_json, meta_json, size_bytes, now, now, signature)
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM screenshot_cache WHERE created_at < ?", (now - self.ttl,))
+        count, total_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM screenshot_cache"
+        ).fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        # Walk entries from least recently used until both bounds hold again
+        evict_keys = []
+        for key, size_bytes in conn.execute(
+            "SELECT key, size_bytes FROM screenshot_cache ORDER BY accessed_at"
+        ):
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            evict_keys.append(key)
+            count -= 1
+            total_bytes -= size_bytes
+        conn.executemany("DELETE FROM screenshot_cache WHERE key = ?", [(key,) for key in evict_keys])
+        logger.info(f"Evicted {len(evict_keys)} screenshot cache entries")
+
+
+screenshot_cache = ScreenshotCache(
+    ttl=SCREENSHOT_CACHE_TTL,
+    max_entries=SCREENSHOT_CACHE_MAX_ENTRIES,
+    max_bytes=SCREENSHOT_CACHE_MAX_BYTES,
+)
+
+
+# Geocoding cache settings
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", str(24 * 3600)))
+GEOCODE_MEMORY_CACHE_SIZE = int(os.getenv("GEOCODE_MEMORY_CACHE_SIZE", "10000"))
+
+
+def normalize_geocode_query(query: str) -> str:
+    """Cache key for a place name: case-folded, whitespace collapsed, edge punctuation removed"""
+    return " ".join(query.casefold().split()).strip(" .,;:!?-'\"")
+
+
+class TwoTierCache(ABC):
+    """An in-process LRU in front of a table in the shared cache database
+
+    Subclasses name the table and its value columns and convert values to and
+    from those columns. Entries live for ``ttl`` seconds, or ``negative_ttl``
+    seconds for values recording that a query had no result.
+    """
+
+    # Table with a query_key primary key, the value ``columns`` and fetched_at
+    table: str
+    columns: Tuple[str, ...]
+    schema: str
+
+    def __init__(self, ttl: int, negative_ttl: int, memory_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+    @abstractmethod
+    def _encode(self, value) -> tuple:
+        """Column values, in ``columns`` order, for a cached value"""
+
+    @abstractmethod
+    def _decode(self, row: tuple):
+        """The cached value of a row of ``columns``"""
+
+    @abstractmethod
+    def _is_negative(self, value) -> bool:
+        """Whether ``value`` records that the query had no result"""
+
+    def _on_db_hit(self, conn: sqlite3.Connection, key: str):
+        """Called when an entry is served from the table rather than from memory"""
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = get_cache_connection()
+        if not self._schema_ready:
+            conn.execute(self.schema)
+            self._schema_ready = True
+        return conn
+
+    def _expires_at(self, value, fetched_at: float) -> float:
+        return fetched_at + (self.negative_ttl if self._is_negative(value) else self.ttl)
+
+    def _remember(self, key: str, value, expires_at: float):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, query: str) -> Tuple[bool, Any]:
+        """Return ``(hit, value)`` for a query"""
+        key = normalize_geocode_query(query)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return True, entry[0]
+                del self._memory[key]
+
+        conn = self._connection()
+        row = conn.execute(
+            f"SELECT {', '.join(self.columns)}, fetched_at FROM {self.table} WHERE query_key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            value = self._decode(row[:-1])
+            expires_at = self._expires_at(value, row[-1])
+            if expires_at > now:
+                self._on_db_hit(conn, key)
+                self._remember(key, value, expires_at)
+                self.stats["db_hits"] += 1
+                return True, value
+
+        self.stats["misses"] += 1
+        return False, None
+
+    def _store(self, query: str, value):
+        key = normalize_geocode_query(query)
+        now = time.time()
+        placeholders = ", ".join("?" for _ in self.columns)
+        self._connection().execute(
+            f"INSERT OR REPLACE INTO {self.table} (query_key, {', '.join(self.columns)}, fetched_at) "
+            f"VALUES (?, {placeholders}, ?)",
+            (key, *self._encode(value), now)
+        )
+        self._remember(key, value, self._expires_at(value, now))
+
+
+class GeocodeCache(TwoTierCache):
+    """Two-tier geocoding cache: an in-process LRU in front of a shared SQLite table
+
+    Successful lookups live for ``ttl`` seconds; queries Nominatim had no result
+    for are cached as negative entries for ``negative_ttl`` seconds.
+    """
+
+    table = "geocode_cache"
+    columns = ("latitude", "longitude", "display_name", "found")
+    schema = """
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            query_key TEXT PRIMARY KEY,
+            latitude REAL,
+            longitude REAL,
+            display_name TEXT,
+            found INTEGER NOT NULL,
+            hit_count INTEGER NOT NULL DEFAULT 0,
+            fetched_at REAL NOT NULL
+        )
+    """
+
+    def _encode(self, result: Optional[dict]) -> tuple:
+        if result is None:
+            return None, None, None, 0
+        return result["latitude"], result["longitude"], result.get("address"), 1
+
+    def _decode(self, row: tuple) -> Optional[dict]:
+        latitude, longitude, display_name, found = row
+        return {"latitude": latitude, "longitude": longitude, "address": display_name} if found else None
+
+    def _is_negative(self, result: Optional[dict]) -> bool:
+        return result is None
+
+    def _on_db_hit(self, conn: sqlite3.Connection, key: str):
+        conn.execute("UPDATE geocode_cache SET hit_count = hit_count + 1 WHERE query_key = ?", (key,))
+
+    def get(self, query: str):
+        """Return ``(hit, result)``; ``result`` is None for a cached negative lookup"""
+        return self._lookup(query)
+
+    def put(self, query: str, result: Optional[dict]):
+        """Store a lookup result; pass None to record that the query has no match"""
+        self._store(query, result)
+
+
+geocode_cache = GeocodeCache(
+    ttl=GEOCODE_CACHE_TTL,
+    negative_ttl=GEOCODE_NEGATIVE_TTL,
+    memory_size=GEOCODE_MEMORY_CACHE_SIZE,
+)
+
+
+class GeocodeSearchCache(TwoTierCache):
+    """Cache of address-search result lists, shared by all workers like GeocodeCache
+
+    Queries with results live for ``ttl`` seconds, queries without any for
+    ``negative_ttl`` seconds.
+    """
+
+    table = "geocode_search_cache"
+    columns = ("results",)
+    schema = """
+        CREATE TABLE IF NOT EXISTS geocode_search_cache (
+            query_key TEXT PRIMARY KEY,
+            results TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """
+
+    def _encode(self, results: list) -> tuple:
+        return (json.dumps(results),)
+
+    def _decode(self, row: tuple) -> list:
+        return json.loads(row[0])
+
+    def _is_negative(self, results: list) -> bool:
+        return not results
+
+    def get(self, query: str) -> Optional[list]:
+        """Return the cached results for ``query`` (possibly empty), or None on a miss"""
+        hit, results = self._lookup(query)
+        return results if hit else None
+
+    def put(self, query: str, results: list):
+        self._store(query, results)
+
+
+geocode_search_cache = GeocodeSearchCache(
+    ttl=GEOCODE_CACHE_TTL,
+    negative_ttl=GEOCODE_NEGATIVE_TTL,
+    memory_size=GEOCODE_MEMORY_CACHE_SIZE,
+)
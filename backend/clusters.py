@@ -0,0 +1,257 @@
+# Precomputed map clusters per user and zoom level
+#
+# Each location is counted in one grid cell per zoom level, on a Web Mercator
+# grid of CLUSTER_CELLS_PER_TILE x CLUSTER_CELLS_PER_TILE cells per map tile.
+# Each zoom level's grid halves the one above it, so a cell at zoom z is the
+# cell at zoom z + 1 with both coordinates halved. A build therefore runs in
+# SQL: one INSERT ... SELECT projects the user's locations onto the finest grid
+# and groups them, then each coarser level is grouped from the level above.
+# A user's cells are built lazily on their first cluster request, then kept up
+# to date incrementally by the location write paths, in the same transaction.
+# cluster_state records the locations_version the cells reflect; if it ever
+# falls behind (e.g. a write path that does not maintain clusters), the next
+# request rebuilds the user's cells from scratch.
+import logging
+import math
+import os
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, and_, case, cast, delete, func, insert, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import ClusterState, Location, LocationCluster, User, engine
+
+logger = logging.getLogger("vibesy")
+
+# Highest zoom level with precomputed clusters; above it the map shows individual pins
+MAX_CLUSTER_ZOOM = int(os.getenv("MAX_CLUSTER_ZOOM", "16"))
+CLUSTER_CELLS_PER_TILE = int(os.getenv("CLUSTER_CELLS_PER_TILE", "2"))
+
+# Web Mercator is undefined at the poles
+MAX_MERCATOR_LATITUDE = 85.05112878
+
+_upsert = postgresql_insert if engine.dialect.name == "postgresql" else sqlite_insert
+
+# (location id, latitude, longitude)
+Point = Tuple[int, float, float]
+
+
+def mercator(latitude: float, longitude: float) -> Tuple[float, float]:
+    """Project to the unit square, x growing east and y growing south
+
+    Same arithmetic as _mercator_sql, so incremental updates and SQL builds
+    put a location in the same cell.
+    """
+    latitude = max(-MAX_MERCATOR_LATITUDE, min(MAX_MERCATOR_LATITUDE, latitude))
+    phi = latitude * (math.pi / 180.0)
+    x = (longitude + 180.0) / 360.0
+    y = (1.0 - math.log(math.tan(phi) + 1.0 / math.cos(phi)) / math.pi) / 2.0
+    return x, y
+
+
+def _mercator_sql(latitude, longitude):
+    """mercator() as SQL expressions over latitude/longitude columns"""
+    latitude = case(
+        (latitude > MAX_MERCATOR_LATITUDE, MAX_MERCATOR_LATITUDE),
+        (latitude < -MAX_MERCATOR_LATITUDE, -MAX_MERCATOR_LATITUDE),
+        else_=latitude,
+    )
+    phi = latitude * (math.pi / 180.0)
+    x = (longitude + 180.0) / 360.0
+    y = (1.0 - func.ln(func.tan(phi) + 1.0 / func.cos(phi)) / math.pi) / 2.0
+    return x, y
+
+
+def _cell_sql(coordinate, size: int):
+    """_cell() for one projected coordinate, as an SQL expression"""
+    # The clamped pole latitudes project a hair outside [0, 1]
+    index = cast(func.floor(coordinate * size), Integer)
+    return case((index < 0, 0), (index > size - 1, size - 1), else_=index)
+
+
+def _grid_size(zoom: int) -> int:
+    return (1 << zoom) * CLUSTER_CELLS_PER_TILE
+
+
+def _cell(x: float, y: float, size: int) -> Tuple[int, int]:
+    return min(int(x * size), size - 1), min(int(y * size), size - 1)
+
+
+def _aggregate(points: Iterable[Point]) -> dict:
+    """Group points into (zoom, cell_x, cell_y) -> [count, latitude sum, longitude sum, smallest id]"""
+    cells = defaultdict(lambda: [0, 0.0, 0.0, None])
+    sizes = [_grid_size(zoom) for zoom in range(MAX_CLUSTER_ZOOM + 1)]
+    for location_id, latitude, longitude in points:
+        x, y = mercator(latitude, longitude)
+        for zoom, size in enumerate(sizes):
+            cell = cells[(zoom, *_cell(x, y, size))]
+            cell[0] += 1
+            cell[1] += latitude
+            cell[2] += longitude
+            if cell[3] is None or location_id < cell[3]:
+                cell[3] = location_id
+    return cells
+
+
+def _cell_rows(user_id: int, cells: dict) -> List[dict]:
+    return [
+        {"user_id": user_id, "zoom": zoom, "cell_x": cell_x, "cell_y": cell_y,
+         "count": count, "latitude_sum": latitude_sum, "longitude_sum": longitude_sum, "representative_id": rep_id}
+        for (zoom, cell_x, cell_y), (count, latitude_sum, longitude_sum, rep_id) in cells.items()
+    ]
+
+
+_CELL_COLUMNS = ["user_id", "zoom", "cell_x", "cell_y", "count", "latitude_sum", "longitude_sum", "representative_id"]
+
+
+def build_clusters(db: Session, user_id: int):
+    """(Re)build all of a user's cluster cells in SQL and commit"""
+    # Deleting first takes the write lock, so concurrent builds for one user run one at a time
+    db.execute(delete(LocationCluster).where(LocationCluster.user_id == user_id))
+    version = db.execute(select(User.locations_version).where(User.id == user_id)).scalar_one()
+
+    # Finest level straight from the locations
+    size = _grid_size(MAX_CLUSTER_ZOOM)
+    x, y = _mercator_sql(Location.latitude, Location.longitude)
+    points = select(
+        Location.id, Location.latitude, Location.longitude,
+        _cell_sql(x, size).label("cell_x"), _cell_sql(y, size).label("cell_y"),
+    ).where(Location.user_id == user_id).subquery()
+    cells = select(
+        literal(user_id), literal(MAX_CLUSTER_ZOOM), points.c.cell_x, points.c.cell_y, func.count(),
+        func.sum(points.c.latitude), func.sum(points.c.longitude), func.min(points.c.id),
+    ).group_by(points.c.cell_x, points.c.cell_y)
+    created = db.execute(insert(LocationCluster).from_select(_CELL_COLUMNS, cells)).rowcount
+
+    # Every coarser level from the one above: each cell covers 2 x 2 cells of the finer grid
+    for zoom in range(MAX_CLUSTER_ZOOM - 1, -1, -1):
+        finer = select(LocationCluster).where(
+            LocationCluster.user_id == user_id, LocationCluster.zoom == zoom + 1
+        ).subquery()
+        cell_x, cell_y = finer.c.cell_x // 2, finer.c.cell_y // 2
+        cells = select(
+            literal(user_id), literal(zoom), cell_x, cell_y, func.sum(finer.c.count),
+            func.sum(finer.c.latitude_sum), func.sum(finer.c.longitude_sum), func.min(finer.c.representative_id),
+        ).group_by(cell_x, cell_y)
+        created += db.execute(insert(LocationCluster).from_select(_CELL_COLUMNS, cells)).rowcount
+
+    db.execute(delete(ClusterState).where(ClusterState.user_id == user_id))
+    db.add(ClusterState(user_id=user_id, version=version))
+    db.commit()
+    logger.info(f"Built {created} cluster cells for user {user_id}")
+
+
+def ensure_clusters(db: Session, user_id: int, version: int):
+    state = db.get(ClusterState, user_id)
+    if state is None or state.version != version:
+        build_clusters(db, user_id)
+
+
+def record_location_changes(db: Session, user_id: int, version: int,
+                            added: Iterable[Point] = (), removed: Iterable[Point] = ()):
+    """Apply a write to the user's cluster cells, if they have been built
+
+    Call inside the writing transaction, after next_locations_version.
+    """
+    state = db.get(ClusterState, user_id)
+    if state is None:
+        return
+    if state.version != version - 1:
+        # Cells missed a change; leave them stale so the next request rebuilds them
+        return
+
+    added_cells = _aggregate(added)
+    if added_cells:
+        stmt = _upsert(LocationCluster)
+        # Existing cells keep their representative; only new cells take the inserted one
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "zoom", "cell_x", "cell_y"],
+            set_={
+                "count": LocationCluster.count + stmt.excluded.count,
+                "latitude_sum": LocationCluster.latitude_sum + stmt.excluded.latitude_sum,
+                "longitude_sum": LocationCluster.longitude_sum + stmt.excluded.longitude_sum,
+            }
+        )
+        db.execute(stmt, _cell_rows(user_id, added_cells))
+
+    removed = list(removed)
+    removed_ids = [location_id for location_id, _, _ in removed]
+    for (zoom, cell_x, cell_y), (count, latitude_sum, longitude_sum, _) in _aggregate(removed).items():
+        key = and_(
+            LocationCluster.user_id == user_id, LocationCluster.zoom == zoom,
+            LocationCluster.cell_x == cell_x, LocationCluster.cell_y == cell_y,
+        )
+        db.execute(update(LocationCluster).where(key).values(
+            count=LocationCluster.count - count,
+            latitude_sum=LocationCluster.latitude_sum - latitude_sum,
+            longitude_sum=LocationCluster.longitude_sum - longitude_sum,
+        ))
+        db.execute(delete(LocationCluster).where(key, LocationCluster.count <= 0))
+        cluster = db.execute(select(LocationCluster).where(key, LocationCluster.representative_id.in_(removed_ids))).scalar()
+        if cluster is not None:
+            cluster.representative_id = _find_representative(db, user_id, zoom, cell_x, cell_y, removed_ids)
+
+    state.version = version
+
+
+def _cell_bounds(zoom: int, cell_x: int, cell_y: int) -> Tuple[float, float, float, float]:
+    """(min longitude, min latitude, max longitude, max latitude) of a grid cell"""
+    size = _grid_size(zoom)
+
+    def latitude(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / size))))
+
+    return (cell_x / size * 360.0 - 180.0, latitude(cell_y + 1),
+            (cell_x + 1) / size * 360.0 - 180.0, latitude(cell_y))
+
+
+def _find_representative(db: Session, user_id: int, zoom: int, cell_x: int, cell_y: int,
+                         exclude: List[int]) -> Optional[int]:
+    from queries import select_locations
+
+    # Any remaining location in the cell; the bounds are widened slightly and
+    # the candidates re-checked against the exact cell
+    min_lon, min_lat, max_lon, max_lat = _cell_bounds(zoom, cell_x, cell_y)
+    margin = 1e-9
+    box = (max(-180.0, min_lon - margin), max(-90.0, min_lat - margin),
+           min(180.0, max_lon + margin), min(90.0, max_lat + margin))
+    size = _grid_size(zoom)
+    statement = select_locations(user_id, ["id", "latitude", "longitude"], bbox=box)
+    for location_id, latitude, longitude in db.execute(statement):
+        if location_id not in exclude and _cell(*mercator(latitude, longitude), size) == (cell_x, cell_y):
+            return location_id
+    return None
+
+
+def query_clusters(db: Session, user_id: int, zoom: int, bbox: Tuple[float, float, float, float]) -> List[dict]:
+    """Clusters of the given zoom level whose cells intersect ``bbox``"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    size = _grid_size(zoom)
+    # North edge has the smaller y
+    x_low, y_low = _cell(*mercator(max_lat, min_lon), size)
+    x_high, y_high = _cell(*mercator(min_lat, max_lon), size)
+    x_ranges = [(x_low, x_high)] if min_lon <= max_lon else [(x_low, size - 1), (0, x_high)]
+
+    cells = db.execute(
+        select(
+            LocationCluster.count, LocationCluster.latitude_sum,
+            LocationCluster.longitude_sum, LocationCluster.representative_id
+        ).where(
+            LocationCluster.user_id == user_id,
+            LocationCluster.zoom == zoom,
+            or_(*(LocationCluster.cell_x.between(low, high) for low, high in x_ranges)),
+            LocationCluster.cell_y.between(y_low, y_high),
+        )
+    )
+    return [
+        {
+            "count": count,
+            "latitude": latitude_sum / count,
+            "longitude": longitude_sum / count,
+            "representative_id": representative_id,
+        }
+        for count, latitude_sum, longitude_sum, representative_id in cells
+    ]
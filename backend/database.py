@@ -1,16 +1,108 @@
 # Database models for Vibesy app using SQLAlchemy
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, ForeignKey, Text, Index
+from sqlalchemy import Delete, Insert, Update
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import Session, sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.elements import TextClause
 from sqlalchemy.sql import func
 from datetime import datetime
+import math
 import os
+import sqlite3
 
 # Database configuration
-DATABASE_URL = "sqlite:///./vibesy.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./vibesy.db")
+
+# SQLite engine profile:
+#   wal    - WAL journal and tuned pragmas, writes serialized through one writer
+#            connection, reads served by a bounded pool of reader connections
+#   legacy - a single engine with SQLite defaults
+DB_ENGINE_PROFILE = os.getenv("DB_ENGINE_PROFILE", "wal")
+DB_READER_POOL_SIZE = int(os.getenv("DB_READER_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Negative values are KiB, positive values are pages
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+
+def _ensure_math_functions(dbapi_connection, connection_record):
+    """Provide ln/tan/cos/floor (used to build map clusters in SQL) where SQLite was built without them"""
+    try:
+        dbapi_connection.execute("SELECT ln(1), tan(0), cos(0), floor(0)")
+    except sqlite3.OperationalError:
+        for name, function in (("ln", math.log), ("tan", math.tan), ("cos", math.cos), ("floor", math.floor)):
+            dbapi_connection.create_function(name, 1, function, deterministic=True)
+
+
+# Leading keywords of raw SQL statements that must run on the writer
+WRITE_KEYWORDS = {"INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER"}
+
+
+def _is_write(clause) -> bool:
+    if isinstance(clause, (Insert, Update, Delete)):
+        return True
+    if isinstance(clause, TextClause):
+        words = clause.text.split(None, 1)
+        return bool(words) and words[0].upper() in WRITE_KEYWORDS
+    return False
+
+
+class RoutingSession(Session):
+    """Session that sends flushes and DML to the writer engine and plain reads to the readers
+
+    Once a transaction has written, its later reads also go to the writer so
+    they see the uncommitted changes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.info.get("writing") or self._flushing or _is_write(clause):
+            self.info["writing"] = True
+            return engine
+        return reader_engine
+
+
+@event.listens_for(RoutingSession, "after_commit")
+@event.listens_for(RoutingSession, "after_rollback")
+def _end_write(session):
+    session.info.pop("writing", None)
+
+
+if DATABASE_URL.startswith("sqlite") and DB_ENGINE_PROFILE == "wal":
+    sqlite_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT}
+    # A single writer connection: writers queue in the pool instead of failing with "database is locked"
+    engine = create_engine(
+        DATABASE_URL, connect_args=sqlite_args, poolclass=QueuePool,
+        pool_size=1, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT
+    )
+    reader_engine = create_engine(
+        DATABASE_URL, connect_args=sqlite_args, poolclass=QueuePool,
+        pool_size=DB_READER_POOL_SIZE, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT
+    )
+    for sqlite_engine in (engine, reader_engine):
+        event.listen(sqlite_engine, "connect", _apply_sqlite_pragmas)
+        event.listen(sqlite_engine, "connect", _ensure_math_functions)
+    SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+elif DATABASE_URL.startswith("sqlite"):
+    engine = reader_engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _ensure_math_functions)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+else:
+    # Server databases handle concurrent writers themselves
+    engine = reader_engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 # Database models
@@ -23,6 +115,10 @@ class User(Base):
     name = Column(String(255), nullable=True)
     bio = Column(Text, nullable=True)
     avatar_url = Column(String(500), nullable=True)
+    # Bumped on every change to the user's locations; drives ETags and delta sync
+    locations_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Newest locations_version whose tombstones have been pruned; older cursors must resync
+    tombstones_pruned_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -40,11 +136,80 @@ class Location(Base):
     description = Column(Text, nullable=True)
     address = Column(Text, nullable=True)
     source_url = Column(String(500), nullable=True)
+    # User's locations_version when this row last changed
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # Relationship with user
     user = relationship("User", back_populates="locations")
+    
+    # Every location query is scoped to one user
+    __table_args__ = (
+        Index("ix_locations_user_id_id", "user_id", "id"),
+        Index("ix_locations_user_id_updated_at", "user_id", "updated_at"),
+        Index("ix_locations_user_id_version", "user_id", "version"),
+    )
+
+class LocationTombstone(Base):
+    """Record of a deleted location, so delta sync can report deletions"""
+    __tablename__ = "location_tombstones"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    location_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index("ix_location_tombstones_user_id_version", "user_id", "version"),
+        Index("ix_location_tombstones_deleted_at", "deleted_at"),
+    )
+
+class LocationCluster(Base):
+    """Precomputed count and coordinate sums of one user's locations in one map grid cell"""
+    __tablename__ = "location_clusters"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    zoom = Column(Integer, primary_key=True)
+    cell_x = Column(Integer, primary_key=True)
+    cell_y = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+    latitude_sum = Column(Float, nullable=False)
+    longitude_sum = Column(Float, nullable=False)
+    representative_id = Column(Integer, nullable=True)
+
+class ClusterState(Base):
+    """locations_version a user's location_clusters rows were last brought up to date with"""
+    __tablename__ = "cluster_state"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False)
+
+class ImportJob(Base):
+    """Progress of one /locations/import upload"""
+    __tablename__ = "import_jobs"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    filename = Column(String(255), nullable=True)
+    format = Column(String(16), nullable=False)
+    # queued | running | done | failed
+    status = Column(String(16), nullable=False, default="queued")
+    rows_read = Column(Integer, nullable=False, default=0)
+    imported = Column(Integer, nullable=False, default=0)
+    geocoded = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    # JSON list of the first row errors
+    errors = Column(Text, nullable=True)
+    # "host:pid" of the worker running the import
+    worker = Column(String(64), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        Index("ix_import_jobs_user_id_id", "user_id", "id"),
+    )
 
 # Create all tables
 def create_tables():
@@ -0,0 +1,112 @@
+# In-process fan-out of location change events to connected clients
+#
+# Each WebSocket subscriber owns a small bounded queue; publishing is a dict
+# lookup plus a put_nowait per connection of that user, so thousands of idle
+# connections cost nothing until one of their users changes something.
+# Endpoints run in the threadpool, so publish() hands events to the event loop
+# with call_soon_threadsafe. Events are dispatched directly only on the worker
+# process that committed the change; to cover changes committed by other
+# workers, watch_versions() polls the locations_version of every user with a
+# connection here, in one query per LOCATION_EVENTS_POLL_INTERVAL, and sends a
+# "changed" event when it moved. Every event carries the user's
+# locations_version so clients can catch up through /locations/changes.
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger("vibesy")
+
+# Events buffered per connection before it is told to resync instead
+LOCATION_EVENTS_QUEUE_SIZE = int(os.getenv("LOCATION_EVENTS_QUEUE_SIZE", "100"))
+# Seconds between checks for changes committed by other worker processes
+LOCATION_EVENTS_POLL_INTERVAL = float(os.getenv("LOCATION_EVENTS_POLL_INTERVAL", "2"))
+# Users whose versions are read per query while polling
+VERSION_POLL_BATCH_SIZE = 500
+
+
+class LocationEventBroker:
+    """Per-user publish/subscribe of location change events"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        # Newest locations_version sent to each subscribed user's connections
+        self._versions: Dict[int, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, user_id: int, version: int = 0) -> asyncio.Queue:
+        """Queue for one connection; ``version`` is the cursor the client was last sent"""
+        # Subscriptions happen on the event loop, which is where events get dispatched
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        self._versions[user_id] = max(self._versions.get(user_id, 0), version)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+                self._versions.pop(user_id, None)
+
+    def connection_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, user_id: int, event: dict):
+        """Queue ``event`` for the user's connections; safe to call from any thread"""
+        loop = self._loop
+        if loop is None or user_id not in self._subscribers or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(user_id, event)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, user_id, event)
+
+    def _dispatch(self, user_id: int, event: dict):
+        if user_id not in self._subscribers:
+            return
+        cursor = event.get("cursor")
+        if cursor is not None:
+            self._versions[user_id] = max(self._versions.get(user_id, 0), cursor)
+        for queue in self._subscribers[user_id]:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: replace its backlog with one resync instruction
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync", "cursor": event.get("cursor")})
+                logger.info(f"Location event queue full for user {user_id}, asking client to resync")
+
+    async def watch_versions(self, read_versions: Callable[[List[int]], Dict[int, int]],
+                             interval: float = LOCATION_EVENTS_POLL_INTERVAL):
+        """Send "changed" events for versions moved by other workers; runs until cancelled
+
+        ``read_versions`` maps user ids to their current locations_version and
+        is called in a thread.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for batch in _batches(list(self._subscribers), VERSION_POLL_BATCH_SIZE):
+                    versions = await asyncio.to_thread(read_versions, batch)
+                    for user_id, version in versions.items():
+                        if version > self._versions.get(user_id, version):
+                            self._dispatch(user_id, {"type": "changed", "cursor": version})
+            except Exception:
+                logger.exception("Polling location versions failed")
+
+
+def _batches(items: List[int], size: int) -> Iterable[List[int]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+location_events = LocationEventBroker(queue_size=LOCATION_EVENTS_QUEUE_SIZE)
@@ -0,0 +1,260 @@
+# Location extraction from OCR text and captions
+#
+# All patterns are compiled once at import. The famous-places alternation is
+# matched with a character trie instead of a 200-way regex alternation, and
+# candidate cleanup uses a precompiled translation table.
+import logging
+import re
+from typing import List
+
+logger = logging.getLogger("vibesy")
+
+# Bump when a change alters the candidates extracted from a text, so cached
+# screenshot results made by the old code are not reused
+EXTRACTION_VERSION = 2
+
+# Famous places and cities, in the priority order of the original regex alternation
+FAMOUS_PLACES = [
+    "New York", "NYC", "Manhattan", "Brooklyn", "San Francisco", "Los Angeles", "LA", "Hollywood",
+    "Paris", "London", "Tokyo", "Rome", "Barcelona", "Amsterdam", "Berlin", "Prague", "Vienna",
+    "Budapest", "Dublin", "Edinburgh", "Stockholm", "Copenhagen", "Madrid", "Athens", "Istanbul",
+    "Dubai", "Bangkok", "Singapore", "Sydney", "Melbourne", "Brisbane", "Perth", "Vancouver",
+    "Toronto", "Montreal", "Chicago", "Miami", "Seattle", "Boston", "Austin", "Portland", "Denver",
+    "Las Vegas", "Honolulu", "Santorini", "Mykonos", "Oia", "Fira", "Bali", "Ubud", "Phuket",
+    "Krabi", "Kyoto", "Seoul", "Hong Kong", "Macau", "Shanghai", "Beijing", "Guangzhou",
+    "Shenzhen", "Hanoi", "Ho Chi Minh", "Saigon", "Manila", "Jakarta", "Kuala Lumpur", "Penang",
+    "Taipei", "Osaka", "Fukuoka", "Busan", "Jeju", "Reykjavik", "Lisbon", "Porto", "Monaco",
+    "Venice", "Florence", "Milan", "Naples", "Zurich", "Geneva", "Marrakech", "Cairo", "Cape Town",
+    "Nairobi", "Rio", "Sao Paulo", "Buenos Aires", "Lima", "Cusco", "Machu Picchu", "Bogota",
+    "Cartagena", "Cancun", "Tulum", "Playa del Carmen", "Mexico City", "San Diego", "Phoenix",
+    "Dallas", "Houston", "Philadelphia", "Washington", "Atlanta", "New Orleans", "Nashville",
+    "Memphis", "Charleston", "Savannah", "Key West", "Napa", "Yosemite", "Yellowstone",
+    "Grand Canyon", "Zion", "Tahoe", "Aspen", "Vail", "Whistler", "Banff", "Queenstown",
+    "Auckland", "Wellington", "Christchurch", "Fiji", "Tahiti", "Maldives", "Seychelles",
+    "Mauritius", "Bora Bora", "Santorini", "Mykonos", "Ibiza", "Mallorca", "Capri", "Amalfi",
+    "Positano", "Cinque Terre", "Dubrovnik", "Split", "Hvar", "Montenegro", "Croatia", "Slovenia",
+    "Lake Como", "Lake Garda", "Swiss Alps", "French Riviera", "Cannes", "Nice", "Monaco",
+    "St Tropez", "Bordeaux", "Lyon", "Marseille", "Strasbourg", "Normandy", "Bruges", "Brussels",
+    "Antwerp", "Luxembourg", "Edinburgh", "Glasgow", "Oxford", "Cambridge", "Bath", "Brighton",
+    "Cornwall", "Lake District", "Yorkshire", "Cotswolds", "Santorini", "Crete", "Rhodes", "Corfu",
+    "Zakynthos", "Paros", "Naxos",
+]
+
+SKIP_WORDS = frozenset({'the', 'and', 'for', 'with', 'this', 'that', 'from', 'have', 'they', 'will', 'what', 'when', 'where', 'your', 'more', 'said', 'each', 'about', 'than', 'having', 'best', 'time', 'next', 'week', 'visiting'})
+
+# Words that boost confidence when they appear in a candidate
+LOCATION_INDICATORS = ('beach', 'park', 'hotel', 'restaurant', 'cafe', 'bay', 'island', 'museum', 'tower', 'square', 'airport', 'station')
+
+# Maximum number of locations returned to the user
+MAX_LOCATIONS = 15
+
+
+def _is_word_char(ch: str) -> bool:
+    # Same definition as \w in a str regex
+    return ch.isalnum() or ch == '_'
+
+
+class PhraseMatcher:
+    """Trie matcher equivalent to ``re.finditer(r'\b(p1|p2|...)\b', text)``
+
+    Like the regex alternation, the earliest listed phrase wins when several
+    match at the same position, and matches never overlap.
+    """
+
+    def __init__(self, phrases: List[str]):
+        self._root = {}
+        for priority, phrase in enumerate(phrases):
+            node = self._root
+            for ch in phrase:
+                node = node.setdefault(ch, {})
+            # Duplicates keep the priority of their first occurrence
+            node.setdefault(None, priority)
+
+    def finditer(self, text: str):
+        root = self._root
+        length = len(text)
+        i = 0
+        while i < length:
+            if text[i] in root and (i == 0 or not _is_word_char(text[i - 1])) and _is_word_char(text[i]):
+                node = root
+                best = None
+                j = i
+                while j < length and text[j] in node:
+                    node = node[text[j]]
+                    j += 1
+                    priority = node.get(None)
+                    if priority is not None and (j == length or not _is_word_char(text[j])):
+                        if best is None or priority < best[0]:
+                            best = (priority, j)
+                if best is not None:
+                    yield text[i:best[1]]
+                    i = best[1]
+                    continue
+            i += 1
+
+
+def _compile(pattern: str, confidence: float):
+    # Low-confidence patterns are matched case-insensitively
+    return re.compile(pattern, re.IGNORECASE if confidence < 0.8 else 0)
+
+
+# Enhanced patterns with broader matching, compiled once
+PATTERNS = [
+    # Location emoji followed by text (highest priority)
+    (_compile(r'📍\s*([^\n📍🏠🌴🏖️🎭🍕☕🗺️🏛️]{3,150})', 0.95), 0.95),
+    # Other location emojis
+    (_compile(r'[🏠🌴🏖️🎭🍕☕🗺️🏛️🏨🏰🗼🌉🏙️🌆]\s*([^\n📍🏠🌴🏖️🎭🍕☕🗺️🏛️]{3,150})', 0.9), 0.9),
+    # Explicit location keywords (multilingual)
+    (_compile(r'(?:Location|Address|Place|Venue|Located at|Visit|Check out|At|Visiting|Địa chỉ|位置|場所|위치|Ubicación|Adresse|Indirizzo|Endereço|地址|Lokasi|สถานที่)[\s:]+([^\n]{5,150})', 0.92), 0.92),
+    # City, Country format (improved to catch more variations)
+    (_compile(r'\b([A-ZÀ-Ž][a-zA-ZÀ-ž\s\-\']{2,45},\s*[A-ZÀ-Ž][a-zA-ZÀ-ž\s\-\']{2,45})\b', 0.88), 0.88),
+    # Famous places and cities (expanded list with more global locations)
+    (PhraseMatcher(FAMOUS_PLACES), 0.93),
+    # Places with type suffix (improved and expanded)
+    (_compile(r'\b([A-ZÀ-Ž][a-zA-ZÀ-ž\s\-\']{2,60}\s+(?:Beach|Beaches|Park|Parks|Tower|Towers|Museum|Museums|Temple|Temples|Castle|Castles|Palace|Palaces|Fort|Forts|Cathedral|Cathedrals|Church|Churches|Mosque|Mosques|Shrine|Shrines|Monastery|Monasteries|Square|Squares|Plaza|Plazas|Market|Markets|Bazaar|Bazaars|Bay|Bays|Island|Islands|Lake|Lakes|River|Rivers|Mountain|Mountains|Hill|Hills|Valley|Valleys|Garden|Gardens|Bridge|Bridges|Airport|Airports|Station|Stations|Hotel|Hotels|Resort|Resorts|Restaurant|Restaurants|Cafe|Cafes|Bistro|Bistros|Bar|Bars|Pub|Pubs|Club|Clubs|Mall|Malls|Center|Centre|Centers|Centres|Village|Villages|Town|Towns|City|Cities|Waterfall|Waterfalls|Canyon|Canyons|Pier|Piers|Harbor|Harbour|Marina|Marinas|Port|Ports|Zoo|Zoos|Aquarium|Aquariums|Stadium|Stadiums|Arena|Arenas|Theater|Theatre|Spa|Spas|Winery|Wineries|Vineyard|Vineyards|Brewery|Breweries|Distillery|Distilleries|Bakery|Bakeries|Deli|Delis|Lounge|Lounges|Gallery|Galleries|Library|Libraries|University|Universities|College|Colleges|Hospital|Hospitals|Clinic|Clinics))\b', 0.89), 0.89),
+    # Preposition + Location (improved with more prepositions)
+    (_compile(r'(?:at|in|from|to|visiting|near|around|by|beside|next to|across from|opposite|behind|@)\s+(?:the\s+)?([A-ZÀ-Ž][a-zA-ZÀ-ž\s,\-\'&]{3,80})', 0.78), 0.78),
+    # Street addresses (numbers + street names) - improved
+    (_compile(r'\b(\d+\s+[A-ZÀ-Ž][a-zA-ZÀ-ž\s\-\']{3,60}(?:Street|St\.?|Avenue|Ave\.?|Road|Rd\.?|Boulevard|Blvd\.?|Lane|Ln\.?|Drive|Dr\.?|Way|Court|Ct\.?|Place|Pl\.?|Terrace|Ter\.?|Circle|Cir\.?))\b', 0.84), 0.84),
+    # Hashtags with location names (common on social media)
+    (_compile(r'#([A-ZÀ-Ž][a-zA-ZÀ-ž]{3,30}(?:[A-Z][a-zA-ZÀ-ž]{2,30})*)', 0.72), 0.72),
+    # Multiple capitalized words (potential location names)
+    (_compile(r'\b([A-ZÀ-Ž][a-zA-ZÀ-ž]+(?:\s+[A-ZÀ-Ž][a-zA-ZÀ-ž]+){1,5})\b', 0.65), 0.65),
+    # @ mentions that might be places (e.g., @CentralPark)
+    (_compile(r'@([A-ZÀ-Ž][a-zA-ZÀ-ž0-9_]{2,40})', 0.68), 0.68),
+]
+
+
+def _finditer(matcher, text: str):
+    if isinstance(matcher, PhraseMatcher):
+        yield from matcher.finditer(text)
+    else:
+        for match in matcher.finditer(text):
+            yield match.group(1)
+
+
+_KEEP_CHAR = re.compile(r'[\w\s,.\-\'À-ÿĀ-ſƀ-ɏḀ-ỿ一-龯ぁ-ゟァ-ヿ가-힣]')
+
+
+class _CleanupTable(dict):
+    """str.translate table deleting characters outside the allowed set, filled lazily per code point"""
+
+    def __missing__(self, codepoint: int):
+        value = codepoint if _KEEP_CHAR.match(chr(codepoint)) else None
+        self[codepoint] = value
+        return value
+
+
+_CLEANUP_TABLE = _CleanupTable()
+
+
+def clean_candidate(text: str) -> str:
+    """Normalize spaces and drop characters that cannot be part of a place name"""
+    return ' '.join(text.split()).translate(_CLEANUP_TABLE).strip()
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def dedupe_locations(locations: List[dict]) -> List[dict]:
+    """Remove duplicates and overlapping names, keeping the most confident/specific one
+
+    Kept names are indexed by trigram, so finding the first kept name that
+    contains or is contained in a candidate only checks names sharing a trigram
+    with it instead of scanning every kept name.
+    """
+    kept = {}            # insertion sequence -> (location, lowercased name), in insertion order
+    kept_names = {}      # lowercased name -> sequence
+    containing = {}      # trigram -> sequences of kept names containing it
+    leading = {}         # trigram -> sequences of kept names starting with it
+
+    def drop(seq: int):
+        _, name = kept.pop(seq)
+        del kept_names[name]
+        leading[name[:3]].discard(seq)
+        for trigram in _trigrams(name):
+            containing[trigram].discard(seq)
+
+    # Sort by confidence first
+    for seq, loc in enumerate(sorted(locations, key=lambda x: x["confidence"], reverse=True)):
+        loc_lower = loc["name"].lower().strip()
+
+        # Skip if already seen or too short
+        if loc_lower in kept_names or len(loc_lower) < 3:
+            continue
+
+        loc_trigrams = _trigrams(loc_lower)
+        overlapping = []
+
+        # Kept names containing this one contain all of its trigrams; check the rarest bucket
+        buckets = [containing.get(trigram) for trigram in loc_trigrams]
+        if all(buckets):
+            overlapping.extend(s for s in min(buckets, key=len) if loc_lower in kept[s][1])
+
+        # Kept names contained in this one start with one of its trigrams
+        for trigram in loc_trigrams:
+            bucket = leading.get(trigram)
+            if bucket:
+                overlapping.extend(s for s in bucket if kept[s][1] in loc_lower)
+
+        if overlapping:
+            # The earliest kept overlapping name decides (keep longer, more specific one)
+            existing_seq = min(overlapping)
+            existing, existing_lower = kept[existing_seq]
+            if loc["confidence"] < existing["confidence"]:
+                continue
+            if loc["confidence"] == existing["confidence"] and len(loc_lower) <= len(existing_lower):
+                continue
+            drop(existing_seq)
+
+        kept[seq] = (loc, loc_lower)
+        kept_names[loc_lower] = seq
+        leading.setdefault(loc_lower[:3], set()).add(seq)
+        for trigram in loc_trigrams:
+            containing.setdefault(trigram, set()).add(seq)
+
+    return [loc for loc, _ in kept.values()]
+
+
+def extract_locations_from_text(text: str) -> List[dict]:
+    """Extract location mentions from text using improved pattern matching"""
+    locations = []
+    logger.info(f"Extracting locations from text (length: {len(text)})")
+
+    for matcher, confidence in PATTERNS:
+        for raw in _finditer(matcher, text):
+            location_text = clean_candidate(raw)
+
+            # Check if text starts or ends with common non-location words
+            location_lower = location_text.lower()
+            words = location_lower.split()
+            if words and (words[0] in SKIP_WORDS or words[-1] in SKIP_WORDS):
+                # If starts/ends with skip word and confidence is low, skip it
+                if confidence < 0.9:
+                    continue
+
+            if location_lower in SKIP_WORDS:
+                continue
+
+            # Validate length and content quality
+            if 3 <= len(location_text) <= 100:
+                # Boost confidence if it contains location indicators; like the original
+                # implementation, the boost carries over to later matches of the same pattern
+                if any(word in location_lower for word in LOCATION_INDICATORS):
+                    confidence = min(confidence + 0.1, 0.98)
+
+                locations.append({
+                    "name": location_text,
+                    "confidence": confidence,
+                    "source": "text_pattern"
+                })
+
+    # Remove duplicates and filter false positives
+    unique_locations = dedupe_locations(locations)
+
+    # Limit to top 15 most confident locations to avoid overwhelming the user
+    unique_locations = sorted(unique_locations, key=lambda x: x["confidence"], reverse=True)[:MAX_LOCATIONS]
+
+    logger.info(f"Found {len(unique_locations)} unique locations after deduplication")
+    return unique_locations
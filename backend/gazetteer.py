@@ -0,0 +1,183 @@
+# Offline gazetteer: instant coordinates for well-known places
+#
+# Names and aliases are kept in one sorted key list with parallel arrays for the
+# place data, so exact and prefix lookups are a binary search with no network
+# call. The bundled data/gazetteer.tsv covers the famous places the extractor
+# knows about; GeoNames dumps (e.g. cities15000.txt) can be added through
+# GAZETTEER_EXTRA_PATHS to cover many more.
+#
+# Lookups are case-insensitive, except for names that are easily hit by
+# accident: names of SHORT_NAME_LENGTH characters or fewer ("LA", "KL") only
+# match with their exact casing, and names that are also common words
+# ("Nice", "Split") only match a capitalised query, unless the query is
+# qualified with the country.
+import logging
+import os
+from array import array
+from bisect import bisect_left
+from typing import List, Optional
+
+from cache import normalize_geocode_query
+
+logger = logging.getLogger("vibesy")
+
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.tsv")
+)
+# Extra gazetteer files (bundled format or GeoNames dump), separated by os.pathsep
+GAZETTEER_EXTRA_PATHS = [path for path in os.getenv("GAZETTEER_EXTRA_PATHS", "").split(os.pathsep) if path]
+
+# Column count of a GeoNames "geoname" table dump
+GEONAMES_COLUMNS = 19
+
+# Names this short only match with their exact casing
+SHORT_NAME_LENGTH = 3
+
+# Place names that are also everyday words in captions; they only match when capitalised
+COMMON_WORDS = frozenset({
+    'bath', 'split', 'nice', 'canton', 'rio', 'como', 'reading', 'mobile', 'hope', 'orange',
+    'eagle', 'bend', 'march', 'may', 'deal', 'wells', 'rugby', 'cork', 'china', 'turkey',
+    'chad', 'sale', 'grant', 'independence', 'liberty', 'union', 'concord', 'harmony',
+    'paradise', 'providence', 'surprise', 'normal', 'mar', 'sol',
+})
+
+# How a gazetteer key must be matched, beyond case-insensitive equality
+ANY_CASE, EXACT_CASE, CAPITALISED = 0, 1, 2
+
+
+class Gazetteer:
+    """Array-backed place index with exact and prefix lookup"""
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.countries: List[str] = []
+        self.country_codes: List[str] = []
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.populations = array('q')
+        # Sorted (key, place index, match rule, original spelling) entries, split into parallel sequences
+        self._keys: List[str] = []
+        self._places = array('i')
+        self._rules = array('b')
+        self._spellings: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _add_place(self, name: str, aliases: List[str], latitude: float, longitude: float,
+                   country_code: str, country: str, population: int, keys: list):
+        index = len(self.names)
+        self.names.append(name)
+        self.countries.append(country)
+        self.country_codes.append(country_code)
+        self.latitudes.append(latitude)
+        self.longitudes.append(longitude)
+        self.populations.append(population)
+        seen = set()
+        for spelling in [name, *aliases]:
+            spelling = _spelling(spelling)
+            if not spelling or spelling in seen:
+                continue
+            seen.add(spelling)
+            key = normalize_geocode_query(spelling)
+            if len(key) <= SHORT_NAME_LENGTH:
+                keys.append((key, index, EXACT_CASE, spelling))
+            elif key in COMMON_WORDS:
+                keys.append((key, index, CAPITALISED, ""))
+            else:
+                keys.append((key, index, ANY_CASE, ""))
+
+    def load(self, paths: List[str]):
+        """Load gazetteer files and (re)build the sorted key index"""
+        keys = list(zip(self._keys, self._places, self._rules, self._spellings))
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip() or line.startswith("#"):
+                        continue
+                    cols = line.rstrip("\n").split("\t")
+                    if len(cols) >= GEONAMES_COLUMNS:
+                        # geonameid, name, asciiname, alternatenames, lat, lon, ..., country code (8), ..., population (14)
+                        aliases = [cols[2]] + cols[3].split(",")
+                        self._add_place(cols[1], aliases, float(cols[4]), float(cols[5]),
+                                        cols[8], cols[8], int(cols[14] or 0), keys)
+                    else:
+                        name, aliases, latitude, longitude, country_code, country, population = cols[:7]
+                        self._add_place(name, aliases.split(","), float(latitude), float(longitude),
+                                        country_code, country, int(population or 0), keys)
+        keys.sort()
+        self._keys = [key for key, _, _, _ in keys]
+        self._places = array('i', (index for _, index, _, _ in keys))
+        self._rules = array('b', (rule for _, _, rule, _ in keys))
+        self._spellings = [spelling for _, _, _, spelling in keys]
+        logger.info(f"Loaded gazetteer with {len(self.names)} places and {len(self._keys)} names")
+
+    def _place(self, index: int) -> dict:
+        return {
+            "name": self.names[index],
+            "latitude": self.latitudes[index],
+            "longitude": self.longitudes[index],
+            "country": self.countries[index],
+            "country_code": self.country_codes[index],
+            "address": f"{self.names[index]}, {self.countries[index]}",
+        }
+
+    def _best(self, indexes) -> Optional[int]:
+        # Prefer the most populous place when a name is ambiguous
+        return max(indexes, key=lambda i: self.populations[i], default=None)
+
+    def _exact_indexes(self, query: str, any_case: bool = False) -> List[int]:
+        """Places with ``query`` as a name or alias, applying each name's case rule unless ``any_case``"""
+        spelling = _spelling(query)
+        key = normalize_geocode_query(spelling)
+        start = bisect_left(self._keys, key)
+        indexes = []
+        for position in range(start, len(self._keys)):
+            if self._keys[position] != key:
+                break
+            rule = self._rules[position]
+            if any_case or rule == ANY_CASE \
+                    or (rule == EXACT_CASE and spelling == self._spellings[position]) \
+                    or (rule == CAPITALISED and spelling[:1].isupper()):
+                indexes.append(self._places[position])
+        return indexes
+
+    def lookup(self, query: str) -> Optional[dict]:
+        """Exact match on a name or alias, optionally qualified as "Name, Country" """
+        best = self._best(self._exact_indexes(query))
+        if best is None and "," in query:
+            name, _, qualifier = query.rpartition(",")
+            qualifier = normalize_geocode_query(qualifier)
+            # The country makes an ambiguous name deliberate, so any casing matches
+            best = self._best(
+                i for i in self._exact_indexes(name, any_case=True)
+                if qualifier in (self.countries[i].casefold(), self.country_codes[i].casefold())
+            )
+        return self._place(best) if best is not None else None
+
+    def prefix(self, query: str, limit: int = 5) -> List[dict]:
+        """Places whose name or alias starts with ``query``, most populous first"""
+        key = normalize_geocode_query(query)
+        if not key:
+            return []
+        start = bisect_left(self._keys, key)
+        matches = set()
+        for position in range(start, len(self._keys)):
+            if not self._keys[position].startswith(key):
+                break
+            matches.add(self._places[position])
+        best = sorted(matches, key=lambda i: self.populations[i], reverse=True)[:limit]
+        return [self._place(i) for i in best]
+
+
+def _spelling(name: str) -> str:
+    """A name as written, with whitespace collapsed and edge punctuation removed"""
+    return " ".join(name.split()).strip(" .,;:!?-'\"")
+
+
+gazetteer = Gazetteer()
+try:
+    gazetteer.load([GAZETTEER_PATH, *GAZETTEER_EXTRA_PATHS])
+except OSError as e:
+    logger.warning(f"Gazetteer not loaded: {e}")
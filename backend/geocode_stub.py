@@ -0,0 +1,36 @@
+# Local stand-in for the Nominatim search API
+#
+# Serves Nominatim-shaped /search responses from fixtures so the parse
+# pipeline can be tested and benchmarked offline at realistic concurrency:
+#
+#   uvicorn geocode_stub:app --port 8001
+#   GEOCODER_BASE_URL=http://localhost:8001 GEOCODE_RATE_LIMIT=0 uvicorn main:app
+import asyncio
+import json
+import os
+
+from fastapi import FastAPI
+
+from cache import normalize_geocode_query
+
+FIXTURES_PATH = os.getenv(
+    "GEOCODE_STUB_FIXTURES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "nominatim_search.json")
+)
+# Simulated upstream latency, to benchmark the client under realistic conditions
+STUB_LATENCY_MS = float(os.getenv("GEOCODE_STUB_LATENCY_MS", "0"))
+
+with open(FIXTURES_PATH, encoding="utf-8") as f:
+    FIXTURES = {normalize_geocode_query(query): results for query, results in json.load(f).items()}
+
+app = FastAPI(title="Vibesy geocoder stub")
+
+@app.get("/search")
+async def search(q: str, limit: int = 10, format: str = "json", addressdetails: int = 0):
+    if STUB_LATENCY_MS:
+        await asyncio.sleep(STUB_LATENCY_MS / 1000)
+    return FIXTURES.get(normalize_geocode_query(q), [])[:limit]
+
+@app.get("/status")
+def status():
+    return {"status": "OK", "fixtures": len(FIXTURES)}
@@ -0,0 +1,260 @@
+# Geocoding for Vibesy: place names to coordinates
+#
+# Well-known places are answered by the offline gazetteer. Other lookups go
+# through the shared geocode cache first; only misses reach the
+# network, and queries without a match are cached as negative results.
+# Outbound calls share one token bucket and identical in-flight lookups are
+# coalesced, so concurrent requests never exceed the Nominatim usage policy.
+# Address autocomplete (search_places) follows the same path with result lists,
+# and additionally debounces each client's rapid successive queries.
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import httpx
+
+from cache import geocode_cache, geocode_search_cache, normalize_geocode_query
+from gazetteer import gazetteer
+from ratelimit import Debouncer, SingleFlight, SQLiteTokenBucket, TokenBucket
+
+logger = logging.getLogger("vibesy")
+
+USER_AGENT = "Vibesy/1.0 (contact@vibesy.app)"
+
+# Geocoding backend; point GEOCODER_BASE_URL at geocode_stub to work offline
+GEOCODER_BACKEND = os.getenv("GEOCODER_BACKEND", "nominatim")
+GEOCODER_BASE_URL = os.getenv("GEOCODER_BASE_URL", "https://nominatim.openstreetmap.org")
+GEOCODER_TIMEOUT = float(os.getenv("GEOCODER_TIMEOUT", "10"))
+GEOCODER_MAX_RETRIES = int(os.getenv("GEOCODER_MAX_RETRIES", "2"))
+GEOCODER_BACKOFF = float(os.getenv("GEOCODER_BACKOFF", "1.0"))
+GEOCODER_MAX_CONNECTIONS = int(os.getenv("GEOCODER_MAX_CONNECTIONS", "10"))
+
+# Nominatim allows at most 1 request per second per application (0 disables limiting)
+GEOCODE_RATE_LIMIT = float(os.getenv("GEOCODE_RATE_LIMIT", "1.0"))
+GEOCODE_BURST = int(os.getenv("GEOCODE_BURST", "1"))
+# sqlite shares the budget across all uvicorn workers; local limits each worker on its own
+GEOCODE_RATE_LIMITER = os.getenv("GEOCODE_RATE_LIMITER", "sqlite")
+
+if GEOCODE_RATE_LIMITER == "local":
+    geocode_limiter = TokenBucket(GEOCODE_RATE_LIMIT, GEOCODE_BURST)
+else:
+    geocode_limiter = SQLiteTokenBucket(GEOCODER_BACKEND, GEOCODE_RATE_LIMIT, GEOCODE_BURST)
+
+# Address autocomplete: seconds a query waits for a follow-up keystroke before
+# going upstream, shortest query sent upstream, and matches fetched per query
+GEOCODE_SEARCH_DEBOUNCE = float(os.getenv("GEOCODE_SEARCH_DEBOUNCE", "0.3"))
+GEOCODE_SEARCH_MIN_CHARS = int(os.getenv("GEOCODE_SEARCH_MIN_CHARS", "3"))
+GEOCODE_SEARCH_FETCH = 10
+
+_inflight = SingleFlight()
+_search_inflight = SingleFlight()
+_search_debouncer = Debouncer(GEOCODE_SEARCH_DEBOUNCE)
+
+
+class GeocodingError(Exception):
+    """Raised when the geocoding service could not be reached or answered with an error."""
+
+
+class Geocoder(ABC):
+    """Geocoding backend interface"""
+
+    @abstractmethod
+    async def search(self, query: str, limit: int = 1) -> List[dict]:
+        """Return up to ``limit`` matches as dicts with latitude, longitude and address"""
+
+    async def aclose(self):
+        pass
+
+
+class NominatimGeocoder(Geocoder):
+    """Nominatim-compatible backend on a pooled keep-alive HTTP client
+
+    Any server speaking the Nominatim ``/search`` API works, including the
+    bundled ``geocode_stub`` server used for offline testing and benchmarks.
+    """
+
+    def __init__(self, base_url: str, limiter=None, timeout: float = 10.0, max_retries: int = 2,
+                 backoff: float = 1.0, max_connections: int = 10):
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Pooled connections belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"User-Agent": USER_AGENT},
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def search(self, query: str, limit: int = 1) -> List[dict]:
+        params = {"q": query, "format": "json", "limit": limit, "addressdetails": 1}
+        last_error = None
+        for attempt in range(self.max_retries):
+            # Every attempt, including retries, spends a token from the shared budget
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            try:
+                logger.info(f"Geocoding '{query}' (attempt {attempt + 1}/{self.max_retries})")
+                response = await self._get_client().get("/search", params=params)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise GeocodingError(f"Geocoder returned HTTP {response.status_code}")
+                response.raise_for_status()
+                return [
+                    {
+                        "latitude": float(result["lat"]),
+                        "longitude": float(result["lon"]),
+                        "address": result.get("display_name", query)
+                    }
+                    for result in response.json()
+                ]
+            except httpx.HTTPStatusError as e:
+                # Other 4xx answers will not improve on retry
+                raise GeocodingError(str(e))
+            except (httpx.TransportError, GeocodingError, ValueError) as e:
+                logger.error(f"Geocoding error for '{query}': {e}")
+                last_error = e
+                if attempt < self.max_retries - 1:
+                    await asyncio.sleep(self.backoff * (2 ** attempt))  # Exponential backoff
+        raise GeocodingError(str(last_error))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+GEOCODER_BACKENDS = {
+    "nominatim": NominatimGeocoder,
+}
+
+
+def create_geocoder(backend: str) -> Geocoder:
+    """The configured geocoding backend; raises ValueError for an unknown backend name"""
+    if backend not in GEOCODER_BACKENDS:
+        raise ValueError(
+            f"Unknown GEOCODER_BACKEND {backend!r}; valid backends: {', '.join(sorted(GEOCODER_BACKENDS))}"
+        )
+    return GEOCODER_BACKENDS[backend](
+        GEOCODER_BASE_URL,
+        limiter=geocode_limiter if GEOCODE_RATE_LIMIT > 0 else None,
+        timeout=GEOCODER_TIMEOUT,
+        max_retries=GEOCODER_MAX_RETRIES,
+        backoff=GEOCODER_BACKOFF,
+        max_connections=GEOCODER_MAX_CONNECTIONS,
+    )
+
+
+geocoder: Geocoder = create_geocoder(GEOCODER_BACKEND)
+
+
+def set_geocoder(backend: Geocoder):
+    """Swap the geocoding backend (e.g. for tests)"""
+    global geocoder
+    geocoder = backend
+
+
+async def close_geocoder():
+    await geocoder.aclose()
+
+
+async def _lookup(location_name: str) -> Optional[dict]:
+    """Geocode through the backend and store the outcome in the cache"""
+    results = await geocoder.search(location_name, limit=1)
+    result = results[0] if results else None
+    if result:
+        logger.info(f"Successfully geocoded '{location_name}' to ({result['latitude']}, {result['longitude']})")
+    else:
+        logger.warning(f"No geocoding results for '{location_name}'")
+    try:
+        await asyncio.to_thread(geocode_cache.put, location_name, result)
+    except Exception as e:
+        logger.warning(f"Geocode cache store failed for '{location_name}': {e}")
+    return result
+
+
+async def geocode_location(location_name: str) -> dict:
+    """Geocode a location name to get coordinates, answering from the cache when possible"""
+    # Well-known places resolve from the in-memory gazetteer without any I/O
+    place = gazetteer.lookup(location_name)
+    if place is not None:
+        return {
+            "latitude": place["latitude"],
+            "longitude": place["longitude"],
+            "address": place["address"],
+            "geocoded": True
+        }
+
+    try:
+        hit, result = await asyncio.to_thread(geocode_cache.get, location_name)
+    except Exception as e:
+        logger.warning(f"Geocode cache lookup failed for '{location_name}': {e}")
+        hit, result = False, None
+
+    if not hit:
+        try:
+            # Concurrent lookups of the same place share one outbound request
+            result = await _inflight.do(normalize_geocode_query(location_name), lambda: _lookup(location_name))
+        except GeocodingError:
+            # Transient failures are not cached so the next request retries
+            return {"geocoded": False}
+
+    if result is None:
+        return {"geocoded": False}
+    return {**result, "geocoded": True}
+
+
+async def _search_lookup(query: str) -> List[dict]:
+    results = await geocoder.search(query, limit=GEOCODE_SEARCH_FETCH)
+    try:
+        await asyncio.to_thread(geocode_search_cache.put, query, results)
+    except Exception as e:
+        logger.warning(f"Geocode search cache store failed for '{query}': {e}")
+    return results
+
+
+async def search_places(query: str, limit: int, client_key=None) -> dict:
+    """Address autocomplete: gazetteer and cached matches first, the geocoder on a miss
+
+    Returns ``results`` (dicts with name, latitude, longitude, address and
+    source) and ``complete``, which is False when the geocoder was skipped
+    because a newer query from ``client_key`` superseded this one or failed.
+    """
+    results = [{**place, "source": "gazetteer"} for place in gazetteer.prefix(query, limit)]
+    key = normalize_geocode_query(query)
+    if len(results) >= limit or len(key) < GEOCODE_SEARCH_MIN_CHARS:
+        return {"results": results[:limit], "complete": True}
+
+    try:
+        cached = await asyncio.to_thread(geocode_search_cache.get, query)
+    except Exception as e:
+        logger.warning(f"Geocode search cache lookup failed for '{query}': {e}")
+        cached = None
+
+    if cached is None:
+        if client_key is not None and not await _search_debouncer.settle(client_key):
+            return {"results": results, "complete": False}
+        try:
+            cached = await _search_inflight.do(key, lambda: _search_lookup(query))
+        except GeocodingError:
+            return {"results": results, "complete": False}
+
+    seen = {(round(r["latitude"], 4), round(r["longitude"], 4)) for r in results}
+    for match in cached:
+        if len(results) >= limit:
+            break
+        if (round(match["latitude"], 4), round(match["longitude"], 4)) not in seen:
+            results.append({"name": match["address"].split(",")[0], **match, "source": "geocoder"})
+    return {"results": results, "complete": True}
@@ -0,0 +1,458 @@
+# Streaming bulk import of location files (CSV, GeoJSON, KML)
+#
+# An upload is spooled to a temporary file and processed by a background task:
+# rows are parsed incrementally, IMPORT_BATCH_SIZE at a time; rows without
+# coordinates are geocoded through geocode_location (cache, gazetteer and the
+# shared rate limit) a few at a time; each batch is saved in one transaction
+# together with the job's progress in import_jobs, which clients poll. Neither
+# the file nor the imported rows are ever held in memory as a whole.
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import ImportJob, SessionLocal
+from events import location_events
+from geocoding import geocode_location
+from sync import added_event, insert_locations
+
+logger = logging.getLogger("vibesy")
+
+IMPORT_FORMATS = ("csv", "geojson", "kml")
+# Rows parsed, geocoded and committed together
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+# Imports processed at once per worker; later ones wait as "queued"
+IMPORT_MAX_CONCURRENT = int(os.getenv("IMPORT_MAX_CONCURRENT", "2"))
+# Geocoding lookups in flight per import (the shared rate limit still applies)
+IMPORT_GEOCODE_CONCURRENCY = int(os.getenv("IMPORT_GEOCODE_CONCURRENCY", "4"))
+# Row errors kept on the job
+MAX_IMPORT_ERRORS = 100
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Accepted column / property names, lower-cased, per location field
+FIELD_ALIASES = {
+    "name": ("name", "title", "place", "place name"),
+    "latitude": ("latitude", "lat", "y"),
+    "longitude": ("longitude", "lon", "lng", "long", "x"),
+    "description": ("description", "note", "notes", "comment"),
+    "address": ("address", "location", "full address"),
+    "source_url": ("source_url", "url", "link", "google maps url"),
+}
+
+_FEATURES_ARRAY = re.compile(r'"features"\s*:\s*\[')
+
+# Recorded on the jobs this process runs, so that a worker starting up can tell
+# jobs abandoned by an exited worker from jobs other workers are still running
+WORKER_HOST = socket.gethostname()[:48]
+WORKER_ID = f"{WORKER_HOST}:{os.getpid()}"
+WORKER_RESTARTED_ERROR = "Import interrupted: the worker restarted (rows saved before then were kept)"
+
+_slots: Optional[asyncio.Semaphore] = None
+_tasks = set()
+
+
+class ImportTooLarge(Exception):
+    """Raised when an upload exceeds IMPORT_MAX_BYTES."""
+
+
+def detect_format(filename: Optional[str], requested: Optional[str] = None) -> str:
+    """The import format from ``requested`` or the file extension; ValueError if unsupported"""
+    if requested:
+        fmt = requested.lower()
+    else:
+        extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+        fmt = {"json": "geojson", "geojsonl": "geojson", "ndjson": "geojson"}.get(extension, extension)
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format; use one of: {', '.join(IMPORT_FORMATS)}")
+    return fmt
+
+
+async def spool_upload(upload) -> str:
+    """Copy an UploadFile to a temporary file in chunks and return its path"""
+    spool = tempfile.NamedTemporaryFile(prefix="vibesy-import-", delete=False)
+    size = 0
+    try:
+        with spool:
+            while True:
+                chunk = await upload.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > IMPORT_MAX_BYTES:
+                    raise ImportTooLarge(f"Import files are limited to {IMPORT_MAX_BYTES // (1024 * 1024)}MB")
+                await asyncio.to_thread(spool.write, chunk)
+    except BaseException:
+        os.unlink(spool.name)
+        raise
+    return spool.name
+
+
+def _pick(record: dict) -> dict:
+    lowered = {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+    picked = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            value = lowered.get(alias)
+            if value not in (None, ""):
+                picked[field] = value
+                break
+    return picked
+
+
+def iter_csv(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for record in csv.DictReader(f):
+            yield _pick(record)
+
+
+def _iter_json_values(f, buffer: str) -> Iterator[dict]:
+    """Decode consecutive JSON values separated by whitespace, commas or record separators, until ']'"""
+    decoder = json.JSONDecoder()
+    eof = False
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,\x1e")
+        if not buffer:
+            if eof:
+                return
+            chunk = f.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        if buffer[0] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Malformed GeoJSON") from None
+            chunk = f.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield value
+        buffer = buffer[end:]
+
+
+def _feature_row(feature: dict) -> dict:
+    if not isinstance(feature, dict):
+        return {}
+    properties = feature.get("properties") or {}
+    geometry = feature.get("geometry") or {}
+    if not isinstance(properties, dict):
+        return {"error": "properties must be an object"}
+    if not isinstance(geometry, dict):
+        return {"error": "geometry must be an object"}
+    row = _pick(properties)
+    if geometry.get("type") == "Point" and len(geometry.get("coordinates") or ()) >= 2:
+        row["longitude"], row["latitude"] = geometry["coordinates"][:2]
+    return row
+
+
+def iter_geojson(path: str) -> Iterator[dict]:
+    """Features of a FeatureCollection, or of newline-delimited GeoJSON, one at a time"""
+    with open(path, encoding="utf-8-sig") as f:
+        buffer = ""
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            buffer += chunk
+            match = _FEATURES_ARRAY.search(buffer)
+            if match:
+                # A FeatureCollection: stream the members of its features array
+                values = _iter_json_values(f, buffer[match.end():])
+                break
+            if not chunk or len(buffer) > READ_CHUNK_SIZE * 16:
+                # No features array near the start: a sequence of Feature objects
+                values = _iter_json_values(f, buffer)
+                break
+        for value in values:
+            if isinstance(value, dict) and value.get("type") == "FeatureCollection":
+                for feature in value.get("features") or ():
+                    yield _feature_row(feature)
+            else:
+                yield _feature_row(value)
+
+
+def iter_kml(path: str) -> Iterator[dict]:
+    """Placemarks of a KML document, freeing each one once read"""
+    # Open elements, outermost first, so a finished Placemark can be detached from its parent
+    open_elements = []
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            open_elements.append(element)
+            continue
+        open_elements.pop()
+        if not element.tag.endswith("Placemark"):
+            continue
+        row = {
+            "name": element.findtext("{*}name"),
+            "description": element.findtext("{*}description"),
+            "address": element.findtext("{*}address"),
+        }
+        coordinates = element.findtext(".//{*}Point/{*}coordinates")
+        if coordinates:
+            parts = coordinates.strip().split(",")
+            if len(parts) >= 2:
+                row["longitude"], row["latitude"] = parts[0], parts[1]
+        element.clear()
+        if open_elements:
+            open_elements[-1].remove(element)
+        yield {key: value.strip() if isinstance(value, str) else value for key, value in row.items() if value}
+
+
+PARSERS = {"csv": iter_csv, "geojson": iter_geojson, "kml": iter_kml}
+
+
+def _text(raw: dict, field: str) -> Optional[str]:
+    """A text field as a stripped string (numbers are accepted); ValueError for lists and objects"""
+    value = raw.get(field)
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        raise ValueError(f"{field} must be text")
+    return str(value).strip() or None
+
+
+def normalize_row(raw: dict) -> dict:
+    """Validate a parsed row; latitude and longitude are None when it needs geocoding"""
+    # Parsers report rows they could not read under "error"
+    if raw.get("error"):
+        raise ValueError(raw["error"])
+    address = _text(raw, "address")
+    name = _text(raw, "name") or address
+    if not name:
+        raise ValueError("missing name")
+    latitude, longitude = raw.get("latitude"), raw.get("longitude")
+    if (latitude is None) != (longitude is None):
+        raise ValueError("latitude and longitude must be given together")
+    if latitude is not None:
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            raise ValueError("coordinates are not numbers")
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError("coordinates are out of range")
+    source_url = _text(raw, "source_url")
+    return {
+        "name": name[:255],
+        "latitude": latitude,
+        "longitude": longitude,
+        "description": _text(raw, "description"),
+        "address": address,
+        "source_url": source_url if source_url and len(source_url) <= 500 else None,
+    }
+
+
+class _Progress:
+    def __init__(self):
+        self.rows_read = 0
+        self.imported = 0
+        self.geocoded = 0
+        self.skipped = 0
+        self.errors: List[dict] = []
+
+    def error(self, row: int, message: str):
+        self.skipped += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+
+def _next_batch(rows: Iterator[dict], size: int) -> List[dict]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            break
+    return batch
+
+
+def _update_job(db, job_id: int, progress: _Progress, status: Optional[str] = None, imported: int = 0):
+    # ``imported`` counts rows saved in the transaction being committed, not yet in progress
+    job = db.get(ImportJob, job_id)
+    job.rows_read = progress.rows_read
+    job.imported = progress.imported + imported
+    job.geocoded = progress.geocoded
+    job.skipped = progress.skipped
+    job.errors = json.dumps(progress.errors)
+    if status is not None:
+        job.status = status
+        if status in ("done", "failed"):
+            job.finished_at = datetime.now(timezone.utc)
+
+
+def _commit_rows(job_id: int, user_id: int, rows: List[dict], progress: _Progress):
+    """Insert rows and record the job's progress in one transaction"""
+    db = SessionLocal()
+    try:
+        ids, version = insert_locations(db, user_id, rows) if rows else ([], None)
+        _update_job(db, job_id, progress, imported=len(ids))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    progress.imported += len(ids)
+    if ids:
+        location_events.publish(user_id, added_event(version, ids, rows))
+
+
+def _save_batch(job_id: int, user_id: int, rows: List[dict], numbers: List[int], progress: _Progress):
+    """Save a batch; if the database rejects it, retry its rows one by one and skip the ones it still rejects"""
+    try:
+        _commit_rows(job_id, user_id, rows, progress)
+        return
+    except SQLAlchemyError as e:
+        logger.warning(f"Import {job_id}: batch of {len(rows)} rows rejected, saving them one at a time: {e}")
+    for row, number in zip(rows, numbers):
+        try:
+            _commit_rows(job_id, user_id, [row], progress)
+        except SQLAlchemyError as e:
+            logger.warning(f"Import {job_id}: row {number} rejected: {e}")
+            progress.error(number, "could not be saved")
+
+
+def _set_status(job_id: int, progress: _Progress, status: str):
+    db = SessionLocal()
+    try:
+        _update_job(db, job_id, progress, status)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _geocode_rows(rows: List[dict]) -> List[Optional[dict]]:
+    semaphore = asyncio.Semaphore(IMPORT_GEOCODE_CONCURRENCY)
+
+    async def geocode(row):
+        async with semaphore:
+            return await geocode_location(row["address"] or row["name"])
+
+    return await asyncio.gather(*(geocode(row) for row in rows))
+
+
+async def run_import(job_id: int, user_id: int, path: str, fmt: str):
+    """Process a spooled upload; the temporary file is removed afterwards"""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(IMPORT_MAX_CONCURRENT)
+    progress = _Progress()
+    try:
+        async with _slots:
+            await asyncio.to_thread(_set_status, job_id, progress, "running")
+            rows = PARSERS[fmt](path)
+            while True:
+                batch = await asyncio.to_thread(_next_batch, rows, IMPORT_BATCH_SIZE)
+                if not batch:
+                    break
+                ready, missing = [], []
+                for raw in batch:
+                    progress.rows_read += 1
+                    try:
+                        row = normalize_row(raw)
+                    except ValueError as e:
+                        progress.error(progress.rows_read, str(e))
+                        continue
+                    row["row"] = progress.rows_read
+                    (ready if row["latitude"] is not None else missing).append(row)
+
+                for row, result in zip(missing, await _geocode_rows(missing)):
+                    if result.get("geocoded"):
+                        row["latitude"], row["longitude"] = result["latitude"], result["longitude"]
+                        row["address"] = row["address"] or result.get("address")
+                        progress.geocoded += 1
+                        ready.append(row)
+                    else:
+                        progress.error(row["row"], "could not geocode")
+
+                ready.sort(key=lambda row: row["row"])
+                numbers = [row.pop("row") for row in ready]
+                await asyncio.to_thread(_save_batch, job_id, user_id, ready, numbers, progress)
+        await asyncio.to_thread(_set_status, job_id, progress, "done")
+        logger.info(f"Import {job_id} finished: {progress.imported} imported, {progress.skipped} skipped")
+    except Exception as e:
+        # Only errors describing the file are reported to the client
+        if isinstance(e, (ValueError, ElementTree.ParseError, csv.Error, UnicodeDecodeError)):
+            logger.warning(f"Import {job_id} failed: {e}")
+            message = str(e)
+        else:
+            logger.exception(f"Import {job_id} failed")
+            message = "Import failed, please try again"
+        progress.errors.append({"row": None, "error": message})
+        await asyncio.to_thread(_set_status, job_id, progress, "failed")
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _worker_exited(worker: Optional[str]) -> bool:
+    if not worker:
+        # Created before jobs recorded their worker
+        return True
+    host, _, pid = worker.rpartition(":")
+    if host != WORKER_HOST or not pid.isdigit():
+        # Another machine's workers cannot be checked from here
+        return False
+    if int(pid) == os.getpid():
+        # This process has only just started, so the job was its PID's previous owner's
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def fail_abandoned_jobs() -> int:
+    """Mark queued or running jobs whose worker has exited as failed; returns how many"""
+    db = SessionLocal()
+    try:
+        jobs = db.query(ImportJob).filter(ImportJob.status.in_(("queued", "running"))).all()
+        abandoned = [job for job in jobs if _worker_exited(job.worker)]
+        for job in abandoned:
+            errors = json.loads(job.errors) if job.errors else []
+            errors.append({"row": None, "error": WORKER_RESTARTED_ERROR})
+            job.errors = json.dumps(errors)
+            job.status = "failed"
+            job.finished_at = datetime.now(timezone.utc)
+        db.commit()
+        return len(abandoned)
+    finally:
+        db.close()
+
+
+def start_import(job_id: int, user_id: int, path: str, fmt: str):
+    """Run an import in the background on the current event loop"""
+    task = asyncio.get_running_loop().create_task(run_import(job_id, user_id, path, fmt))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def job_to_dict(job: ImportJob) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "format": job.format,
+        "filename": job.filename,
+        "rows_read": job.rows_read,
+        "imported": job.imported,
+        "geocoded": job.geocoded,
+        "skipped": job.skipped,
+        "errors": json.loads(job.errors) if job.errors else [],
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
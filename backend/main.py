@@ -1,29 +1,49 @@
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Request
+from fastapi import FastAPI, HTTPException, Depends, Query, status, UploadFile, File, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from passlib.context import CryptContext
+from typing import Any, List, Optional
 from datetime import datetime, timedelta
 import jwt
-import re
-import requests
+import hashlib
+import secrets
 import os
 from dotenv import load_dotenv
-import io
-from PIL import Image
-import pytesseract
 import logging
+import asyncio
+from contextlib import asynccontextmanager
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("vibesy")
 
-# Import database components
-from database import SessionLocal, Base, User as DBUser, Location as DBLocation, create_tables, engine
-
+# Load .env before the modules below read their settings
 load_dotenv()
 
+# Import database components
+from database import SessionLocal, Base, User as DBUser, Location as DBLocation, LocationTombstone, ImportJob, create_tables, engine
+from migrations import run_migrations
+from ocr import OCR_VERSION, OCREngineUnavailable, fingerprint_image, recognize, run_in_ocr_pool, same_screenshot, shutdown_ocr_pool
+from cache import SCREENSHOT_CACHE_MODE, screenshot_cache
+from geocoding import close_geocoder, geocode_location, search_places
+from extraction import EXTRACTION_VERSION, extract_locations_from_text
+from sync import (
+    TOMBSTONE_PRUNE_INTERVAL, TOMBSTONE_RETENTION_DAYS, added_event, current_locations_version, etag_matches,
+    insert_locations, locations_etag, locations_versions, next_locations_version, prune_tombstones, tombstones_pruned_version
+)
+from events import location_events
+from principals import SOCKET_TICKET_TTL, Principal, claim_ticket, principal_cache
+from passwords import PASSWORD_HASH_ROUNDS, PasswordHasherBusy, password_hasher
+from queries import (
+    EXPORT_FORMATS, LOCATION_FIELDS, LOCATION_FORMATS, csv_chunks, fetch_columns, geojson_chunks, iter_rows,
+    json_array_chunks, ndjson_chunks, pack_columns, parse_bbox, parse_fields, parse_search, search_locations,
+    select_locations, stream_locations
+)
+from clusters import MAX_CLUSTER_ZOOM, ensure_clusters, query_clusters, record_location_changes
+from nearby import nearby_index
+from imports import WORKER_ID, ImportTooLarge, detect_format, fail_abandoned_jobs, job_to_dict, spool_upload, start_import
+
 # Dependency to get database session
 def get_db():
     db = SessionLocal()
@@ -41,22 +61,59 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days for convenience
 if SECRET_KEY == "simple-dev-key-for-side-project-CHANGE-IN-PRODUCTION":
     logger.warning("⚠️  Using default SECRET_KEY! Set SECRET_KEY in .env for production!")
 
-# Simple password hashing for side-project (fast and simple)
-pwd_context = CryptContext(
-    schemes=["bcrypt"],
-    deprecated="auto",
-    bcrypt__rounds=4  # Very fast rounds for side-project
-)
-
-# Create database tables
+# Create database tables and apply pending schema migrations
 create_tables()
+run_migrations(engine)
+
+# Imports run inside the worker that received them, so those of an exited worker never finish
+abandoned_imports = fail_abandoned_jobs()
+if abandoned_imports:
+    logger.warning(f"Marked {abandoned_imports} import jobs left unfinished by an exited worker as failed")
 
 # Determine allowed origins based on environment
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 if "*" in ALLOWED_ORIGINS:
     logger.warning("⚠️  CORS allows all origins! Set ALLOWED_ORIGINS in .env for production!")
 
-app = FastAPI(title="Vibesy API", description="Location sharing app with SQLite backend")
+def _prune_tombstones():
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        deleted = prune_tombstones(db, cutoff)
+        if deleted:
+            logger.info(f"Pruned {deleted} location tombstones older than {TOMBSTONE_RETENTION_DAYS:g} days")
+    finally:
+        db.close()
+
+async def _prune_tombstones_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(_prune_tombstones)
+        except Exception:
+            logger.exception("Pruning location tombstones failed")
+        await asyncio.sleep(TOMBSTONE_PRUNE_INTERVAL)
+
+def _read_locations_versions(user_ids):
+    db = SessionLocal()
+    try:
+        return locations_versions(db, user_ids)
+    finally:
+        db.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pruner = asyncio.create_task(_prune_tombstones_periodically())
+    # Changes committed by other workers reach this worker's sockets through the version poll
+    watcher = asyncio.create_task(location_events.watch_versions(_read_locations_versions))
+    yield
+    # Stop background workers and close pooled connections on shutdown
+    pruner.cancel()
+    watcher.cancel()
+    shutdown_ocr_pool()
+    password_hasher.shutdown()
+    await close_geocoder()
+
+app = FastAPI(title="Vibesy API", description="Location sharing app with SQLite backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -64,10 +121,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-After-Id"],
 )
 
 security = HTTPBearer()
 
+# Seconds between keepalive pings on idle /ws/locations connections
+LOCATION_SOCKET_PING_INTERVAL = float(os.getenv("LOCATION_SOCKET_PING_INTERVAL", "30"))
+
+# Largest page GET /locations returns when paginated with ?limit=
+MAX_LOCATIONS_PAGE_SIZE = int(os.getenv("MAX_LOCATIONS_PAGE_SIZE", "1000"))
+
+# Most locations one /locations/nearby request may ask for
+MAX_NEARBY_RESULTS = int(os.getenv("MAX_NEARBY_RESULTS", "100"))
+
+# Upper bound on locations saved by one /locations/from-parsed request
+MAX_BULK_LOCATIONS = int(os.getenv("MAX_BULK_LOCATIONS", "5000"))
+
 # Pydantic models
 class UserRegister(BaseModel):
     email: str
@@ -99,6 +169,20 @@ class Location(BaseModel):
     address: Optional[str] = None
     source_url: Optional[str] = None
 
+class ParsedLocation(BaseModel):
+    name: str = Field(min_length=1, max_length=255)
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    description: Optional[str] = None
+    address: Optional[str] = None
+    source_url: Optional[str] = Field(default=None, max_length=500)
+
+class SaveParsedLocations(BaseModel):
+    # Items are validated one by one as ParsedLocation so errors can be reported per index
+    locations: List[Any]
+    source_info: dict = {}
+    report_errors: bool = False
+
 class ParsedLocationResponse(BaseModel):
     locations: List[dict]
     source_info: dict
@@ -109,29 +193,8 @@ class Token(BaseModel):
     user: dict
 
 # Utility functions
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    # Truncate password if longer than 72 bytes (bcrypt limitation)
-    if len(plain_password.encode('utf-8')) > 72:
-        plain_password = plain_password[:72]
-    # If there's no stored hash, treat as invalid credentials
-    if not hashed_password:
-        logger.warning("Empty password hash for user during verify_password")
-        return False
-    try:
-        return pwd_context.verify(plain_password, hashed_password)
-    except Exception as e:
-        # Handle UnknownHashError from passlib gracefully without requiring static import
-        if e.__class__.__name__ == 'UnknownHashError':
-            logger.warning("Could not identify stored password hash format; rejecting login")
-            return False
-        logger.exception("Unexpected error during password verification: %s", e)
-        return False
-
-def get_password_hash(password: str) -> str:
-    # Truncate password if longer than 72 bytes (bcrypt limitation)
-    if len(password.encode('utf-8')) > 72:
-        password = password[:72]
-    return pwd_context.hash(password)
+def _hasher_busy() -> HTTPException:
+    return HTTPException(status_code=503, detail="Too many sign-ins at once, please retry", headers={"Retry-After": "1"})
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -154,31 +217,67 @@ def _parse_simple_token(token: str):
             return int(parts[1])
     return None
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    token = credentials.credentials
-    
+def get_current_principal(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)) -> Principal:
+    """The request's user as a cached Principal, for endpoints that only need the user's id"""
+    return resolve_principal(credentials.credentials, db)
+
+def get_current_user(principal: Principal = Depends(get_current_principal), db: Session = Depends(get_db)) -> DBUser:
+    """The request's user row, for the profile endpoints"""
+    user = db.get(DBUser, principal.id)
+    if user is None:
+        principal_cache.invalidate_user(principal.id)
+        raise HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+def get_locations_version(principal: Principal = Depends(get_current_principal), db: Session = Depends(get_db)) -> int:
+    """The request user's locations_version, read on its own instead of loading the user row"""
+    version = current_locations_version(db, principal.id)
+    if version is None:
+        principal_cache.invalidate_user(principal.id)
+        raise HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    return version
+
+def resolve_principal(token: str, db: Session) -> Principal:
+    """Return the principal a bearer token belongs to, raising 401 if it is not valid"""
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    user, expires_at = _verify_token(token, db)
+    principal = Principal(id=user.id, email=user.email)
+    principal_cache.put(token, principal, expires_at)
+    return principal
+
+def _get_or_create_demo_user(db: Session) -> DBUser:
+    demo_user = db.query(DBUser).filter(DBUser.email == "demo@vibesy.app").first()
+    if not demo_user:
+        try:
+            # Hashed so /login works for demo too
+            password_hash = password_hasher.hash_blocking("demo")
+        except PasswordHasherBusy:
+            raise _hasher_busy()
+        demo_user = DBUser(
+            email="demo@vibesy.app",
+            password_hash=password_hash,
+            name="Demo User",
+            bio="This is a demo account for testing Vibesy features"
+        )
+        db.add(demo_user)
+        db.commit()
+        db.refresh(demo_user)
+    return demo_user
+
+def _verify_token(token: str, db: Session):
+    """Return (user, token expiry timestamp or None) for a bearer token, raising 401 if it is not valid"""
     # Demo mode - allow "demo" as a token for easy testing
     if token == "demo":
-        # Get or create demo user
-        demo_user = db.query(DBUser).filter(DBUser.email == "demo@vibesy.app").first()
-        if not demo_user:
-            demo_user = DBUser(
-                email="demo@vibesy.app",
-                password_hash=get_password_hash("demo"),  # ensure hashed so /login works for demo
-                name="Demo User",
-                bio="This is a demo account for testing Vibesy features"
-            )
-            db.add(demo_user)
-            db.commit()
-            db.refresh(demo_user)
-        return demo_user
+        return _get_or_create_demo_user(db), None
     
     # Support legacy simple_token_<id>
     simple_id = _parse_simple_token(token)
     if simple_id is not None:
         user = db.query(DBUser).filter(DBUser.id == simple_id).first()
         if user:
-            return user
+            return user, None
         raise HTTPException(status_code=401, detail="Legacy simple token user not found")
 
     credentials_exception = HTTPException(
@@ -207,7 +306,7 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     user = db.query(DBUser).filter(DBUser.id == user_id).first()
     if user is None:
         raise credentials_exception
-    return user
+    return user, payload.get("exp")
 
 # API endpoints
 @app.get("/")
@@ -219,27 +318,15 @@ def health_check():
     return {
         "status": "healthy",
         "database": "SQLite",
-        "message": "API is running with SQLite database"
+        "message": "API is running with SQLite database",
+        "auth_cache": {**principal_cache.stats, "hit_rate": round(principal_cache.hit_rate(), 3)},
+        "password_hashing": {**password_hasher.stats, "queue_depth": password_hasher.queue_depth()}
     }
 
-@app.post("/register", response_model=Token)
-def register(user: UserRegister, db: Session = Depends(get_db)):
-    # Check if user already exists
-    db_user = db.query(DBUser).filter(DBUser.email == user.email).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create new user
-    hashed_password = get_password_hash(user.password)
-    db_user = DBUser(
-        email=user.email,
-        password_hash=hashed_password,
-        name=user.email.split("@")[0]  # Default name from email
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    
+def _find_user_by_email(db: Session, email: str) -> Optional[DBUser]:
+    return db.query(DBUser).filter(DBUser.email == email).first()
+
+def _token_response(db_user: DBUser) -> dict:
     # Create access token (ensure sub stored as int consistently)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -256,44 +343,59 @@ def register(user: UserRegister, db: Session = Depends(get_db)):
         }
     }
 
+def _create_user(db: Session, email: str, password_hash: str) -> dict:
+    db_user = DBUser(
+        email=email,
+        password_hash=password_hash,
+        name=email.split("@")[0]  # Default name from email
+    )
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return _token_response(db_user)
+
+def _store_password_hash(db: Session, db_user: DBUser, password_hash: str):
+    db_user.password_hash = password_hash
+    db.commit()
+    db.refresh(db_user)
+
+# Hashing awaits the password pool, so register and login are async and keep
+# their database calls off the event loop with to_thread
+@app.post("/register", response_model=Token)
+async def register(user: UserRegister, db: Session = Depends(get_db)):
+    # Check if user already exists
+    if await asyncio.to_thread(_find_user_by_email, db, user.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+    return await asyncio.to_thread(_create_user, db, user.email, hashed_password)
+
 @app.post("/login", response_model=Token)
-def login(user: UserLogin, db: Session = Depends(get_db)):
+async def login(user: UserLogin, db: Session = Depends(get_db)):
     # Authenticate user
-    db_user = db.query(DBUser).filter(DBUser.email == user.email).first()
-    if not db_user or not verify_password(user.password, db_user.password_hash):
+    db_user = await asyncio.to_thread(_find_user_by_email, db, user.email)
+    valid, new_hash = False, None
+    if db_user:
+        try:
+            valid, new_hash = await password_hasher.verify(user.password, db_user.password_hash)
+        except PasswordHasherBusy:
+            raise _hasher_busy()
+    if not valid:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     
-    # Create access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": str(db_user.id)}, expires_delta=access_token_expires  # store integer not string
-    )
-    
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": {
-            "id": db_user.id,
-            "email": db_user.email,
-            "name": db_user.name
-        }
-    }
+    # The stored hash used another cost; replace it while we have the plain password
+    if new_hash is not None:
+        await asyncio.to_thread(_store_password_hash, db, db_user, new_hash)
+        logger.info(f"Rehashed password of user {db_user.id} with {PASSWORD_HASH_ROUNDS} rounds")
+    return _token_response(db_user)
 
 @app.get("/demo-login", response_model=Token)
 def demo_login(db: Session = Depends(get_db)):
     """Easy demo login for side-project testing - no password needed!"""
-    # Get or create demo user
-    demo_user = db.query(DBUser).filter(DBUser.email == "demo@vibesy.app").first()
-    if not demo_user:
-        demo_user = DBUser(
-            email="demo@vibesy.app",
-            password_hash=get_password_hash("demo"),  # ensure hashed so /login works for demo
-            name="Demo User",
-            bio="This is a demo account for testing Vibesy features"
-        )
-        db.add(demo_user)
-        db.commit()
-        db.refresh(demo_user)
+    demo_user = _get_or_create_demo_user(db)
     
     return {
         "access_token": "demo",
@@ -326,29 +428,285 @@ def update_profile(user_data: UserUpdate, current_user: DBUser = Depends(get_cur
         current_user.avatar_url = user_data.avatar_url
     
     db.commit()
+    principal_cache.invalidate_user(current_user.id)
     return {"message": "Profile updated successfully"}
 
+def location_to_dict(loc: DBLocation) -> dict:
+    return {
+        "id": loc.id,
+        "user_id": loc.user_id,
+        "name": loc.name,
+        "latitude": loc.latitude,
+        "longitude": loc.longitude,
+        "description": loc.description,
+        "address": loc.address,
+        "source_url": loc.source_url
+    }
+
+def _set_sync_headers(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    # Let clients cache the list but revalidate it on every poll
+    response.headers["Cache-Control"] = "private, no-cache"
+
+def _bbox_tag(box) -> str:
+    # No commas: If-None-Match is a comma-separated list of tags
+    return "_".join(f"{value:g}" for value in box)
+
+def _not_modified(etag: str) -> Response:
+    response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    _set_sync_headers(response, etag)
+    return response
+
 @app.get("/locations", response_model=List[Location])
-def get_locations(current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
-    locations = db.query(DBLocation).filter(DBLocation.user_id == current_user.id).all()
-    return [
-        {
-            "id": loc.id,
-            "user_id": loc.user_id,
-            "name": loc.name,
-            "latitude": loc.latitude,
-            "longitude": loc.longitude,
-            "description": loc.description,
-            "address": loc.address,
-            "source_url": loc.source_url
-        }
-        for loc in locations
-    ]
+def get_locations(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LOCATIONS_PAGE_SIZE),
+    after_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    bbox: Optional[str] = None,
+    format: str = Query("json", pattern=f"^({'|'.join(LOCATION_FORMATS)})$"),
+    current_user: Principal = Depends(get_current_principal),
+    version: int = Depends(get_locations_version),
+    db: Session = Depends(get_db)
+):
+    """List the user's locations, optionally paginated and projected
+    
+    With ``limit`` the response is one page ordered by id; when more rows follow,
+    the ``X-Next-After-Id`` header holds the ``after_id`` for the next page.
+    ``fields`` is a comma-separated subset of the location fields to return.
+    ``bbox=minLon,minLat,maxLon,maxLat`` returns only the pins inside the box.
+    Without ``limit`` the full list is streamed, read one keyset page at a time.
+    
+    ``format=columnar`` returns ``{"count": n, "columns": {field: [...]}}``
+    instead of one object per location; ``format=binary`` returns the packed
+    layout described in ``queries.pack_columns`` (always with coordinates).
+    """
+    try:
+        columns = parse_fields(fields)
+        box = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format == "binary":
+        columns = [field for field in LOCATION_FIELDS if field in {*columns, "latitude", "longitude"}]
+    
+    # An unchanged list costs only the version lookup
+    variant = None
+    if fields or limit or after_id is not None or box or format != "json":
+        variant = f"{'_'.join(columns)}.{after_id}.{limit}"
+        if box:
+            variant += "." + _bbox_tag(box)
+        if format != "json":
+            variant += f".{format}"
+    etag = locations_etag(current_user.id, version, variant)
+    if etag_matches(request, etag):
+        return _not_modified(etag)
+    
+    if format != "json":
+        # Column-wise encodings are built from a single projected query, without per-row dicts
+        fetch = limit + 1 if limit is not None else None
+        values = fetch_columns(db, select_locations(current_user.id, columns, after_id, fetch, box), columns)
+        next_after_id = None
+        if limit is not None and len(values["id"]) > limit:
+            values = {field: column[:limit] for field, column in values.items()}
+            next_after_id = values["id"][-1]
+        if format == "binary":
+            response = Response(pack_columns(values), media_type="application/octet-stream")
+        else:
+            response = JSONResponse({"count": len(values["id"]), "columns": values})
+        _set_sync_headers(response, etag)
+        if next_after_id is not None:
+            response.headers["X-Next-After-Id"] = str(next_after_id)
+        return response
+    
+    if limit is None:
+        rows = stream_locations(current_user.id, columns, after_id, box)
+        response = StreamingResponse(json_array_chunks(rows), media_type="application/json")
+        _set_sync_headers(response, etag)
+        return response
+    
+    # Fetch one extra row to learn whether there is a next page
+    rows = list(iter_rows(db, select_locations(current_user.id, columns, after_id, limit + 1, box)))
+    response = JSONResponse(rows[:limit])
+    _set_sync_headers(response, etag)
+    if len(rows) > limit:
+        response.headers["X-Next-After-Id"] = str(rows[limit - 1]["id"])
+    return response
+
+@app.get("/locations/export")
+def export_locations(
+    format: str = Query("geojson", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    fields: Optional[str] = None,
+    current_user: Principal = Depends(get_current_principal)
+):
+    """Download all of the user's locations as GeoJSON, NDJSON or CSV
+    
+    The file is streamed in keyset pages, each read in a short session, so memory
+    use does not grow with the number of locations and no connection is held
+    while the client downloads.
+    """
+    try:
+        columns = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format == "geojson":
+        columns = [field for field in LOCATION_FIELDS if field in {*columns, "latitude", "longitude"}]
+    
+    rows = stream_locations(current_user.id, columns)
+    if format == "geojson":
+        chunks = geojson_chunks(rows)
+    elif format == "ndjson":
+        chunks = ndjson_chunks(rows)
+    else:
+        chunks = csv_chunks(rows, columns)
+    extension = "json" if format == "geojson" else format
+    return StreamingResponse(chunks, media_type=EXPORT_FORMATS[format], headers={
+        "Content-Disposition": f'attachment; filename="vibesy-locations.{extension}"'
+    })
+
+@app.get("/locations/clusters")
+def get_location_clusters(
+    request: Request,
+    bbox: str,
+    zoom: int = Query(..., ge=0, le=MAX_CLUSTER_ZOOM),
+    current_user: Principal = Depends(get_current_principal),
+    version: int = Depends(get_locations_version),
+    db: Session = Depends(get_db)
+):
+    """Clusters of the user's locations in a map viewport at one zoom level
+    
+    Each cluster has a ``count``, the centroid ``latitude``/``longitude`` of its
+    locations and the id of one of them. Above ``MAX_CLUSTER_ZOOM`` fetch the
+    pins themselves with ``GET /locations?bbox=``.
+    """
+    try:
+        box = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    etag = locations_etag(current_user.id, version, f"clusters.{zoom}.{_bbox_tag(box)}")
+    if etag_matches(request, etag):
+        return _not_modified(etag)
+    
+    ensure_clusters(db, current_user.id, version)
+    response = JSONResponse(query_clusters(db, current_user.id, zoom, box))
+    _set_sync_headers(response, etag)
+    return response
+
+@app.get("/locations/nearby")
+def get_nearby_locations(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=MAX_NEARBY_RESULTS),
+    radius_m: Optional[float] = Query(None, gt=0),
+    current_user: Principal = Depends(get_current_principal),
+    version: int = Depends(get_locations_version),
+    db: Session = Depends(get_db)
+):
+    """The ``k`` saved locations nearest to ``lat``/``lon``, nearest first
+    
+    Each location carries its great-circle ``distance_m``; with ``radius_m`` only
+    locations within that many metres are returned.
+    """
+    etag = locations_etag(current_user.id, version, f"nearby.{lat:g}_{lon:g}.{k}.{radius_m}")
+    if etag_matches(request, etag):
+        return _not_modified(etag)
+    
+    nearest = nearby_index.nearest(db, current_user.id, version, lat, lon, k, radius_m)
+    rows = {}
+    if nearest:
+        statement = select_locations(current_user.id, list(LOCATION_FIELDS)).where(
+            DBLocation.id.in_([location_id for location_id, _ in nearest])
+        )
+        rows = {row["id"]: row for row in iter_rows(db, statement)}
+    response = JSONResponse([
+        {**rows[location_id], "distance_m": round(distance, 1)}
+        for location_id, distance in nearest if location_id in rows
+    ])
+    _set_sync_headers(response, etag)
+    return response
+
+@app.get("/locations/search")
+def search_user_locations(
+    request: Request,
+    q: str,
+    limit: int = Query(20, ge=1, le=MAX_LOCATIONS_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: Principal = Depends(get_current_principal),
+    version: int = Depends(get_locations_version),
+    db: Session = Depends(get_db)
+):
+    """Locations whose name, description or address match ``q``, best match first
+    
+    Every word must match; the last one also matches as a prefix, so the
+    endpoint can back a type-ahead search box.
+    """
+    try:
+        columns = parse_fields(fields)
+        terms = parse_search(q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Hashed: search words need not be valid header characters
+    query_key = hashlib.sha1(" ".join(terms).encode()).hexdigest()[:16]
+    etag = locations_etag(current_user.id, version, f"search.{query_key}.{limit}.{'_'.join(columns)}")
+    if etag_matches(request, etag):
+        return _not_modified(etag)
+    
+    response = JSONResponse(list(iter_rows(db, search_locations(current_user.id, columns, terms, limit))))
+    _set_sync_headers(response, etag)
+    return response
+
+@app.get("/locations/changes")
+def get_location_changes(
+    request: Request,
+    response: Response,
+    since: int = 0,
+    current_user: Principal = Depends(get_current_principal),
+    version: int = Depends(get_locations_version),
+    db: Session = Depends(get_db)
+):
+    """Locations added, changed or deleted after the ``since`` cursor
+    
+    Pass the returned ``cursor`` as ``since`` on the next call. ``reset`` means
+    ``upserts`` holds the full list and replaces what the client has (first
+    sync, or a cursor the server does not know).
+    """
+    etag = locations_etag(current_user.id, version, f"since-{since}")
+    if etag_matches(request, etag):
+        return _not_modified(etag)
+    _set_sync_headers(response, etag)
+    
+    cursor = version
+    reset = since <= 0 or since > cursor
+    if not reset and since < cursor and since < tombstones_pruned_version(db, current_user.id):
+        # Deletions after ``since`` may have been pruned, so a delta could miss some
+        reset = True
+    if reset:
+        since = 0
+    changes = {"cursor": cursor, "reset": reset, "upserts": [], "deletes": []}
+    if since == cursor and not reset:
+        return changes
+    
+    upserts = db.query(DBLocation).filter(
+        DBLocation.user_id == current_user.id,
+        DBLocation.version > since
+    ).all()
+    changes["upserts"] = [location_to_dict(loc) for loc in upserts]
+    if since > 0:
+        tombstones = db.query(LocationTombstone.location_id).filter(
+            LocationTombstone.user_id == current_user.id,
+            LocationTombstone.version > since
+        ).all()
+        changes["deletes"] = [location_id for location_id, in tombstones]
+    return changes
 
 @app.post("/locations", response_model=Location)
-def add_location(location: Location, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+def add_location(location: Location, current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    version = next_locations_version(db, current_user.id)
     db_location = DBLocation(
         user_id=current_user.id,
+        version=version,
         name=location.name,
         latitude=location.latitude,
         longitude=location.longitude,
@@ -357,8 +715,14 @@ def add_location(location: Location, current_user: DBUser = Depends(get_current_
         source_url=location.source_url
     )
     db.add(db_location)
+    db.flush()
+    record_location_changes(db, current_user.id, version,
+                            added=[(db_location.id, db_location.latitude, db_location.longitude)])
     db.commit()
     db.refresh(db_location)
+    location_events.publish(current_user.id, {
+        "type": "add", "cursor": db_location.version, "locations": [location_to_dict(db_location)]
+    })
     
     return {
         "id": db_location.id,
@@ -372,7 +736,7 @@ def add_location(location: Location, current_user: DBUser = Depends(get_current_
     }
 
 @app.delete("/locations/{location_id}")
-def delete_location(location_id: int, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_location(location_id: int, current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     location = db.query(DBLocation).filter(
         DBLocation.id == location_id,
         DBLocation.user_id == current_user.id
@@ -381,222 +745,158 @@ def delete_location(location_id: int, current_user: DBUser = Depends(get_current
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
     
+    version = next_locations_version(db, current_user.id)
+    db.add(LocationTombstone(user_id=current_user.id, location_id=location.id, version=version))
+    record_location_changes(db, current_user.id, version,
+                            removed=[(location.id, location.latitude, location.longitude)])
     db.delete(location)
     db.commit()
+    location_events.publish(current_user.id, {"type": "delete", "cursor": version, "ids": [location_id]})
     return {"message": "Location deleted successfully"}
 
-# Location parsing functions
-def extract_locations_from_text(text: str) -> List[dict]:
-    """Extract location mentions from text using improved pattern matching"""
-    locations = []
-    logger.info(f"Extracting locations from text (length: {len(text)})")
-    
-    # Enhanced patterns with broader matching
-    patterns = [
-        # Location emoji followed by text (highest priority)
-        (r'📍\s*([^\n📍🏠🌴🏖️🎭🍕☕🗺️🏛️]{3,150})', 0.95),
-        
-        # Other location emojis
-        (r'[🏠🌴🏖️🎭🍕☕🗺️🏛️🏨🏰🗼🌉🏙️🌆]\s*([^\n📍🏠🌴🏖️🎭🍕☕🗺️🏛️]{3,150})', 0.9),
-        
-        # Explicit location keywords (multilingual)
-        (r'(?:Location|Address|Place|Venue|Located at|Visit|Check out|At|Visiting|Địa chỉ|位置|場所|위치|Ubicación|Adresse|Indirizzo|Endereço|地址|Lokasi|สถานที่)[\s:]+([^\n]{5,150})', 0.92),
-        
-        # City, Country format (improved to catch more variations)
-        (r'\b([A-ZÀ-Ž][a-zA-ZÀ-ž\s\-\']{2,45},\s*[A-ZÀ-Ž][a-zA-ZÀ-ž\s\-\']{2,45})\b', 0.88),
-        
-        # Famous places and cities (expanded list with more global locations)
-        (r'\b(New York|NYC|Manhattan|Brooklyn|San Francisco|Los Angeles|LA|Hollywood|Paris|London|Tokyo|Rome|Barcelona|Amsterdam|Berlin|Prague|Vienna|Budapest|Dublin|Edinburgh|Stockholm|Copenhagen|Madrid|Athens|Istanbul|Dubai|Bangkok|Singapore|Sydney|Melbourne|Brisbane|Perth|Vancouver|Toronto|Montreal|Chicago|Miami|Seattle|Boston|Austin|Portland|Denver|Las Vegas|Honolulu|Santorini|Mykonos|Oia|Fira|Bali|Ubud|Phuket|Krabi|Kyoto|Seoul|Hong Kong|Macau|Shanghai|Beijing|Guangzhou|Shenzhen|Hanoi|Ho Chi Minh|Saigon|Manila|Jakarta|Kuala Lumpur|Penang|Taipei|Osaka|Fukuoka|Busan|Jeju|Reykjavik|Lisbon|Porto|Monaco|Venice|Florence|Milan|Naples|Zurich|Geneva|Marrakech|Cairo|Cape Town|Nairobi|Rio|Sao Paulo|Buenos Aires|Lima|Cusco|Machu Picchu|Bogota|Cartagena|Cancun|Tulum|Playa del Carmen|Mexico City|San Diego|Phoenix|Dallas|Houston|Philadelphia|Washington|Atlanta|New Orleans|Nashville|Memphis|Charleston|Savannah|Key West|Napa|Yosemite|Yellowstone|Grand Canyon|Zion|Tahoe|Aspen|Vail|Whistler|Banff|Queenstown|Auckland|Wellington|Christchurch|Fiji|Tahiti|Maldives|Seychelles|Mauritius|Bora Bora|Santorini|Mykonos|Ibiza|Mallorca|Capri|Amalfi|Positano|Cinque Terre|Dubrovnik|Split|Hvar|Montenegro|Croatia|Slovenia|Lake Como|Lake Garda|Swiss Alps|French Riviera|Cannes|Nice|Monaco|St Tropez|Bordeaux|Lyon|Marseille|Strasbourg|Normandy|Bruges|Brussels|Antwerp|Luxembourg|Edinburgh|Glasgow|Oxford|Cambridge|Bath|Brighton|Cornwall|Lake District|Yorkshire|Cotswolds|Santorini|Crete|Rhodes|Corfu|Zakynthos|Paros|Naxos)\b', 0.93),
-        
-        # Places with type suffix (improved and expanded)
-        (r'\b([A-ZÀ-Ž][a-zA-ZÀ-ž\s\-\']{2,60}\s+(?:Beach|Beaches|Park|Parks|Tower|Towers|Museum|Museums|Temple|Temples|Castle|Castles|Palace|Palaces|Fort|Forts|Cathedral|Cathedrals|Church|Churches|Mosque|Mosques|Shrine|Shrines|Monastery|Monasteries|Square|Squares|Plaza|Plazas|Market|Markets|Bazaar|Bazaars|Bay|Bays|Island|Islands|Lake|Lakes|River|Rivers|Mountain|Mountains|Hill|Hills|Valley|Valleys|Garden|Gardens|Bridge|Bridges|Airport|Airports|Station|Stations|Hotel|Hotels|Resort|Resorts|Restaurant|Restaurants|Cafe|Cafes|Bistro|Bistros|Bar|Bars|Pub|Pubs|Club|Clubs|Mall|Malls|Center|Centre|Centers|Centres|Village|Villages|Town|Towns|City|Cities|Waterfall|Waterfalls|Canyon|Canyons|Pier|Piers|Harbor|Harbour|Marina|Marinas|Port|Ports|Zoo|Zoos|Aquarium|Aquariums|Stadium|Stadiums|Arena|Arenas|Theater|Theatre|Spa|Spas|Winery|Wineries|Vineyard|Vineyards|Brewery|Breweries|Distillery|Distilleries|Bakery|Bakeries|Deli|Delis|Lounge|Lounges|Gallery|Galleries|Library|Libraries|University|Universities|College|Colleges|Hospital|Hospitals|Clinic|Clinics))\b', 0.89),
-        
-        # Preposition + Location (improved with more prepositions)
-        (r'(?:at|in|from|to|visiting|near|around|by|beside|next to|across from|opposite|behind|@)\s+(?:the\s+)?([A-ZÀ-Ž][a-zA-ZÀ-ž\s,\-\'&]{3,80})', 0.78),
-        
-        # Street addresses (numbers + street names) - improved
-        (r'\b(\d+\s+[A-ZÀ-Ž][a-zA-ZÀ-ž\s\-\']{3,60}(?:Street|St\.?|Avenue|Ave\.?|Road|Rd\.?|Boulevard|Blvd\.?|Lane|Ln\.?|Drive|Dr\.?|Way|Court|Ct\.?|Place|Pl\.?|Terrace|Ter\.?|Circle|Cir\.?))\b', 0.84),
-        
-        # Hashtags with location names (common on social media)
-        (r'#([A-ZÀ-Ž][a-zA-ZÀ-ž]{3,30}(?:[A-Z][a-zA-ZÀ-ž]{2,30})*)', 0.72),
-        
-        # Multiple capitalized words (potential location names)
-        (r'\b([A-ZÀ-Ž][a-zA-ZÀ-ž]+(?:\s+[A-ZÀ-Ž][a-zA-ZÀ-ž]+){1,5})\b', 0.65),
-        
-        # @ mentions that might be places (e.g., @CentralPark)
-        (r'@([A-ZÀ-Ž][a-zA-ZÀ-ž0-9_]{2,40})', 0.68),
-    ]
-    
-    for pattern, confidence in patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE if confidence < 0.8 else 0)
-        for match in matches:
-            location_text = match.group(1).strip() if len(match.groups()) > 0 else match.group(0).strip()
-            
-            # Clean up the text
-            location_text = re.sub(r'\s+', ' ', location_text)  # Normalize spaces
-            location_text = re.sub(r'[^\w\s,.\-\'À-ÿĀ-ſƀ-ɏḀ-ỿ一-龯ぁ-ゟァ-ヿ가-힣]', '', location_text)
-            location_text = location_text.strip()
-            
-            # Filter out common non-location words and phrases
-            skip_words = {'the', 'and', 'for', 'with', 'this', 'that', 'from', 'have', 'they', 'will', 'what', 'when', 'where', 'your', 'more', 'said', 'each', 'about', 'than', 'having', 'best', 'time', 'next', 'week', 'visiting'}
-            
-            # Check if text starts or ends with common non-location words
-            words = location_text.lower().split()
-            if words and (words[0] in skip_words or words[-1] in skip_words):
-                # If starts/ends with skip word and confidence is low, skip it
-                if confidence < 0.9:
-                    continue
-            
-            if location_text.lower() in skip_words:
-                continue
-            
-            # Validate length and content quality
-            if 3 <= len(location_text) <= 100:
-                # Boost confidence if it contains location indicators
-                if any(word in location_text.lower() for word in ['beach', 'park', 'hotel', 'restaurant', 'cafe', 'bay', 'island', 'museum', 'tower', 'square', 'airport', 'station']):
-                    confidence = min(confidence + 0.1, 0.98)
-                
-                locations.append({
-                    "name": location_text,
-                    "confidence": confidence,
-                    "source": "text_pattern"
-                })
-    
-    # Remove duplicates and filter false positives
-    unique_locations = []
-    seen = set()
+@app.post("/locations/from-parsed")
+def save_parsed_locations(payload: SaveParsedLocations, current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    """Save multiple locations parsed from a link or screenshot in one transaction
     
-    # Sort by confidence first
-    sorted_locations = sorted(locations, key=lambda x: x["confidence"], reverse=True)
+    By default the whole payload is validated first and nothing is saved if any
+    location is invalid. With ``report_errors`` the valid locations are saved and
+    the invalid ones are reported per index.
+    """
+    if len(payload.locations) > MAX_BULK_LOCATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_LOCATIONS} locations can be saved at once")
     
-    for loc in sorted_locations:
-        loc_lower = loc["name"].lower().strip()
-        
-        # Skip if already seen or too short
-        if loc_lower in seen or len(loc_lower) < 3:
+    default_description = f"Parsed from {payload.source_info.get('platform', 'social media')}"
+    rows, errors = [], []
+    for index, item in enumerate(payload.locations):
+        try:
+            location = ParsedLocation.model_validate(item)
+        except ValidationError as e:
+            errors.append({
+                "index": index,
+                "name": item.get("name") if isinstance(item, dict) else None,
+                "errors": [f"{'.'.join(str(part) for part in err['loc']) or 'location'}: {err['msg']}" for err in e.errors()]
+            })
             continue
-            
-        # Skip if it's a substring of an already added location (keep longer, more specific one)
-        is_substring = False
-        for existing in unique_locations:
-            existing_lower = existing["name"].lower().strip()
-            if loc_lower in existing_lower or existing_lower in loc_lower:
-                # Keep the one with higher confidence, or longer name if same confidence
-                if loc["confidence"] < existing["confidence"]:
-                    is_substring = True
-                    break
-                elif loc["confidence"] == existing["confidence"] and len(loc_lower) <= len(existing_lower):
-                    is_substring = True
-                    break
-                else:
-                    # Remove the existing one, add this one
-                    unique_locations.remove(existing)
-                    seen.discard(existing_lower)
-                    break
-        
-        if not is_substring:
-            seen.add(loc_lower)
-            unique_locations.append(loc)
+        rows.append({
+            "user_id": current_user.id,
+            "name": location.name,
+            "latitude": location.latitude,
+            "longitude": location.longitude,
+            "description": location.description if location.description is not None else default_description,
+            "address": location.address,
+            "source_url": location.source_url,
+        })
     
-    # Limit to top 15 most confident locations to avoid overwhelming the user
-    unique_locations = sorted(unique_locations, key=lambda x: x["confidence"], reverse=True)[:15]
+    if errors and not payload.report_errors:
+        raise HTTPException(status_code=422, detail={"message": "Invalid locations, nothing was saved", "errors": errors})
     
-    logger.info(f"Found {len(unique_locations)} unique locations after deduplication")
-    return unique_locations
+    ids = []
+    if rows:
+        try:
+            # A single commit for the whole batch
+            ids, version = insert_locations(db, current_user.id, rows)
+            db.commit()
+            location_events.publish(current_user.id, added_event(version, ids, rows))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error saving parsed locations: {e}")
+            raise HTTPException(status_code=500, detail=f"Error saving locations: {str(e)}")
+    
+    response = {
+        "message": f"Successfully saved {len(ids)} of {len(payload.locations)} locations",
+        "saved_count": len(ids),
+        "total_count": len(payload.locations),
+        "ids": ids,
+    }
+    if payload.report_errors:
+        response["errors"] = errors
+    return response
 
-def geocode_location(location_name: str) -> dict:
-    """Geocode a location name to get coordinates with retry logic"""
-    import time
+@app.post("/locations/import", status_code=status.HTTP_202_ACCEPTED)
+async def import_locations(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="csv, geojson or kml; inferred from the file name by default"),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """Start a bulk import of a CSV, GeoJSON or KML file
+    
+    The file is processed in the background: rows are read incrementally,
+    places without coordinates are geocoded and every batch is committed as it
+    is done. Poll ``GET /locations/import/{job_id}`` for progress.
+    """
+    try:
+        fmt = detect_format(file.filename, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        path = await spool_upload(file)
+    except ImportTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     
-    max_retries = 2
-    for attempt in range(max_retries):
+    def create_job():
+        db = SessionLocal()
         try:
-            # Use Nominatim for geocoding (free service)
-            url = "https://nominatim.openstreetmap.org/search"
-            params = {
-                "q": location_name,
-                "format": "json",
-                "limit": 1,
-                "addressdetails": 1
-            }
-            headers = {
-                "User-Agent": "Vibesy/1.0 (contact@vibesy.app)"
-            }
-            
-            logger.info(f"Geocoding '{location_name}' (attempt {attempt + 1}/{max_retries})")
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            if data and len(data) > 0:
-                result = data[0]
-                logger.info(f"Successfully geocoded '{location_name}' to ({result['lat']}, {result['lon']})")
-                return {
-                    "latitude": float(result["lat"]),
-                    "longitude": float(result["lon"]),
-                    "address": result.get("display_name", location_name),
-                    "geocoded": True
-                }
-            
-            logger.warning(f"No geocoding results for '{location_name}'")
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Geocoding request error for '{location_name}': {e}")
-            if attempt < max_retries - 1:
-                time.sleep(1)  # Wait before retry
-                continue
-        except Exception as e:
-            logger.error(f"Geocoding error for '{location_name}': {e}")
-            if attempt < max_retries - 1:
-                time.sleep(1)
-                continue
+            job = ImportJob(user_id=current_user.id, filename=(file.filename or "")[:255] or None, format=fmt,
+                            worker=WORKER_ID)
+            db.add(job)
+            db.commit()
+            return job_to_dict(job)
+        finally:
+            db.close()
     
-    return {"geocoded": False}
+    try:
+        job = await asyncio.to_thread(create_job)
+    except Exception:
+        os.unlink(path)
+        raise
+    start_import(job["id"], current_user.id, path, fmt)
+    logger.info(f"Import {job['id']} queued for user {current_user.id}: {file.filename} ({fmt})")
+    return job
 
-@app.post("/locations/from-parsed")
-def save_parsed_locations(locations_data: dict, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Save multiple locations parsed from a link"""
+@app.get("/locations/import/{job_id}")
+def get_import_job(job_id: int, current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    """Progress of a bulk import started by the current user"""
+    job = db.get(ImportJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return job_to_dict(job)
+
+@app.get("/geocode/search")
+async def geocode_search(
+    q: str,
+    limit: int = Query(5, ge=1, le=10),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """Address autocomplete for the add-location form
+    
+    Answers from the user's saved locations, the gazetteer and the shared geocode
+    cache, and only asks the external geocoder on a miss. Rapid successive
+    queries from one user are debounced server-side; ``complete`` is False when
+    this query was superseded (or the geocoder failed) and only local matches
+    are returned.
+    """
     try:
-        locations = locations_data.get('locations', [])
-        saved_count = 0
-        
-        for location in locations:
-            try:
-                # Create location object
-                db_location = DBLocation(
-                    user_id=current_user.id,
-                    name=location.get('name'),
-                    latitude=location.get('latitude'),
-                    longitude=location.get('longitude'),
-                    description=location.get('description', f"Parsed from {locations_data.get('source_info', {}).get('platform', 'social media')}"),
-                    address=location.get('address'),
-                    source_url=location.get('source_url')
-                )
-                
-                db.add(db_location)
-                db.commit()
-                saved_count += 1
-                    
-            except Exception as e:
-                print(f"Error saving location {location.get('name', 'unknown')}: {e}")
-                db.rollback()
-                continue
-        
-        return {
-            "message": f"Successfully saved {saved_count} of {len(locations)} locations",
-            "saved_count": saved_count,
-            "total_count": len(locations)
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error saving locations: {str(e)}")
+        terms = parse_search(q)
+    except ValueError:
+        return {"query": q, "results": [], "complete": True}
+    
+    statement = search_locations(current_user.id, ["id", "name", "latitude", "longitude", "address"], terms, limit)
+    saved = await asyncio.to_thread(lambda: list(iter_rows(db, statement)))
+    results = [{**row, "source": "saved"} for row in saved]
+    complete = True
+    if len(results) < limit:
+        places = await search_places(q, limit - len(results), client_key=current_user.id)
+        results.extend(places["results"])
+        complete = places["complete"]
+    return {"query": q, "results": results, "complete": complete}
 
 MAX_IMAGE_BYTES = 5 * 1024 * 1024  # 5MB limit
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
 
 @app.post("/parse-screenshot", response_model=ParsedLocationResponse)
 async def parse_screenshot(
-    current_user: DBUser = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     file: UploadFile = File(...)
 ):
     """Parse locations from a screenshot image using OCR with improved processing"""
@@ -615,109 +915,66 @@ async def parse_screenshot(
         raise HTTPException(status_code=400, detail="Image too large (limit 5MB).")
     
     try:
-        # Open and preprocess image for better OCR
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB if necessary
-        if image.mode not in ['RGB', 'L']:
-            image = image.convert('RGB')
-        
-        # Resize if too large (improves OCR performance)
-        max_dimension = 3000
-        if max(image.size) > max_dimension:
-            ratio = max_dimension / max(image.size)
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-            logger.info(f"Resized image to {new_size}")
-        
-        # Enhanced image preprocessing for better OCR
-        from PIL import ImageEnhance, ImageFilter, ImageOps
-        
-        # Convert to grayscale for better text detection
-        image_gray = ImageOps.grayscale(image)
-        
-        # Increase sharpness significantly
-        enhancer = ImageEnhance.Sharpness(image_gray)
-        image_sharp = enhancer.enhance(3.0)
-        
-        # Increase contrast significantly
-        enhancer = ImageEnhance.Contrast(image_sharp)
-        image_contrast = enhancer.enhance(2.5)
-        
-        # Apply slight blur to reduce noise, then sharpen
-        image_processed = image_contrast.filter(ImageFilter.MedianFilter(size=3))
-        
-        # Final sharpening pass
-        enhancer = ImageEnhance.Sharpness(image_processed)
-        image_final = enhancer.enhance(2.0)
-        
-        logger.info(f"Processing image: {image.size} pixels, mode: {image.mode}")
+        # Repeated uploads of the same screenshot are answered from the cache
+        cache_key = None
+        signature = None
+        cached = None
+        if SCREENSHOT_CACHE_MODE != "off":
+            try:
+                fingerprint, signature = await run_in_ocr_pool(fingerprint_image, contents, SCREENSHOT_CACHE_MODE)
+                # Results of older OCR or extraction code are never reused
+                cache_key = f"v{OCR_VERSION}.{EXTRACTION_VERSION}:{fingerprint}"
+                cached = await asyncio.to_thread(screenshot_cache.get, cache_key)
+                if cached and not same_screenshot(signature, cached["signature"]):
+                    logger.info(f"Screenshot cache key {cache_key[:24]} belongs to a different image")
+                    cached = None
+            except Exception as cache_error:
+                logger.warning(f"Screenshot cache lookup failed: {cache_error}")
         
-        # Perform OCR with optimized config - try multiple configurations
-        ocr_text = ""
-        try:
-            # Configuration 1: Standard block detection (best for screenshots)
-            config1 = r'--oem 3 --psm 6 -c preserve_interword_spaces=1'
-            text1 = pytesseract.image_to_string(image_final, lang='eng', config=config1)
-            
-            # Configuration 2: Sparse text detection (good for social media)
-            config2 = r'--oem 3 --psm 11 -c preserve_interword_spaces=1'
-            text2 = pytesseract.image_to_string(image_final, lang='eng', config=config2)
-            
-            # Configuration 3: Single column of text
-            config3 = r'--oem 3 --psm 4 -c preserve_interword_spaces=1'
-            text3 = pytesseract.image_to_string(image_final, lang='eng', config=config3)
-            
-            # Also try with original enhanced image (not grayscale)
-            config4 = r'--oem 3 --psm 6 -c preserve_interword_spaces=1'
-            image_color_enhanced = image.convert('RGB')
-            enhancer = ImageEnhance.Sharpness(image_color_enhanced)
-            image_color_sharp = enhancer.enhance(2.5)
-            enhancer = ImageEnhance.Contrast(image_color_sharp)
-            image_color_final = enhancer.enhance(2.0)
-            text4 = pytesseract.image_to_string(image_color_final, lang='eng', config=config4)
-            
-            # Combine all results and deduplicate
-            all_texts = [text1, text2, text3, text4]
-            # Use the longest text as base
-            ocr_text = max(all_texts, key=len)
-            
-            # Also append unique lines from other attempts
-            all_lines = set()
-            for text in all_texts:
-                all_lines.update(text.strip().split('\n'))
-            
-            # Combine unique lines
-            combined_text = '\n'.join(sorted(all_lines, key=lambda x: len(x), reverse=True))
-            if len(combined_text) > len(ocr_text):
-                ocr_text = combined_text
-            
-            logger.info(f"OCR extracted {len(ocr_text)} characters using multi-pass approach")
-            
-            # Log sample of extracted text for debugging
-            if ocr_text:
-                sample = ocr_text[:300].replace('\n', ' ')
-                logger.info(f"OCR sample: {sample}...")
-            
-        except pytesseract.TesseractNotFoundError:
-            logger.error("Tesseract OCR not installed on server")
-            return {
-                "locations": [],
-                "source_info": {
-                    "platform": "screenshot",
-                    "url": None,
-                    "parsed_content": "OCR engine not installed on server. Please install Tesseract.",
-                    "total_locations_found": 0,
-                    "meta": {
-                        "filename": file.filename,
-                        "content_type": file.content_type,
-                        "ocr_available": False
+        if cached:
+            logger.info(f"Screenshot cache hit for {cache_key[:24]}")
+            ocr_text = cached["ocr_text"]
+            ocr_meta = {**cached["meta"], "cache": "hit"}
+        else:
+            # Preprocessing and OCR run in the process pool so the event loop keeps serving requests
+            try:
+                ocr_result = await recognize(contents, count_locations=lambda text: len(extract_locations_from_text(text)))
+                ocr_text = ocr_result["text"]
+                logger.info(f"Processed image: {ocr_result['size']} pixels, mode: {ocr_result['mode']}")
+                logger.info(f"OCR extracted {len(ocr_text)} characters using {len(ocr_result['passes'])} passes")
+                
+                # Log sample of extracted text for debugging
+                if ocr_text:
+                    sample = ocr_text[:300].replace('\n', ' ')
+                    logger.info(f"OCR sample: {sample}...")
+                
+            except OCREngineUnavailable:
+                logger.error("Tesseract OCR not installed on server")
+                return {
+                    "locations": [],
+                    "source_info": {
+                        "platform": "screenshot",
+                        "url": None,
+                        "parsed_content": "OCR engine not installed on server. Please install Tesseract.",
+                        "total_locations_found": 0,
+                        "meta": {
+                            "filename": file.filename,
+                            "content_type": file.content_type,
+                            "ocr_available": False
+                        }
                     }
                 }
+            except Exception as ocr_error:
+                logger.error(f"OCR error: {ocr_error}")
+                raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(ocr_error)}")
+            
+            ocr_meta = {
+                "ocr_policy": ocr_result["policy"],
+                "ocr_passes": ocr_result["passes"],
+                "ocr_timings_ms": ocr_result["timings_ms"],
+                "ocr_wall_ms": ocr_result["wall_ms"],
+                "cache": "miss" if cache_key else "off"
             }
-        except Exception as ocr_error:
-            logger.error(f"OCR error: {ocr_error}")
-            raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(ocr_error)}")
         
         # Validate OCR output
         if not ocr_text or len(ocr_text.strip()) < 3:
@@ -738,23 +995,24 @@ async def parse_screenshot(
             }
         
         # Extract location mentions from OCR text
-        locations = extract_locations_from_text(ocr_text)
+        if cached:
+            locations = cached["candidates"]
+        else:
+            locations = extract_locations_from_text(ocr_text)
+            if cache_key:
+                try:
+                    await asyncio.to_thread(screenshot_cache.put, cache_key, ocr_text, locations, ocr_meta, signature)
+                except Exception as cache_error:
+                    logger.warning(f"Screenshot cache store failed: {cache_error}")
         logger.info(f"Extracted {len(locations)} potential locations from text")
         
-        # Geocode locations (with optimized rate limiting)
-        geocoded_locations = []
-        import time
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        
+        # Geocode locations (with shared rate limiting)
         # Limit to top 20 most confident locations to avoid rate limiting
         locations_to_geocode = sorted(locations, key=lambda x: x["confidence"], reverse=True)[:20]
         
-        def geocode_with_delay(loc_data, index):
-            """Helper function for parallel geocoding with delay"""
-            # Stagger requests to respect rate limits (max 1 req/sec for Nominatim)
-            time.sleep(index * 1.1)  # 1.1 second delay between each request
-            
-            geo = geocode_location(loc_data["name"])
+        async def geocode_candidate(loc_data):
+            """Helper coroutine for concurrent geocoding (rate limited inside geocode_location)"""
+            geo = await geocode_location(loc_data["name"])
             if geo.get("geocoded"):
                 return {
                     "name": loc_data["name"],
@@ -767,22 +1025,18 @@ async def parse_screenshot(
                 }
             return None
         
-        # Use ThreadPoolExecutor for parallel geocoding (but with delays)
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = {
-                executor.submit(geocode_with_delay, loc, i): loc 
-                for i, loc in enumerate(locations_to_geocode)
-            }
-            
-            for future in as_completed(futures):
-                try:
-                    result = future.result(timeout=15)
-                    if result:
-                        geocoded_locations.append(result)
-                        logger.info(f"✓ Geocoded: {result['name']}")
-                except Exception as e:
-                    loc = futures[future]
-                    logger.warning(f"✗ Failed to geocode {loc['name']}: {e}")
+        results = await asyncio.gather(
+            *(geocode_candidate(loc) for loc in locations_to_geocode),
+            return_exceptions=True
+        )
+        
+        geocoded_locations = []
+        for loc, result in zip(locations_to_geocode, results):
+            if isinstance(result, Exception):
+                logger.warning(f"✗ Failed to geocode {loc['name']}: {result}")
+            elif result:
+                geocoded_locations.append(result)
+                logger.info(f"✓ Geocoded: {result['name']}")
         
         logger.info(f"Successfully geocoded {len(geocoded_locations)} of {len(locations)} locations")
         
@@ -798,7 +1052,8 @@ async def parse_screenshot(
                     "content_type": file.content_type,
                     "ocr_length": len(ocr_text),
                     "locations_extracted": len(locations),
-                    "locations_geocoded": len(geocoded_locations)
+                    "locations_geocoded": len(geocoded_locations),
+                    **ocr_meta
                 }
             }
         }
@@ -809,20 +1064,96 @@ async def parse_screenshot(
         logger.exception("Error parsing screenshot")
         raise HTTPException(status_code=500, detail=f"Error parsing screenshot: {str(e)}")
 
+def _authenticate_socket(token: str):
+    """Return (user id, locations version) for a socket token, or None if it is not valid"""
+    db = SessionLocal()
+    try:
+        principal = resolve_principal(token, db)
+        version = current_locations_version(db, principal.id)
+        return (principal.id, version) if version is not None else None
+    except HTTPException:
+        return None
+    finally:
+        db.close()
+
+def _authenticate_ticket(ticket: str):
+    """Return (user id, locations version) for an unused socket ticket, or None"""
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_sub": False})
+        if payload.get("purpose") != "socket" or not claim_ticket(payload["jti"], payload["exp"]):
+            return None
+        user_id = int(payload["sub"])
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return None
+    db = SessionLocal()
+    try:
+        version = current_locations_version(db, user_id)
+        return (user_id, version) if version is not None else None
+    finally:
+        db.close()
+
+@app.post("/ws/locations/ticket")
+def create_socket_ticket(current_user: Principal = Depends(get_current_principal)):
+    """A single-use ticket for opening /ws/locations where headers cannot be set (browsers)"""
+    expires_at = datetime.utcnow() + timedelta(seconds=SOCKET_TICKET_TTL)
+    ticket = jwt.encode(
+        {"sub": str(current_user.id), "purpose": "socket", "jti": secrets.token_urlsafe(16), "exp": expires_at},
+        SECRET_KEY, algorithm=ALGORITHM
+    )
+    return {"ticket": ticket, "expires_in": SOCKET_TICKET_TTL}
+
+@app.websocket("/ws/locations")
+async def locations_socket(websocket: WebSocket, ticket: Optional[str] = None):
+    """Push the user's location changes as they are committed
+    
+    Authenticate with an ``Authorization: Bearer`` header, or, where headers
+    cannot be set, with ``?ticket=`` from POST /ws/locations/ticket. The bearer
+    token itself is never accepted in the URL, where access logs would record
+    it. The first message carries the current sync cursor; after a ``resync``
+    message the client should call /locations/changes.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        user = await asyncio.to_thread(_authenticate_socket, authorization[7:])
+    elif ticket:
+        user = await asyncio.to_thread(_authenticate_ticket, ticket)
+    else:
+        user = None
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    user_id, cursor = user
+    
+    await websocket.accept()
+    queue = location_events.subscribe(user_id, cursor)
+    try:
+        await websocket.send_json({"type": "hello", "cursor": cursor})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=LOCATION_SOCKET_PING_INTERVAL)
+            except asyncio.TimeoutError:
+                event = {"type": "ping"}
+            await websocket.send_json(event)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        location_events.unsubscribe(user_id, queue)
+
 @app.get("/locations/refresh", response_model=List[Location])
-def refresh_locations(current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+def refresh_locations(
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_current_principal),
+    version: int = Depends(get_locations_version),
+    db: Session = Depends(get_db)
+):
     """Return current user's saved locations (helper endpoint)."""
+    etag = locations_etag(current_user.id, version)
+    if etag_matches(request, etag):
+        return _not_modified(etag)
+    _set_sync_headers(response, etag)
     locs = db.query(DBLocation).filter(DBLocation.user_id == current_user.id).all()
-    return [{
-        "id": l.id,
-        "user_id": l.user_id,
-        "name": l.name,
-        "latitude": l.latitude,
-        "longitude": l.longitude,
-        "description": l.description,
-        "address": l.address,
-        "source_url": l.source_url
-    } for l in locs]
+    return [location_to_dict(l) for l in locs]
 
 @app.get("/debug/token")
 def debug_token(token: str):
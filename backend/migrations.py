@@ -0,0 +1,231 @@
+# Versioned schema migrations for the Vibesy database
+#
+# create_tables() builds a fresh database from the models; migrations bring
+# existing databases up to date. Each migration runs once, in order, and must be
+# safe to apply on top of a schema that create_tables() already produced.
+# run_migrations() holds the database write lock (SQLite) or an advisory lock
+# (PostgreSQL) while it runs, so concurrent workers starting up apply each
+# migration exactly once.
+import logging
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger("vibesy")
+
+# Arbitrary key for pg_advisory_xact_lock
+MIGRATION_LOCK_ID = 74218
+
+
+def _001_location_indexes(conn):
+    """Add per-user indexes so location queries stop scanning the whole table"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_locations_user_id_id ON locations (user_id, id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_locations_user_id_updated_at ON locations (user_id, updated_at)"))
+
+
+def _002_location_versions(conn):
+    """Add per-user change versions and deletion tombstones for delta sync"""
+    if not has_column(conn, "users", "locations_version"):
+        conn.execute(text("ALTER TABLE users ADD COLUMN locations_version INTEGER NOT NULL DEFAULT 0"))
+    if not has_column(conn, "locations", "version"):
+        conn.execute(text("ALTER TABLE locations ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+    # Existing rows become version 1, so a sync from cursor 0 returns them
+    conn.execute(text("UPDATE users SET locations_version = 1 WHERE locations_version = 0 "
+                      "AND id IN (SELECT user_id FROM locations)"))
+    conn.execute(text("UPDATE locations SET version = 1 WHERE version = 0"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_locations_user_id_version ON locations (user_id, version)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS location_tombstones (
+            id INTEGER NOT NULL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            location_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_location_tombstones_user_id_version "
+                      "ON location_tombstones (user_id, version)"))
+
+
+def _003_location_rtree(conn):
+    """Add an R*Tree over (user, longitude, latitude) for bounding-box queries (SQLite only)"""
+    if conn.dialect.name != "sqlite":
+        return
+    # The user id is a dimension too, so one user's pins form their own slab of the tree
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS locations_rtree USING rtree("
+        "id, min_user, max_user, min_lon, max_lon, min_lat, max_lat)"
+    ))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS locations_rtree_insert AFTER INSERT ON locations BEGIN
+            INSERT OR REPLACE INTO locations_rtree
+            VALUES (new.id, new.user_id, new.user_id, new.longitude, new.longitude, new.latitude, new.latitude);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS locations_rtree_update AFTER UPDATE OF user_id, latitude, longitude ON locations BEGIN
+            INSERT OR REPLACE INTO locations_rtree
+            VALUES (new.id, new.user_id, new.user_id, new.longitude, new.longitude, new.latitude, new.latitude);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS locations_rtree_delete AFTER DELETE ON locations BEGIN
+            DELETE FROM locations_rtree WHERE id = old.id;
+        END
+    """))
+    conn.execute(text(
+        "INSERT OR REPLACE INTO locations_rtree "
+        "SELECT id, user_id, user_id, longitude, longitude, latitude, latitude FROM locations"
+    ))
+
+
+def _004_location_clusters(conn):
+    """Add per-user, per-zoom map cluster cells (built lazily by clusters.py)"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS location_clusters (
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            zoom INTEGER NOT NULL,
+            cell_x INTEGER NOT NULL,
+            cell_y INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            latitude_sum FLOAT NOT NULL,
+            longitude_sum FLOAT NOT NULL,
+            representative_id INTEGER,
+            PRIMARY KEY (user_id, zoom, cell_x, cell_y)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cluster_state (
+            user_id INTEGER NOT NULL PRIMARY KEY REFERENCES users (id),
+            version INTEGER NOT NULL
+        )
+    """))
+
+
+def _005_location_fts(conn):
+    """Add an FTS5 index over location names, descriptions and addresses (SQLite only)"""
+    if conn.dialect.name != "sqlite":
+        return
+    # External content: the text stays in locations. The owner column holds "u<user_id>"
+    # so a MATCH can be limited to one user's rows inside the index
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS locations_fts USING fts5("
+        "name, description, address, owner, content='locations', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS locations_fts_insert AFTER INSERT ON locations BEGIN
+            INSERT INTO locations_fts (rowid, name, description, address, owner)
+            VALUES (new.id, new.name, new.description, new.address, 'u' || new.user_id);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS locations_fts_update AFTER UPDATE OF user_id, name, description, address ON locations BEGIN
+            INSERT INTO locations_fts (locations_fts, rowid, name, description, address, owner)
+            VALUES ('delete', old.id, old.name, old.description, old.address, 'u' || old.user_id);
+            INSERT INTO locations_fts (rowid, name, description, address, owner)
+            VALUES (new.id, new.name, new.description, new.address, 'u' || new.user_id);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS locations_fts_delete AFTER DELETE ON locations BEGIN
+            INSERT INTO locations_fts (locations_fts, rowid, name, description, address, owner)
+            VALUES ('delete', old.id, old.name, old.description, old.address, 'u' || old.user_id);
+        END
+    """))
+    # Not 'rebuild': locations has no owner column to rebuild from
+    conn.execute(text(
+        "INSERT INTO locations_fts (rowid, name, description, address, owner) "
+        "SELECT id, name, description, address, 'u' || user_id FROM locations"
+    ))
+
+
+def _006_import_jobs(conn):
+    """Add the import_jobs table tracking /locations/import progress"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER NOT NULL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            filename VARCHAR(255),
+            format VARCHAR(16) NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            rows_read INTEGER NOT NULL,
+            imported INTEGER NOT NULL,
+            geocoded INTEGER NOT NULL,
+            skipped INTEGER NOT NULL,
+            errors TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_import_jobs_user_id_id ON import_jobs (user_id, id)"))
+
+
+def _007_tombstone_pruning(conn):
+    """Track pruned tombstones per user and index them by age"""
+    if not has_column(conn, "users", "tombstones_pruned_version"):
+        conn.execute(text("ALTER TABLE users ADD COLUMN tombstones_pruned_version INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_location_tombstones_deleted_at "
+                      "ON location_tombstones (deleted_at)"))
+
+
+def _008_import_job_worker(conn):
+    """Record which worker runs each import job"""
+    if not has_column(conn, "import_jobs", "worker"):
+        conn.execute(text("ALTER TABLE import_jobs ADD COLUMN worker VARCHAR(64)"))
+
+
+# (version, description, function), in order
+MIGRATIONS = [
+    (1, "per-user location indexes", _001_location_indexes),
+    (2, "location versions and tombstones", _002_location_versions),
+    (3, "location R*Tree", _003_location_rtree),
+    (4, "location cluster cells", _004_location_clusters),
+    (5, "location full-text index", _005_location_fts),
+    (6, "import jobs", _006_import_jobs),
+    (7, "tombstone pruning", _007_tombstone_pruning),
+    (8, "import job worker", _008_import_job_worker),
+]
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    return any(col["name"] == column for col in inspect(conn).get_columns(table))
+
+
+def get_schema_version(conn) -> int:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+def run_migrations(engine):
+    """Apply all pending migrations in one locked transaction"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "sqlite":
+            # IMMEDIATE takes the write lock up front, serializing concurrent startups
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        else:
+            conn.exec_driver_sql("BEGIN")
+            if engine.dialect.name == "postgresql":
+                conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            current = get_schema_version(conn)
+            for version, description, migrate in MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info(f"Applying migration {version}: {description}")
+                migrate(conn)
+                conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+            conn.exec_driver_sql("COMMIT")
+        except Exception:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+
+
+if __name__ == "__main__":
+    from database import create_tables, engine
+
+    logging.basicConfig(level=logging.INFO)
+    create_tables()
+    run_migrations(engine)
+    with engine.connect() as conn:
+        print(f"Schema version: {get_schema_version(conn)}")
@@ -0,0 +1,233 @@
+# In-memory nearest-neighbour index of each user's saved locations
+#
+# A user's points are bucketed on a lat/lon grid of NEARBY_CELL_DEGREES cells;
+# each bucket keeps its ids and coordinates in packed arrays. Queries scan
+# rings of cells outwards from the query point and stop once no unscanned cell
+# can hold anything nearer than the k-th match. Indexes are built on a user's
+# first query and then brought up to date from the rows and tombstones stamped
+# with a newer locations_version (see sync.py), so writes made by any worker are
+# applied incrementally. Least recently used indexes are dropped when the
+# total number of indexed points exceeds NEARBY_INDEX_MAX_POINTS.
+import heapq
+import logging
+import math
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import Location, LocationTombstone, User
+
+logger = logging.getLogger("vibesy")
+
+NEARBY_CELL_DEGREES = float(os.getenv("NEARBY_CELL_DEGREES", "0.05"))
+NEARBY_INDEX_MAX_POINTS = int(os.getenv("NEARBY_INDEX_MAX_POINTS", "1000000"))
+
+EARTH_RADIUS_M = 6371008.8
+
+Cell = Tuple[int, int]
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Bucket:
+    __slots__ = ("ids", "latitudes", "longitudes")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+
+
+class PointIndex:
+    """Grid-bucketed points of one user, queried by haversine distance"""
+
+    def __init__(self, cell_degrees: float):
+        self.cell_degrees = cell_degrees
+        self.columns = math.ceil(360.0 / cell_degrees)
+        self.rows = math.ceil(180.0 / cell_degrees)
+        self.version = 0
+        self.lock = threading.Lock()
+        self._buckets: Dict[Cell, Bucket] = {}
+        self._cells: Dict[int, Cell] = {}
+
+    def __len__(self):
+        return len(self._cells)
+
+    def _cell(self, latitude: float, longitude: float) -> Cell:
+        row = min(int((latitude + 90.0) / self.cell_degrees), self.rows - 1)
+        column = min(int((longitude + 180.0) / self.cell_degrees), self.columns - 1)
+        return row, column
+
+    def add(self, location_id: int, latitude: float, longitude: float):
+        if location_id in self._cells:
+            self.remove(location_id)
+        cell = self._cell(latitude, longitude)
+        bucket = self._buckets.get(cell)
+        if bucket is None:
+            bucket = self._buckets[cell] = Bucket()
+        bucket.ids.append(location_id)
+        bucket.latitudes.append(latitude)
+        bucket.longitudes.append(longitude)
+        self._cells[location_id] = cell
+
+    def remove(self, location_id: int):
+        cell = self._cells.pop(location_id, None)
+        if cell is None:
+            return
+        bucket = self._buckets[cell]
+        # Swap with the last entry so removal does not shift the arrays
+        position = bucket.ids.index(location_id)
+        for values in (bucket.ids, bucket.latitudes, bucket.longitudes):
+            values[position] = values[-1]
+            values.pop()
+        if not bucket.ids:
+            del self._buckets[cell]
+
+    def _scan(self, heap: list, bucket: Bucket, k: int, latitude: float, longitude: float, radius_m: Optional[float]):
+        # heap holds (-distance, id) of the k best so far
+        for location_id, lat, lon in zip(bucket.ids, bucket.latitudes, bucket.longitudes):
+            distance = haversine_m(latitude, longitude, lat, lon)
+            if radius_m is not None and distance > radius_m:
+                continue
+            if len(heap) < k:
+                heapq.heappush(heap, (-distance, location_id))
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-distance, location_id))
+
+    def _ring(self, center: Cell, ring: int) -> Iterable[Cell]:
+        row0, column0 = center
+        for row in range(max(0, row0 - ring), min(self.rows - 1, row0 + ring) + 1):
+            edge = abs(row - row0) == ring
+            offsets = range(-ring, ring + 1) if edge else (-ring, ring)
+            for offset in offsets:
+                # Longitude wraps around the antimeridian
+                yield row, (column0 + offset) % self.columns
+
+    def _lower_bound_m(self, latitude: float, ring: int) -> float:
+        """Shortest distance from the query point to any cell outside ``ring``"""
+        gap = math.radians(ring * self.cell_degrees)
+        # Distance to the nearest meridian gap radians away, which is no more than the latitude gap
+        across = math.asin(min(1.0, math.cos(math.radians(latitude)) * math.sin(min(gap, math.pi / 2))))
+        return EARTH_RADIUS_M * min(gap, across)
+
+    def nearest(self, latitude: float, longitude: float, k: int,
+                radius_m: Optional[float] = None) -> List[Tuple[int, float]]:
+        """Up to ``k`` (id, distance in metres) pairs, nearest first"""
+        heap: list = []
+        if not self._buckets or k <= 0:
+            return []
+        center = self._cell(latitude, longitude)
+        ring = 0
+        while True:
+            side = 2 * ring + 1
+            if side > self.columns or side * side > len(self._buckets):
+                # The rings now cover more cells than there are buckets: finish with a plain scan
+                scanned = {cell for r in range(ring) for cell in self._ring(center, r)}
+                for cell, bucket in self._buckets.items():
+                    if cell not in scanned:
+                        self._scan(heap, bucket, k, latitude, longitude, radius_m)
+                break
+            for cell in self._ring(center, ring):
+                bucket = self._buckets.get(cell)
+                if bucket is not None:
+                    self._scan(heap, bucket, k, latitude, longitude, radius_m)
+            bound = self._lower_bound_m(latitude, ring)
+            if radius_m is not None and bound > radius_m:
+                break
+            if len(heap) == k and bound >= -heap[0][0]:
+                break
+            ring += 1
+        return sorted(((location_id, -distance) for distance, location_id in heap), key=lambda item: item[1])
+
+
+class NearbyIndexCache:
+    """Per-user PointIndex objects, least recently used evicted past ``max_points``"""
+
+    def __init__(self, cell_degrees: float, max_points: int):
+        self.cell_degrees = cell_degrees
+        self.max_points = max_points
+        self._indexes: "OrderedDict[int, PointIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"builds": 0, "catch_ups": 0, "evictions": 0}
+
+    def _build(self, db: Session, user_id: int, version: int) -> PointIndex:
+        index = PointIndex(self.cell_degrees)
+        rows = db.execute(
+            select(Location.id, Location.latitude, Location.longitude)
+            .where(Location.user_id == user_id)
+            .execution_options(yield_per=1000)
+        )
+        for location_id, latitude, longitude in rows:
+            index.add(location_id, latitude, longitude)
+        index.version = version
+        self.stats["builds"] += 1
+        return index
+
+    def _catch_up(self, db: Session, user_id: int, index: PointIndex, version: int):
+        pruned = db.execute(select(User.tombstones_pruned_version).where(User.id == user_id)).scalar() or 0
+        if index.version < pruned:
+            # Deletions since the index was built may have been pruned: start over
+            fresh = self._build(db, user_id, version)
+            index._buckets, index._cells, index.version = fresh._buckets, fresh._cells, fresh.version
+            return
+        # Re-applying a change is harmless, so rows newer than ``version`` may be seen early
+        upserts = db.execute(
+            select(Location.id, Location.latitude, Location.longitude)
+            .where(Location.user_id == user_id, Location.version > index.version)
+        ).all()
+        deletes = db.execute(
+            select(LocationTombstone.location_id)
+            .where(LocationTombstone.user_id == user_id, LocationTombstone.version > index.version)
+        ).scalars().all()
+        for location_id, latitude, longitude in upserts:
+            index.add(location_id, latitude, longitude)
+        for location_id in deletes:
+            index.remove(location_id)
+        index.version = version
+        self.stats["catch_ups"] += 1
+
+    def _evict(self):
+        total = sum(len(index) for index in self._indexes.values())
+        while total > self.max_points and len(self._indexes) > 1:
+            user_id, index = self._indexes.popitem(last=False)
+            total -= len(index)
+            self.stats["evictions"] += 1
+            logger.info(f"Evicted nearby index of user {user_id} ({len(index)} points)")
+
+    def nearest(self, db: Session, user_id: int, version: int, latitude: float, longitude: float, k: int,
+                radius_m: Optional[float] = None) -> List[Tuple[int, float]]:
+        """The user's ``k`` nearest locations as (id, distance in metres), nearest first
+
+        ``version`` is the user's current locations_version.
+        """
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+        if index is None:
+            index = self._build(db, user_id, version)
+            with self._lock:
+                # Keep the index another request may have built meanwhile
+                index = self._indexes.setdefault(user_id, index)
+                self._evict()
+        with index.lock:
+            if index.version < version:
+                self._catch_up(db, user_id, index, version)
+            return index.nearest(latitude, longitude, k, radius_m)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+nearby_index = NearbyIndexCache(cell_degrees=NEARBY_CELL_DEGREES, max_points=NEARBY_INDEX_MAX_POINTS)
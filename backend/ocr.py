@@ -0,0 +1,330 @@
+# OCR execution layer for Vibesy screenshot parsing
+#
+# Image preprocessing and Tesseract are CPU bound and block for seconds, so they
+# run in a dedicated process pool instead of on the event loop (or the shared
+# request threadpool). Everything submitted to the pool must be a top-level,
+# picklable function of this module.
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops, ImageEnhance, ImageFilter, ImageOps
+import pytesseract
+
+logger = logging.getLogger("vibesy")
+
+# Number of OCR worker processes (0 = one per CPU core)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or (os.cpu_count() or 1)
+
+# Images larger than this are downscaled before OCR (improves OCR performance)
+MAX_DIMENSION = 3000
+
+OCR_CONFIG = r'--oem 3 --psm {psm} -c preserve_interword_spaces=1'
+
+# Bump when preprocessing or the OCR passes change, so cached screenshot text is not reused
+OCR_VERSION = 2
+
+# Side of the difference hash confirming a perceptual cache hit, and the bits it may
+# differ by: re-encodes of a screenshot differ in ~20 bits, a changed character in ~200
+SIGNATURE_SIZE = 256
+SIGNATURE_MAX_DISTANCE = 64
+
+# How the OCR passes are scheduled:
+#   sequential - all passes one after another in a single worker (legacy behavior)
+#   parallel   - every pass dispatched to its own worker at once
+#   adaptive   - run the primary pass first and only launch the fallback passes
+#                when its confidence or the number of extracted locations is low
+OCR_POLICY = os.getenv("OCR_POLICY", "parallel")
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "70"))
+OCR_MIN_LOCATIONS = int(os.getenv("OCR_MIN_LOCATIONS", "2"))
+
+# (name, image variant, page segmentation mode); the first entry is the primary pass
+OCR_PASSES = [
+    ("block", "gray", 6),         # Standard block detection (best for screenshots)
+    ("sparse", "gray", 11),       # Sparse text detection (good for social media)
+    ("column", "gray", 4),        # Single column of text
+    ("color_block", "color", 6),  # Original enhanced image (not grayscale)
+]
+
+
+class OCREngineUnavailable(Exception):
+    """Raised when the Tesseract binary is not installed on the server."""
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    """Return the shared OCR process pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        # Spawn instead of fork: the server process runs threads and an event loop
+        context = multiprocessing.get_context("spawn")
+        _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=context)
+        logger.info(f"Started OCR process pool with {OCR_WORKERS} workers")
+    return _pool
+
+
+def shutdown_ocr_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run_in_ocr_pool(func, *args):
+    """Run a CPU-bound function in the OCR pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_ocr_pool(), func, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a huge image); start a fresh pool for the next request
+        logger.error("OCR process pool is broken, restarting it")
+        shutdown_ocr_pool()
+        raise
+
+
+def load_image(contents: bytes) -> Image.Image:
+    """Decode an uploaded image and normalize its mode and size"""
+    image = Image.open(io.BytesIO(contents))
+
+    # Convert to RGB if necessary
+    if image.mode not in ['RGB', 'L']:
+        image = image.convert('RGB')
+
+    # Resize if too large
+    if max(image.size) > MAX_DIMENSION:
+        ratio = MAX_DIMENSION / max(image.size)
+        new_size = tuple(int(dim * ratio) for dim in image.size)
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+    return image
+
+
+def preprocess_grayscale(image: Image.Image) -> Image.Image:
+    """Grayscale, sharpen and boost contrast for better text detection"""
+    image_gray = ImageOps.grayscale(image)
+
+    # Increase sharpness significantly
+    image_sharp = ImageEnhance.Sharpness(image_gray).enhance(3.0)
+
+    # Increase contrast significantly
+    image_contrast = ImageEnhance.Contrast(image_sharp).enhance(2.5)
+
+    # Apply slight blur to reduce noise, then sharpen
+    image_processed = image_contrast.filter(ImageFilter.MedianFilter(size=3))
+
+    # Final sharpening pass
+    return ImageEnhance.Sharpness(image_processed).enhance(2.0)
+
+
+def preprocess_color(image: Image.Image) -> Image.Image:
+    """Sharpen and boost contrast while keeping colors"""
+    image_color_sharp = ImageEnhance.Sharpness(image.convert('RGB')).enhance(2.5)
+    return ImageEnhance.Contrast(image_color_sharp).enhance(2.0)
+
+
+def merge_ocr_texts(all_texts: list) -> str:
+    """Combine the output of several OCR passes into one text"""
+    # Use the longest text as base
+    ocr_text = max(all_texts, key=len)
+
+    # Also append unique lines from other attempts
+    all_lines = set()
+    for text in all_texts:
+        all_lines.update(text.strip().split('\n'))
+
+    # Combine unique lines
+    combined_text = '\n'.join(sorted(all_lines, key=lambda x: len(x), reverse=True))
+    if len(combined_text) > len(ocr_text):
+        ocr_text = combined_text
+    return ocr_text
+
+
+def _difference_hash(image: Image.Image, size: int) -> bytes:
+    # One bit per pixel of a size x size grayscale thumbnail: brighter than its right-hand neighbour?
+    small = ImageOps.grayscale(image).resize((size + 1, size), Image.Resampling.LANCZOS)
+    # The margin keeps flat regions stable under compression noise
+    brighter = ImageChops.subtract(small.crop((0, 0, size, size)), small.crop((1, 0, size + 1, size)), offset=-8)
+    return brighter.point(lambda value: 255 if value else 0).convert("1").tobytes()
+
+
+def same_screenshot(signature: Optional[bytes], cached_signature: Optional[bytes]) -> bool:
+    """Whether a cache entry found by key really belongs to the uploaded image
+
+    Pixel keys identify an image exactly and carry no signature. Perceptual keys
+    are coarse enough that different screenshots share them, so their entries
+    are only reused when the finer signatures also agree.
+    """
+    if signature is None or cached_signature is None:
+        return signature is None and cached_signature is None
+    if len(signature) != len(cached_signature):
+        return False
+    distance = (int.from_bytes(signature, "big") ^ int.from_bytes(cached_signature, "big")).bit_count()
+    return distance <= SIGNATURE_MAX_DISTANCE
+
+
+def fingerprint_image(contents: bytes, mode: str = "pixels") -> Tuple[str, Optional[bytes]]:
+    """Cache key and confirmation signature for an uploaded image (executes in a worker process)
+
+    ``pixels`` hashes the decoded pixels, so the same image saved with different
+    metadata or PNG compression maps to one key; it needs no signature.
+    ``perceptual`` uses a 16x16 difference hash, which also matches lossy
+    re-encodes of the same screenshot but is shared by many different text
+    screenshots; the signature, a SIGNATURE_SIZE difference hash, tells those
+    apart (see same_screenshot).
+    """
+    image = Image.open(io.BytesIO(contents))
+    if mode == "perceptual":
+        small = ImageOps.grayscale(image).resize((17, 16), Image.Resampling.LANCZOS)
+        pixels = small.tobytes()
+        bits = 0
+        for row in range(16):
+            for col in range(16):
+                left = pixels[row * 17 + col]
+                # The margin keeps flat regions stable under compression noise
+                bits = (bits << 1) | (left > pixels[row * 17 + col + 1] + 8)
+        # Keep the coarse aspect ratio so crops of the same screen do not collide
+        aspect = round(image.size[0] / image.size[1], 1)
+        return f"ph:{bits:064x}:{aspect}", _difference_hash(image, SIGNATURE_SIZE)
+
+    image = image.convert('RGB') if image.mode not in ['RGB', 'L'] else image
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return f"px:{digest.hexdigest()}", None
+
+
+def _pack(image: Image.Image) -> tuple:
+    # Raw pixels are much cheaper to ship between processes than re-encoded files
+    return image.mode, image.size, image.tobytes()
+
+
+def _unpack(packed: tuple) -> Image.Image:
+    mode, size, data = packed
+    return Image.frombytes(mode, size, data)
+
+
+def _text_from_data(data: dict) -> str:
+    """Rebuild plain text lines from pytesseract image_to_data output"""
+    lines = {}
+    for i, word in enumerate(data["text"]):
+        if word and word.strip():
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            lines.setdefault(key, []).append(word)
+    return '\n'.join(' '.join(words) for words in lines.values())
+
+
+def _mean_confidence(data: dict) -> float:
+    confidences = [
+        float(conf) for word, conf in zip(data["text"], data["conf"])
+        if word and word.strip() and float(conf) >= 0
+    ]
+    return sum(confidences) / len(confidences) if confidences else 0.0
+
+
+def prepare_images(contents: bytes) -> dict:
+    """Decode and build the preprocessed image variants (executes in a worker process)"""
+    started = time.perf_counter()
+    image = load_image(contents)
+    variants = {
+        "gray": _pack(preprocess_grayscale(image)),
+        "color": _pack(preprocess_color(image)),
+    }
+    return {
+        "variants": variants,
+        "size": image.size,
+        "mode": image.mode,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def ocr_pass(packed_image: tuple, psm: int, with_confidence: bool = False) -> dict:
+    """Run a single Tesseract pass (executes in a worker process)"""
+    started = time.perf_counter()
+    image = _unpack(packed_image)
+    config = OCR_CONFIG.format(psm=psm)
+    confidence = None
+    try:
+        if with_confidence:
+            data = pytesseract.image_to_data(image, lang='eng', config=config, output_type=pytesseract.Output.DICT)
+            text = _text_from_data(data)
+            confidence = _mean_confidence(data)
+        else:
+            text = pytesseract.image_to_string(image, lang='eng', config=config)
+    except pytesseract.TesseractNotFoundError:
+        # pytesseract's own exception does not survive pickling across processes
+        raise OCREngineUnavailable("Tesseract OCR not installed on server")
+    return {"text": text, "confidence": confidence, "seconds": time.perf_counter() - started}
+
+
+def ocr_all_passes(contents: bytes) -> dict:
+    """Preprocess and run every pass in one worker, one after another (executes in a worker process)"""
+    prepared = prepare_images(contents)
+    passes = {
+        name: ocr_pass(prepared["variants"][variant], psm)
+        for name, variant, psm in OCR_PASSES
+    }
+    return {"prepared": prepared, "passes": passes}
+
+
+async def recognize(contents: bytes, count_locations=None, policy: Optional[str] = None) -> dict:
+    """Run the multi-pass OCR on an uploaded image according to the scheduling policy
+
+    ``count_locations`` maps OCR text to the number of extracted locations and is
+    used by the adaptive policy to decide whether the fallback passes are needed.
+    """
+    policy = policy or OCR_POLICY
+    started = time.perf_counter()
+    confidence = None
+
+    if policy == "sequential":
+        result = await run_in_ocr_pool(ocr_all_passes, contents)
+        prepared, passes = result["prepared"], result["passes"]
+    else:
+        prepared = await run_in_ocr_pool(prepare_images, contents)
+        variants = prepared["variants"]
+        passes = {}
+        pending = OCR_PASSES
+
+        if policy == "adaptive":
+            name, variant, psm = OCR_PASSES[0]
+            passes[name] = await run_in_ocr_pool(ocr_pass, variants[variant], psm, True)
+            confidence = passes[name]["confidence"]
+            pending = OCR_PASSES[1:]
+
+            primary_text = passes[name]["text"]
+            enough_locations = count_locations is None or count_locations(primary_text) >= OCR_MIN_LOCATIONS
+            if confidence >= OCR_MIN_CONFIDENCE and enough_locations:
+                pending = []
+            else:
+                logger.info(f"Primary OCR pass not conclusive (confidence {confidence:.1f}), running fallback passes")
+        elif policy != "parallel":
+            logger.warning(f"Unknown OCR_POLICY '{policy}', using parallel")
+
+        results = await asyncio.gather(
+            *(run_in_ocr_pool(ocr_pass, variants[variant], psm) for _, variant, psm in pending)
+        )
+        for (name, _, _), result in zip(pending, results):
+            passes[name] = result
+
+    timings = {"preprocess": round(prepared["seconds"] * 1000, 1)}
+    timings.update({name: round(result["seconds"] * 1000, 1) for name, result in passes.items()})
+    wall_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"OCR ({policy}) ran {len(passes)} passes in {wall_ms} ms: {timings}")
+
+    return {
+        "text": merge_ocr_texts([result["text"] for result in passes.values()]),
+        "size": prepared["size"],
+        "mode": prepared["mode"],
+        "policy": policy,
+        "passes": list(passes),
+        "confidence": confidence,
+        "timings_ms": timings,
+        "wall_ms": wall_ms,
+    }
@@ -0,0 +1,121 @@
+# Password hashing on a dedicated, bounded worker pool
+#
+# bcrypt is deliberately slow, so hashing runs on its own small thread pool
+# (bcrypt releases the GIL while it works) instead of the request threadpool
+# that serves every sync endpoint: a burst of logins queues here without
+# delaying location requests. At most PASSWORD_HASH_QUEUE hashes may be running
+# or waiting; callers beyond that get PasswordHasherBusy. Stored hashes made
+# with a different cost are rehashed with PASSWORD_HASH_ROUNDS on the next
+# successful login.
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger("vibesy")
+
+# bcrypt cost factor for new hashes; existing hashes migrate to it on login
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hashes running or waiting before new ones are turned away
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=PASSWORD_HASH_ROUNDS
+)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+
+
+def _truncate(password: str) -> str:
+    # bcrypt only looks at the first 72 bytes
+    if len(password.encode('utf-8')) > 72:
+        password = password[:72]
+    return password
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(_truncate(password))
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # If there's no stored hash, treat as invalid credentials
+    if not hashed_password:
+        logger.warning("Empty password hash for user during verify_password")
+        return False, None
+    try:
+        return pwd_context.verify_and_update(_truncate(password), hashed_password)
+    except Exception as e:
+        # Handle UnknownHashError from passlib gracefully without requiring static import
+        if e.__class__.__name__ == 'UnknownHashError':
+            logger.warning("Could not identify stored password hash format; rejecting login")
+            return False, None
+        logger.exception("Unexpected error during password verification: %s", e)
+        return False, None
+
+
+class PasswordHasher:
+    """Bounded thread pool running bcrypt hashes and verifications"""
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.stats = {"completed": 0, "rejected": 0, "rehashed": 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+            return self._executor
+
+    def _submit(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise PasswordHasherBusy(f"{self._pending} password hashes already queued")
+            self._pending += 1
+        future = self._get_executor().submit(func, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _future):
+        with self._lock:
+            self._pending -= 1
+            self.stats["completed"] += 1
+
+    def queue_depth(self) -> int:
+        return self._pending
+
+    async def hash(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(_hash, password))
+
+    def hash_blocking(self, password: str) -> str:
+        """Like hash(), for sync code paths"""
+        return self._submit(_hash, password).result()
+
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Return (valid, new hash or None); a new hash means the stored one should be replaced"""
+        valid, new_hash = await asyncio.wrap_future(self._submit(_verify_and_update, password, hashed_password))
+        if new_hash is not None:
+            self.stats["rehashed"] += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher(workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_QUEUE)
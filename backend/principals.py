@@ -0,0 +1,103 @@
+# Cache of verified bearer tokens
+#
+# Resolving a token means verifying a JWT signature and looking the user up;
+# the map polls every few seconds with the same token, so each worker keeps the
+# outcome (a small Principal) in a bounded LRU. Entries never outlive the
+# token's own expiry, expire after AUTH_CACHE_TTL seconds regardless, and are
+# dropped when the user's profile changes.
+#
+# Browsers cannot send headers when opening a WebSocket, so they authenticate
+# /ws/locations with a short-lived ticket instead of the bearer token. Tickets
+# are single use: claim_ticket() records each one in the shared cache database,
+# so a ticket is accepted once across all workers.
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Set
+
+from cache import get_cache_connection
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Seconds a /ws/locations ticket stays valid
+SOCKET_TICKET_TTL = int(os.getenv("SOCKET_TICKET_TTL", "30"))
+
+
+class Principal(NamedTuple):
+    """The authenticated user of a request, without a database row behind it"""
+    id: int
+    email: str
+
+
+class PrincipalCache:
+    """LRU of token -> Principal with per-entry expiry and per-user invalidation"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _drop(self, token: str):
+        principal, _ = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(principal.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[principal.id]
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                if entry[1] > time.time():
+                    self._entries.move_to_end(token)
+                    self.stats["hits"] += 1
+                    return entry[0]
+                self._drop(token)
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, token: str, principal: Principal, expires_at: Optional[float] = None):
+        """Remember a verified token until ``expires_at`` (the token's exp claim) or the TTL, whichever is sooner"""
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            if token in self._entries:
+                self._drop(token)
+            self._entries[token] = (principal, deadline)
+            self._tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._drop(token)
+                self.stats["invalidations"] += 1
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+
+def claim_ticket(ticket_id: str, expires_at: float) -> bool:
+    """Record a ticket as used; False if it was used before"""
+    conn = get_cache_connection()
+    conn.execute("CREATE TABLE IF NOT EXISTS used_tickets (id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+    # Expired tickets are rejected by their signature check, so their ids can go
+    conn.execute("DELETE FROM used_tickets WHERE expires_at < ?", (time.time(),))
+    try:
+        conn.execute("INSERT INTO used_tickets (id, expires_at) VALUES (?, ?)", (ticket_id, expires_at))
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+principal_cache = PrincipalCache(ttl=AUTH_CACHE_TTL, max_entries=AUTH_CACHE_SIZE)
@@ -0,0 +1,281 @@
+# Bounded-memory reads of a user's saved locations
+#
+# Lists are selected column by column (no ORM objects), ordered by id so
+# ``after_id`` works as a keyset cursor, and can be streamed to the client as a
+# JSON array in chunks instead of being built in memory first. Streams read
+# one keyset page per short session, so a slow client never holds a reader
+# connection while it downloads. Bounding-box
+# filters use the locations_rtree index on SQLite (see migration 3), text
+# search the locations_fts index (see migration 5). Lists can also be encoded
+# column-wise, as JSON arrays or packed binary, instead of one object per row.
+import csv
+import io
+import json
+import re
+import struct
+import sys
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, column, func, literal_column, or_, select, table
+from sqlalchemy.orm import Session
+
+from database import Location, SessionLocal, engine
+
+# R*Tree maintained by triggers on locations (SQLite only)
+locations_rtree = table(
+    "locations_rtree",
+    column("id"), column("min_user"), column("max_user"),
+    column("min_lon"), column("max_lon"), column("min_lat"), column("max_lat"),
+)
+USE_RTREE = engine.dialect.name == "sqlite"
+
+# FTS5 index over name, description and address, maintained by triggers (SQLite only)
+locations_fts = table("locations_fts", column("rowid"))
+USE_FTS = engine.dialect.name == "sqlite"
+# bm25 column weights: name, description, address, owner
+FTS_WEIGHTS = (10.0, 2.0, 4.0, 0.0)
+MAX_SEARCH_TERMS = 10
+
+# Fields a client may request with ?fields=, in response order
+LOCATION_FIELDS = ("id", "user_id", "name", "latitude", "longitude", "description", "address", "source_url")
+
+# Response encodings of GET /locations
+LOCATION_FORMATS = ("json", "columnar", "binary")
+# Encodings of /locations/export and their media types
+EXPORT_FORMATS = {
+    "geojson": "application/geo+json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# Binary format: magic, row count, byte length of the JSON trailer
+BINARY_HEADER = struct.Struct("<4sII")
+BINARY_MAGIC = b"VBL1"
+# Columns packed as arrays in the binary format; the rest go in the JSON trailer
+BINARY_COLUMNS = (("id", "I"), ("latitude", "f"), ("longitude", "f"))
+
+# Rows fetched from the database per round trip while streaming
+STREAM_BATCH_SIZE = 500
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Validate a comma-separated ?fields= value; ``id`` is always included"""
+    if not fields:
+        return list(LOCATION_FIELDS)
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested.difference(LOCATION_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add("id")
+    return [field for field in LOCATION_FIELDS if field in requested]
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """Parse ``minLon,minLat,maxLon,maxLat``; minLon > maxLon means the box crosses the antimeridian"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise ValueError("bbox must be minLon,minLat,maxLon,maxLat")
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise ValueError("bbox is out of range")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_search(q: str) -> List[str]:
+    """Split a search box value into words; the last one is matched as a prefix"""
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        raise ValueError("q must contain at least one word")
+    return terms[:MAX_SEARCH_TERMS]
+
+
+def _fts_query(user_id: int, terms: List[str]) -> str:
+    # Every term is quoted, so user input never reaches the FTS5 query syntax
+    words = [f'"{term}"' for term in terms]
+    words[-1] += "*"
+    return f"owner:u{user_id} AND " + " AND ".join(words)
+
+
+def search_locations(user_id: int, fields: List[str], terms: List[str], limit: int):
+    """The user's best ``limit`` matches for ``terms``, ranked by bm25 on SQLite"""
+    columns = [getattr(Location, field) for field in fields]
+    if not USE_FTS:
+        matches = [
+            or_(*(getattr(Location, name).ilike(f"%{term}%") for name in ("name", "description", "address")))
+            for term in terms
+        ]
+        return select(*columns).where(Location.user_id == user_id, *matches).order_by(Location.id).limit(limit)
+    fts = literal_column("locations_fts")
+    ranked = (
+        select(locations_fts.c.rowid.label("id"), func.bm25(fts, *FTS_WEIGHTS).label("rank"))
+        .where(fts.op("MATCH")(_fts_query(user_id, terms)))
+        .order_by("rank")
+        .limit(limit)
+        .subquery()
+    )
+    return (
+        select(*columns)
+        .join(ranked, ranked.c.id == Location.id)
+        .where(Location.user_id == user_id)
+        .order_by(ranked.c.rank)
+    )
+
+
+def _bbox_filter(user_id: int, bbox: Tuple[float, float, float, float]):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lon_ranges = [(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180.0), (-180.0, max_lon)]
+    # Exact comparison on the real columns: the R*Tree stores 32-bit floats and may over-select slightly
+    exact = and_(
+        Location.user_id == user_id,
+        Location.latitude.between(min_lat, max_lat),
+        or_(*(Location.longitude.between(low, high) for low, high in lon_ranges)),
+    )
+    if not USE_RTREE:
+        return exact
+    rtree = locations_rtree.c
+    # The user slab only narrows the search: above 2**24 its rounded bounds span neighbouring
+    # ids, so it is matched by overlap and ownership is checked on locations.user_id above
+    candidates = select(rtree.id).where(
+        rtree.max_user >= user_id, rtree.min_user <= user_id,
+        rtree.max_lat >= min_lat, rtree.min_lat <= max_lat,
+        or_(*(and_(rtree.max_lon >= low, rtree.min_lon <= high) for low, high in lon_ranges)),
+    )
+    return and_(Location.id.in_(candidates), exact)
+
+
+def select_locations(user_id: int, fields: List[str], after_id: Optional[int] = None, limit: Optional[int] = None,
+                     bbox: Optional[Tuple[float, float, float, float]] = None):
+    """Keyset-paginated query over the (user_id, id) index, or the R*Tree when ``bbox`` is given"""
+    statement = select(*(getattr(Location, field) for field in fields)).where(Location.user_id == user_id)
+    if bbox is not None:
+        statement = statement.where(_bbox_filter(user_id, bbox))
+    if after_id is not None:
+        statement = statement.where(Location.id > after_id)
+    statement = statement.order_by(Location.id)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+def iter_rows(db: Session, statement, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[dict]:
+    for row in db.execute(statement.execution_options(yield_per=batch_size)):
+        yield dict(row._mapping)
+
+
+def stream_locations(user_id: int, fields: List[str], after_id: Optional[int] = None,
+                     bbox: Optional[Tuple[float, float, float, float]] = None,
+                     batch_size: int = STREAM_BATCH_SIZE) -> Iterator[dict]:
+    """A user's locations in id order, fetched a keyset page at a time
+
+    Each page is read in its own session that is closed before the rows are
+    yielded, so the connection goes back to the pool while the response is sent.
+    """
+    columns = fields if "id" in fields else [*fields, "id"]
+    while True:
+        db = SessionLocal()
+        try:
+            rows = [dict(row._mapping) for row in db.execute(select_locations(user_id, columns, after_id, batch_size, bbox))]
+        finally:
+            db.close()
+        if not rows:
+            return
+        after_id = rows[-1]["id"]
+        for row in rows:
+            if columns is not fields:
+                del row["id"]
+            yield row
+        if len(rows) < batch_size:
+            return
+
+
+def json_array_chunks(rows: Iterator[dict], rows_per_chunk: int = STREAM_BATCH_SIZE) -> Iterator[str]:
+    """Serialize rows as one JSON array, a few hundred rows per chunk"""
+    yield "["
+    chunk, first = [], True
+    for row in rows:
+        chunk.append(json.dumps(row))
+        if len(chunk) == rows_per_chunk:
+            yield ("" if first else ",") + ",".join(chunk)
+            chunk, first = [], False
+    if chunk:
+        yield ("" if first else ",") + ",".join(chunk)
+    yield "]"
+
+
+def _batched(items: Iterator[str], size: int) -> Iterator[str]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def ndjson_chunks(rows: Iterator[dict], rows_per_chunk: int = STREAM_BATCH_SIZE) -> Iterator[str]:
+    """One JSON object per line"""
+    return _batched((json.dumps(row) + "\n" for row in rows), rows_per_chunk)
+
+
+def geojson_chunks(rows: Iterator[dict], rows_per_chunk: int = STREAM_BATCH_SIZE) -> Iterator[str]:
+    """A GeoJSON FeatureCollection of Point features; the other fields become properties"""
+    def features():
+        for index, row in enumerate(rows):
+            properties = {key: value for key, value in row.items() if key not in ("latitude", "longitude")}
+            feature = {
+                "type": "Feature",
+                "id": row["id"],
+                "geometry": {"type": "Point", "coordinates": [row["longitude"], row["latitude"]]},
+                "properties": properties,
+            }
+            yield ("," if index else "") + json.dumps(feature)
+
+    yield '{"type":"FeatureCollection","features":['
+    yield from _batched(features(), rows_per_chunk)
+    yield "]}"
+
+
+def csv_chunks(rows: Iterator[dict], fields: List[str], rows_per_chunk: int = STREAM_BATCH_SIZE) -> Iterator[str]:
+    """CSV with a header row"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+    writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def fetch_columns(db: Session, statement, fields: List[str]) -> Dict[str, list]:
+    """Run a column-projected query and return one list per field"""
+    rows = db.execute(statement).all()
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    return {field: list(values) for field, values in zip(fields, columns)}
+
+
+def pack_columns(columns: Dict[str, list]) -> bytes:
+    """Encode columns in the binary location format
+
+    Little-endian: the header (magic ``VBL1``, uint32 row count, uint32 trailer
+    length), then ids as uint32, latitudes and longitudes as float32, then the
+    remaining columns as a UTF-8 JSON object of arrays. Always includes id,
+    latitude and longitude.
+    """
+    count = len(columns["id"])
+    packed = []
+    for field, typecode in BINARY_COLUMNS:
+        values = array(typecode, columns[field])
+        if sys.byteorder == "big":
+            values.byteswap()
+        packed.append(values.tobytes())
+    packed_fields = {field for field, _ in BINARY_COLUMNS}
+    trailer = json.dumps(
+        {field: values for field, values in columns.items() if field not in packed_fields},
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return BINARY_HEADER.pack(BINARY_MAGIC, count, len(trailer)) + b"".join(packed) + trailer
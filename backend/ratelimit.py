@@ -0,0 +1,132 @@
+# Rate limiting and request coalescing for outbound calls
+#
+# TokenBucket limits a single worker process; SQLiteTokenBucket keeps its state
+# in the shared cache database so every uvicorn worker draws from one budget.
+# Callers only sleep when the bucket is actually empty.
+import asyncio
+import time
+
+from cache import get_cache_connection
+
+
+class TokenBucket:
+    """In-process async token bucket allowing ``rate`` calls per second with bursts up to ``burst``"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _take(self) -> float:
+        """Take a token if one is available; otherwise return the seconds until one is"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        # The lock hands out tokens in arrival order
+        async with self._lock:
+            while True:
+                wait = self._take()
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """Token bucket shared by all processes through a row in the cache database"""
+
+    def __init__(self, name: str, rate: float, burst: int = 1):
+        super().__init__(rate, burst)
+        self.name = name
+        self._schema_ready = False
+
+    def _take(self) -> float:
+        conn = get_cache_connection()
+        if not self._schema_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._schema_ready = True
+
+        # BEGIN IMMEDIATE takes the write lock, so the read-modify-write is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limits WHERE name = ?", (self.name,)).fetchone()
+            tokens, updated_at = row if row else (float(self.burst), now)
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.name, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                wait = await asyncio.to_thread(self._take)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution
+
+    Every caller awaiting a key that is already in flight receives the result
+    (or exception) of the first call instead of starting its own.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key: str, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one cancelled caller does not cancel the shared call for the others
+        return await asyncio.shield(task)
+
+
+class Debouncer:
+    """Let only the last of a rapid series of calls for the same key through
+
+    Each call waits ``delay`` seconds; it proceeds only if no newer call for
+    its key arrived meanwhile, so typing "p", "pa", "par" sends one lookup.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._latest = {}
+
+    async def settle(self, key) -> bool:
+        """Wait out the delay; True if this is still the latest call for ``key``"""
+        marker = object()
+        self._latest[key] = marker
+        await asyncio.sleep(self.delay)
+        if self._latest.get(key) is not marker:
+            return False
+        del self._latest[key]
+        return True
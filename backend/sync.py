@@ -0,0 +1,112 @@
+# Change tracking for a user's saved locations
+#
+# Every write to a user's locations bumps users.locations_version inside the
+# same transaction and stamps the changed rows (or a tombstone for deleted
+# ones) with the new version. The version doubles as the ETag of the user's
+# location list and as the cursor for /locations/changes.
+#
+# Tombstones are kept for TOMBSTONE_RETENTION_DAYS. Pruning records the newest
+# pruned version per user, and a client whose cursor is older than that gets
+# a full resync instead of a delta that would miss deletions.
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from clusters import record_location_changes
+from database import Location, LocationTombstone, User
+
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+# Seconds between pruning runs in each worker
+TOMBSTONE_PRUNE_INTERVAL = float(os.getenv("TOMBSTONE_PRUNE_INTERVAL", "3600"))
+
+
+def next_locations_version(db: Session, user_id: int) -> int:
+    """Increment and return the user's locations version (call inside the writing transaction)"""
+    return db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(locations_version=User.locations_version + 1)
+        .returning(User.locations_version)
+    ).scalar_one()
+
+
+def current_locations_version(db: Session, user_id: int) -> Optional[int]:
+    """The user's locations_version, or None if the user does not exist"""
+    return db.execute(select(User.locations_version).where(User.id == user_id)).scalar()
+
+
+def locations_versions(db: Session, user_ids: Iterable[int]) -> Dict[int, int]:
+    """locations_version of each of the given users that exists"""
+    return dict(db.execute(select(User.id, User.locations_version).where(User.id.in_(list(user_ids)))).all())
+
+
+def tombstones_pruned_version(db: Session, user_id: int) -> int:
+    """Newest version whose deletions may no longer be reported; older cursors need a reset"""
+    return db.execute(select(User.tombstones_pruned_version).where(User.id == user_id)).scalar() or 0
+
+
+def prune_tombstones(db: Session, older_than: datetime) -> int:
+    """Delete tombstones recorded before ``older_than`` (naive UTC) and commit; returns how many"""
+    pruned = db.execute(
+        select(LocationTombstone.user_id, func.max(LocationTombstone.version))
+        .where(LocationTombstone.deleted_at < older_than)
+        .group_by(LocationTombstone.user_id)
+    ).all()
+    for user_id, version in pruned:
+        db.execute(
+            update(User)
+            .where(User.id == user_id, User.tombstones_pruned_version < version)
+            .values(tombstones_pruned_version=version)
+        )
+    deleted = db.execute(delete(LocationTombstone).where(LocationTombstone.deleted_at < older_than)).rowcount
+    db.commit()
+    return deleted
+
+
+def insert_locations(db: Session, user_id: int, rows: List[dict]) -> Tuple[List[int], int]:
+    """Insert location rows as one change and return (ids, version); the caller commits"""
+    version = next_locations_version(db, user_id)
+    for row in rows:
+        row["user_id"] = user_id
+        row["version"] = version
+    # One multi-row INSERT ... RETURNING for the whole batch
+    result = db.execute(insert(Location).returning(Location.id, sort_by_parameter_order=True), rows)
+    ids = list(result.scalars())
+    record_location_changes(db, user_id, version, added=[
+        (location_id, row["latitude"], row["longitude"]) for location_id, row in zip(ids, rows)
+    ])
+    return ids, version
+
+
+def added_event(version: int, ids: List[int], rows: List[dict]) -> dict:
+    """Location event announcing rows saved by insert_locations"""
+    return {
+        "type": "add",
+        "cursor": version,
+        "locations": [
+            {"id": location_id, **{key: value for key, value in row.items() if key != "version"}}
+            for location_id, row in zip(ids, rows)
+        ]
+    }
+
+
+def locations_etag(user_id: int, version: int, variant: Optional[str] = None) -> str:
+    # Weak: the same version may be serialized differently by different endpoints
+    suffix = f".{variant}" if variant else ""
+    return f'W/"{user_id}.{version}{suffix}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match covers ``etag``"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Compare weakly: W/"x" and "x" are the same tag
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
@@ -0,0 +1,41 @@
+# Test setup: import the backend modules against throwaway databases, and
+# shared fixtures for tests that go through the API as a signed-in user
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_tmp = tempfile.mkdtemp(prefix="vibesy-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'vibesy.db')}")
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(_tmp, "vibesy_cache.db"))
+os.environ.setdefault("GEOCODE_RATE_LIMITER", "local")
+# Cheap hashes: the tests log in, they do not measure bcrypt
+os.environ.setdefault("PASSWORD_HASH_ROUNDS", "4")
+
+_users = itertools.count(1)
+
+
+@pytest.fixture
+def client():
+    """A test client signed in as a newly registered user"""
+    # Imported here so the environment above is in place first
+    import main
+
+    client = TestClient(main.app)
+    email = f"user-{next(_users)}@example.com"
+    token = client.post("/register", json={"email": email, "password": "secret"}).json()["access_token"]
+    client.headers["Authorization"] = f"Bearer {token}"
+    return client
+
+
+def add_location(client, name: str = "pin", latitude: float = 1.0, longitude: float = 2.0) -> dict:
+    """Save a location through POST /locations and return it"""
+    response = client.post("/locations", json={"name": name, "latitude": latitude, "longitude": longitude})
+    assert response.status_code == 200
+    return response.json()
@@ -0,0 +1,62 @@
+import pytest
+from fastapi.testclient import TestClient
+from passlib.context import CryptContext
+
+import main
+import passwords
+from database import SessionLocal, User
+from passwords import password_hasher
+from principals import PrincipalCache
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def no_demo_user():
+    db = SessionLocal()
+    db.query(User).filter(User.email == "demo@vibesy.app").delete()
+    db.commit()
+    db.close()
+
+
+@pytest.mark.parametrize("request_demo", [
+    lambda client: client.get("/demo-login"),
+    lambda client: client.get("/locations", headers={"Authorization": "Bearer demo"}),
+])
+def test_demo_user_creation_reports_busy_hasher(client, no_demo_user, monkeypatch, request_demo):
+    # The demo token must not be answered from an earlier test's cached principal
+    monkeypatch.setattr(main, "principal_cache", PrincipalCache(ttl=60, max_entries=10))
+    monkeypatch.setattr(password_hasher, "max_queue", 0)
+    response = request_demo(client)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    monkeypatch.setattr(password_hasher, "max_queue", 32)
+    assert request_demo(client).status_code == 200
+
+
+def stored_hash(email):
+    db = SessionLocal()
+    try:
+        return db.query(User.password_hash).filter(User.email == email).scalar()
+    finally:
+        db.close()
+
+
+def test_login_rehashes_passwords_made_with_another_cost(client, monkeypatch):
+    email = "rehash@example.com"
+    assert client.post("/register", json={"email": email, "password": "secret"}).status_code == 200
+    assert stored_hash(email).startswith("$2b$04$")
+
+    monkeypatch.setattr(passwords, "pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=12))
+    assert client.post("/login", json={"email": email, "password": "secret"}).status_code == 200
+    rehashed = stored_hash(email)
+    assert rehashed.startswith("$2b$12$")
+    assert passwords.pwd_context.verify("secret", rehashed)
+
+    # The new hash already has the configured cost, so it is kept
+    assert client.post("/login", json={"email": email, "password": "secret"}).status_code == 200
+    assert stored_hash(email) == rehashed
@@ -0,0 +1,43 @@
+import uuid
+
+from cache import GeocodeCache, GeocodeSearchCache
+
+
+def fresh(cache_class):
+    # A uniquely named query keeps tests independent of the shared cache table
+    return cache_class(ttl=60, negative_ttl=60, memory_size=2), f"Query {uuid.uuid4().hex}"
+
+
+def test_geocode_cache_serves_found_and_negative_entries_from_both_tiers():
+    cache, query = fresh(GeocodeCache)
+    missing = query + " nowhere"
+    assert cache.get(query) == (False, None)
+
+    place = {"latitude": 1.5, "longitude": 2.5, "address": "Somewhere"}
+    cache.put(query, place)
+    cache.put(missing, None)
+    assert cache.get(query) == (True, place)
+
+    cache._memory.clear()
+    assert cache.get(f"  {query.upper()} ") == (True, place)
+    assert cache.get(missing) == (True, None)
+    assert cache.stats == {"memory_hits": 1, "db_hits": 2, "misses": 1}
+
+
+def test_search_cache_keeps_empty_results_apart_from_misses():
+    cache, query = fresh(GeocodeSearchCache)
+    assert cache.get(query) is None
+
+    cache.put(query, [])
+    cache._memory.clear()
+    assert cache.get(query) == []
+
+
+def test_expired_entries_are_misses():
+    cache, query = fresh(GeocodeSearchCache)
+    cache.ttl = -1
+    cache.put(query, [{"address": "gone"}])
+    assert cache.get(query) is None
+
+    cache._memory.clear()
+    assert cache.get(query) is None
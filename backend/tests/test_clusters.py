@@ -0,0 +1,98 @@
+import random
+
+from sqlalchemy import select
+
+from clusters import _aggregate, build_clusters
+from conftest import add_location
+from database import ClusterState, Location, LocationCluster, SessionLocal
+from sync import next_locations_version
+
+WORLD = "-180,-85,180,85"
+
+
+def add(client, latitude, longitude):
+    return add_location(client, latitude=latitude, longitude=longitude)
+
+
+def cells(user_id):
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(LocationCluster).where(LocationCluster.user_id == user_id)).scalars()
+        return {
+            (row.zoom, row.cell_x, row.cell_y): (row.count, round(row.latitude_sum, 6), round(row.longitude_sum, 6),
+                                                 row.representative_id)
+            for row in rows
+        }
+    finally:
+        db.close()
+
+
+def test_incremental_updates_match_a_rebuild(client):
+    generator = random.Random(7)
+    # Pins packed around two cities, so cells hold several locations at most zoom levels
+    centers = [(48.85, 2.35), (40.71, -74.0)]
+    saved = [add(client, lat + generator.uniform(-0.05, 0.05), lon + generator.uniform(-0.05, 0.05))
+             for lat, lon in centers for _ in range(6)]
+    user_id = saved[0]["user_id"]
+    assert sum(cluster["count"] for cluster in client.get(
+        "/locations/clusters", params={"bbox": WORLD, "zoom": 0}).json()) == len(saved)
+
+    # Writes after the first build update the cells in place
+    for location in saved[::3]:
+        assert client.delete(f"/locations/{location['id']}").status_code == 200
+    saved += [add(client, 48.86, 2.34), add(client, -33.87, 151.21)]
+    remaining = {location["id"] for location in saved} - {location["id"] for location in saved[:12:3]}
+
+    incremental = cells(user_id)
+    db = SessionLocal()
+    try:
+        version = db.get(ClusterState, user_id).version
+        build_clusters(db, user_id)
+        assert db.get(ClusterState, user_id).version == version
+    finally:
+        db.close()
+    rebuilt = cells(user_id)
+
+    assert incremental.keys() == rebuilt.keys()
+    for key, (count, latitude_sum, longitude_sum, representative) in incremental.items():
+        assert (count, latitude_sum, longitude_sum) == rebuilt[key][:3]
+        # A removed representative is replaced by another location of the same cell
+        assert representative in remaining
+    total = client.get("/locations/clusters", params={"bbox": WORLD, "zoom": 0}).json()
+    assert sum(cluster["count"] for cluster in total) == len(remaining)
+
+
+def test_clusters_rebuild_when_they_fall_behind(client):
+    location = add(client, 10.0, 10.0)
+    client.get("/locations/clusters", params={"bbox": WORLD, "zoom": 3})
+    db = SessionLocal()
+    try:
+        # A write that bypasses record_location_changes
+        db.add(Location(user_id=location["user_id"], name="raw", latitude=10.0, longitude=10.0))
+        next_locations_version(db, location["user_id"])
+        db.commit()
+    finally:
+        db.close()
+    clusters = client.get("/locations/clusters", params={"bbox": WORLD, "zoom": 3}).json()
+    assert [cluster["count"] for cluster in clusters] == [2]
+
+
+def test_sql_build_matches_the_python_aggregation(client):
+    user_id = add_location(client, latitude=0.0, longitude=0.0)["user_id"]
+    generator = random.Random(3)
+    points = [(generator.uniform(-90, 90), generator.uniform(-180, 180)) for _ in range(300)]
+    # Edges of the projection: poles, antimeridian, the equator and the prime meridian
+    points += [(90.0, 180.0), (-90.0, -180.0), (85.06, 0.0), (-85.06, 179.999999), (0.0, -180.0), (0.0, 0.0)]
+    db = SessionLocal()
+    try:
+        db.add_all(Location(user_id=user_id, name="p", latitude=lat, longitude=lon) for lat, lon in points)
+        next_locations_version(db, user_id)
+        db.commit()
+        build_clusters(db, user_id)
+        expected = _aggregate(db.execute(
+            select(Location.id, Location.latitude, Location.longitude).where(Location.user_id == user_id)
+        ).all())
+    finally:
+        db.close()
+    expected = {key: (count, round(lat, 6), round(lon, 6), rep) for key, (count, lat, lon, rep) in expected.items()}
+    assert cells(user_id) == expected
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import main
+from conftest import add_location
+from database import SessionLocal
+from events import LocationEventBroker
+from sync import next_locations_version
+
+
+async def next_event(queue):
+    return await asyncio.wait_for(queue.get(), timeout=1)
+
+
+def test_version_poll_reports_changes_from_other_workers():
+    versions = {1: 3, 2: 8}
+    reads = []
+
+    def read_versions(user_ids):
+        reads.append(sorted(user_ids))
+        return {user_id: versions[user_id] for user_id in user_ids}
+
+    async def run():
+        broker = LocationEventBroker(queue_size=10)
+        first = broker.subscribe(1, version=3)
+        second = broker.subscribe(2, version=8)
+        watcher = asyncio.create_task(broker.watch_versions(read_versions, interval=0.01))
+        try:
+            # Another worker commits a change for user 1
+            versions[1] = 4
+            assert await next_event(first) == {"type": "changed", "cursor": 4}
+            # A change this worker already pushed is not announced again
+            broker.publish(1, {"type": "delete", "cursor": 5, "ids": [9]})
+            versions[1] = 5
+            assert await next_event(first) == {"type": "delete", "cursor": 5, "ids": [9]}
+            await asyncio.sleep(0.05)
+            assert first.empty() and second.empty()
+        finally:
+            watcher.cancel()
+        return reads
+
+    reads = asyncio.run(run())
+    # One query per poll covers every connected user
+    assert reads and all(user_ids == [1, 2] for user_ids in reads)
+
+
+def test_version_poll_reads_committed_versions(client):
+    location = add_location(client)
+    user_id = location["user_id"]
+    db = SessionLocal()
+    try:
+        version = next_locations_version(db, user_id)
+        db.commit()
+    finally:
+        db.close()
+    assert main._read_locations_versions([user_id, -1]) == {user_id: version}
+
+
+def test_socket_accepts_the_token_only_in_a_header(client):
+    token = client.headers["Authorization"][7:]
+    anonymous = TestClient(main.app)
+    with anonymous.websocket_connect("/ws/locations", headers={"Authorization": f"Bearer {token}"}) as socket:
+        assert socket.receive_json()["type"] == "hello"
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with anonymous.websocket_connect(f"/ws/locations?token={token}") as socket:
+            socket.receive_json()
+    assert closed.value.code == 1008
+
+
+def test_socket_ticket_is_single_use(client):
+    ticket = client.post("/ws/locations/ticket").json()["ticket"]
+    anonymous = TestClient(main.app)
+    with anonymous.websocket_connect(f"/ws/locations?ticket={ticket}") as socket:
+        assert socket.receive_json()["type"] == "hello"
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with anonymous.websocket_connect(f"/ws/locations?ticket={ticket}") as socket:
+            socket.receive_json()
+    assert closed.value.code == 1008
+    # A bearer token is not a ticket
+    with pytest.raises(WebSocketDisconnect):
+        with anonymous.websocket_connect(f"/ws/locations?ticket={client.headers['Authorization'][7:]}") as socket:
+            socket.receive_json()
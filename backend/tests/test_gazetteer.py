@@ -0,0 +1,37 @@
+import pytest
+
+from gazetteer import gazetteer
+
+
+def name_of(query):
+    place = gazetteer.lookup(query)
+    return place and place["name"]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("LA", "Los Angeles"),
+    ("SF", "San Francisco"),
+    ("KL", "Kuala Lumpur"),
+    ("NYC", "New York"),
+    ("Nice", "Nice"),
+    ("Split", "Split"),
+    ("Bath", "Bath"),
+    ("Rio", "Rio de Janeiro"),
+    ("Como", "Lake Como"),
+    ("Canton", "Guangzhou"),
+    ("los angeles", "Los Angeles"),
+    ("  Kuala   Lumpur. ", "Kuala Lumpur"),
+])
+def test_lookup_matches(query, expected):
+    assert name_of(query) == expected
+
+
+@pytest.mark.parametrize("query", ["la", "La", "sf", "kl", "nice", "split", "bath", "rio", "como", "canton"])
+def test_short_and_common_word_names_need_their_casing(query):
+    assert gazetteer.lookup(query) is None
+
+
+def test_country_qualifier_allows_any_casing():
+    assert name_of("nice, france") == "Nice"
+    assert name_of("la, us") == "Los Angeles"
+    assert gazetteer.lookup("nice, italy") is None
@@ -0,0 +1,20 @@
+import pytest
+
+from geocoding import Geocoder, NominatimGeocoder, create_geocoder
+
+
+def test_geocoder_backends_must_implement_search():
+    class Incomplete(Geocoder):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_known_backend_is_created():
+    assert isinstance(create_geocoder("nominatim"), NominatimGeocoder)
+
+
+def test_unknown_backend_names_the_valid_ones():
+    with pytest.raises(ValueError, match="'nominatom'.*valid backends: nominatim"):
+        create_geocoder("nominatom")
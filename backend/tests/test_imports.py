@@ -0,0 +1,177 @@
+import gc
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from imports import iter_geojson, iter_kml, normalize_row
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_normalize_row_coerces_scalars():
+    row = normalize_row({"name": 42, "latitude": "1.5", "longitude": 2, "description": 3.0, "source_url": " http://x "})
+    assert row["name"] == "42"
+    assert (row["latitude"], row["longitude"]) == (1.5, 2.0)
+    assert row["description"] == "3.0"
+    assert row["source_url"] == "http://x"
+
+
+@pytest.mark.parametrize("raw, message", [
+    ({"name": "A", "description": {"a": 1}}, "description must be text"),
+    ({"name": "A", "address": ["x"]}, "address must be text"),
+    ({"name": "A", "source_url": {"href": "x"}}, "source_url must be text"),
+    ({"name": {"en": "A"}}, "name must be text"),
+    ({"name": "A", "latitude": [1], "longitude": 2}, "coordinates are not numbers"),
+    ({"name": "A", "latitude": "nan", "longitude": 2}, "coordinates are out of range"),
+    ({"name": "A", "latitude": 1}, "latitude and longitude must be given together"),
+    ({"description": "no name"}, "missing name"),
+])
+def test_normalize_row_rejects_bad_fields(raw, message):
+    with pytest.raises(ValueError, match=message):
+        normalize_row(raw)
+
+
+def test_normalize_row_drops_long_urls_and_falls_back_to_address():
+    row = normalize_row({"address": "1 Main St", "source_url": "http://" + "x" * 600})
+    assert row["name"] == "1 Main St"
+    assert row["latitude"] is None
+    assert row["source_url"] is None
+
+
+def test_geojson_feature_with_object_description_is_a_row_error(tmp_path):
+    features = [
+        {"type": "Feature", "properties": {"name": "Good"}, "geometry": {"type": "Point", "coordinates": [2, 48]}},
+        {"type": "Feature", "properties": {"name": "Bad", "description": {"a": 1}},
+         "geometry": {"type": "Point", "coordinates": [2, 48]}},
+    ]
+    path = _write(tmp_path, "places.geojson", json.dumps({"type": "FeatureCollection", "features": features}))
+    rows = list(iter_geojson(path))
+    assert normalize_row(rows[0])["name"] == "Good"
+    with pytest.raises(ValueError):
+        normalize_row(rows[1])
+
+
+@pytest.mark.parametrize("feature, message", [
+    ({"type": "Feature", "properties": {"name": "Bad"}, "geometry": [2, 48]}, "geometry must be an object"),
+    ({"type": "Feature", "properties": ["Bad"], "geometry": None}, "properties must be an object"),
+])
+def test_geojson_feature_with_malformed_members_is_a_row_error(tmp_path, feature, message):
+    path = _write(tmp_path, "places.geojson", json.dumps({"type": "FeatureCollection", "features": [feature]}))
+    (row,) = iter_geojson(path)
+    with pytest.raises(ValueError, match=message):
+        normalize_row(row)
+
+
+def test_kml_placemarks_are_released_while_streaming(tmp_path):
+    count = 5000
+    placemarks = "".join(
+        f"<Placemark><name>P{i}</name><Point><coordinates>{i % 180},{i % 90},0</coordinates></Point></Placemark>"
+        for i in range(count)
+    )
+    path = _write(
+        tmp_path, "places.kml",
+        '<?xml version="1.0"?><kml xmlns="http://www.opengis.net/kml/2.2">'
+        f"<Document><Folder><name>Saved</name>{placemarks}</Folder></Document></kml>"
+    )
+
+    def live_placemarks():
+        gc.collect()
+        return sum(
+            1 for obj in gc.get_objects()
+            if isinstance(obj, ElementTree.Element) and obj.tag.endswith("Placemark")
+        )
+
+    rows = iter_kml(path)
+    for read in range(1, count + 1):
+        row = next(rows)
+        if read in (1000, 2500, 4000):
+            # Only the parser's read-ahead stays alive, not every Placemark read so far
+            assert live_placemarks() < 400
+    assert row == {"name": f"P{count - 1}", "longitude": str((count - 1) % 180), "latitude": str((count - 1) % 90)}
+    assert list(rows) == []
+
+
+def test_rows_the_database_rejects_are_skipped(monkeypatch):
+    import imports
+    from database import ImportJob, Location, SessionLocal, User, create_tables
+
+    create_tables()
+    db = SessionLocal()
+    user = User(email="import-test@example.com", password_hash="x")
+    db.add(user)
+    db.flush()
+    job = ImportJob(user_id=user.id, format="csv")
+    db.add(job)
+    db.commit()
+    user_id, job_id = user.id, job.id
+    db.close()
+
+    real_insert = imports.insert_locations
+
+    def insert_locations(db, user_id, rows):
+        if any(row["name"] == "Boom" for row in rows):
+            raise imports.SQLAlchemyError("driver detail that must not reach the client")
+        return real_insert(db, user_id, rows)
+
+    monkeypatch.setattr(imports, "insert_locations", insert_locations)
+    rows = [normalize_row({"name": name, "latitude": 1, "longitude": 2}) for name in ("A", "Boom", "B")]
+    progress = imports._Progress()
+    progress.rows_read = 3
+    imports._save_batch(job_id, user_id, rows, [1, 2, 3], progress)
+    imports._set_status(job_id, progress, "done")
+
+    db = SessionLocal()
+    saved = sorted(name for (name,) in db.query(Location.name).filter(Location.user_id == user_id))
+    report = imports.job_to_dict(db.get(ImportJob, job_id))
+    db.close()
+    assert saved == ["A", "B"]
+    assert (report["imported"], report["skipped"]) == (2, 1)
+    assert report["errors"] == [{"row": 2, "error": "could not be saved"}]
+
+
+def test_jobs_of_exited_workers_are_failed_at_startup():
+    import imports
+    from database import ImportJob, SessionLocal, User, create_tables
+
+    create_tables()
+    db = SessionLocal()
+    user = User(email="abandoned-import@example.com", password_hash="x")
+    db.add(user)
+    db.flush()
+    # The parent of the test process is alive; PID 2**22 + 1 is above Linux's pid_max
+    workers = {
+        "running": f"{imports.WORKER_HOST}:{2 ** 22 + 1}",
+        "queued": None,
+        "live": f"{imports.WORKER_HOST}:{os.getppid()}",
+        "elsewhere": "another-host:1",
+    }
+    jobs = {}
+    for label, worker in workers.items():
+        status = "queued" if label == "queued" else "running"
+        jobs[label] = ImportJob(user_id=user.id, format="csv", status=status, worker=worker,
+                                errors=json.dumps([{"row": 3, "error": "missing name"}]))
+        db.add(jobs[label])
+    db.commit()
+    ids = {label: job.id for label, job in jobs.items()}
+    db.close()
+
+    assert imports.fail_abandoned_jobs() >= 2
+
+    db = SessionLocal()
+    reports = {label: imports.job_to_dict(db.get(ImportJob, job_id)) for label, job_id in ids.items()}
+    db.close()
+    for label in ("running", "queued"):
+        assert reports[label]["status"] == "failed"
+        assert reports[label]["finished_at"] is not None
+        assert reports[label]["errors"] == [
+            {"row": 3, "error": "missing name"},
+            {"row": None, "error": imports.WORKER_RESTARTED_ERROR},
+        ]
+    assert reports["live"]["status"] == "running"
+    assert reports["elsewhere"]["status"] == "running"
@@ -0,0 +1,104 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from database import Base
+from migrations import MIGRATIONS, get_schema_version, run_migrations
+
+# Schema of a database created before the first migration
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    name VARCHAR(255),
+    bio TEXT,
+    avatar_url VARCHAR(500),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME
+);
+CREATE UNIQUE INDEX ix_users_email ON users (email);
+CREATE INDEX ix_users_id ON users (id);
+CREATE TABLE locations (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    name VARCHAR(255) NOT NULL,
+    latitude FLOAT NOT NULL,
+    longitude FLOAT NOT NULL,
+    description TEXT,
+    address TEXT,
+    source_url VARCHAR(500),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME
+);
+CREATE INDEX ix_locations_id ON locations (id);
+INSERT INTO users (id, email, password_hash) VALUES (1, 'old@example.com', 'x'), (2, 'empty@example.com', 'x');
+INSERT INTO locations (id, user_id, name, latitude, longitude, address)
+VALUES (1, 1, 'Eiffel Tower', 48.8584, 2.2945, 'Champ de Mars, Paris'),
+       (2, 1, 'Golden Gate Bridge', 37.8199, -122.4783, 'San Francisco');
+"""
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = tmp_path / "baseline.db"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+    engine = create_engine(f"sqlite:///{path}")
+    yield engine
+    engine.dispose()
+
+
+def migrate(engine):
+    # The order main.py starts up in
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+
+def test_baseline_database_is_brought_up_to_date(baseline):
+    migrate(baseline)
+    with baseline.connect() as conn:
+        assert get_schema_version(conn) == MIGRATIONS[-1][0]
+        users = dict(conn.execute(text("SELECT id, locations_version FROM users")).all())
+        assert users == {1: 1, 2: 0}
+        assert conn.execute(text("SELECT DISTINCT version FROM locations")).scalars().all() == [1]
+        assert conn.execute(text("SELECT tombstones_pruned_version FROM users WHERE id = 1")).scalar() == 0
+        # Existing rows are searchable and inside the R*Tree
+        assert conn.execute(text(
+            "SELECT rowid FROM locations_fts WHERE locations_fts MATCH 'eiffel AND owner:u1'"
+        )).scalars().all() == [1]
+        assert conn.execute(text(
+            "SELECT id FROM locations_rtree WHERE min_lon <= 3 AND max_lon >= 2 AND min_lat <= 49 AND max_lat >= 48"
+        )).scalars().all() == [1]
+
+
+def test_migrations_run_once(baseline):
+    migrate(baseline)
+    migrate(baseline)
+    with baseline.connect() as conn:
+        versions = conn.execute(text("SELECT version FROM schema_version ORDER BY version")).scalars().all()
+        assert versions == [version for version, _, _ in MIGRATIONS]
+        assert conn.execute(text(
+            "SELECT rowid FROM locations_fts WHERE locations_fts MATCH 'owner:u1' ORDER BY rowid"
+        )).scalars().all() == [1, 2]
+
+
+def test_new_rows_are_indexed_after_migrating(baseline):
+    migrate(baseline)
+    with baseline.begin() as conn:
+        conn.execute(text("INSERT INTO locations (id, user_id, name, latitude, longitude, version) "
+                          "VALUES (3, 2, 'Louvre', 48.8606, 2.3376, 1)"))
+    with baseline.connect() as conn:
+        assert conn.execute(text(
+            "SELECT rowid FROM locations_fts WHERE locations_fts MATCH 'louvre AND owner:u2'"
+        )).scalars().all() == [3]
+        assert conn.execute(text("SELECT min_user FROM locations_rtree WHERE id = 3")).scalar() == 2
+
+
+def test_fresh_database_migrates(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    migrate(engine)
+    with engine.connect() as conn:
+        assert get_schema_version(conn) == MIGRATIONS[-1][0]
+    engine.dispose()
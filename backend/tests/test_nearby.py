@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from nearby import PointIndex, haversine_m
+
+
+def brute_force(points, latitude, longitude, k, radius_m=None):
+    distances = sorted(
+        (haversine_m(latitude, longitude, lat, lon), location_id) for location_id, (lat, lon) in points.items()
+    )
+    if radius_m is not None:
+        distances = [item for item in distances if item[0] <= radius_m]
+    return [round(distance, 3) for distance, _ in distances[:k]]
+
+
+@pytest.fixture(scope="module")
+def points():
+    generator = random.Random(11)
+    points = {}
+    # Dense clusters, scattered points, and points by the antimeridian and the poles
+    for location_id in range(1500):
+        kind = location_id % 4
+        if kind == 0:
+            points[location_id] = (51.5 + generator.gauss(0, 0.05), -0.12 + generator.gauss(0, 0.05))
+        elif kind == 1:
+            points[location_id] = (generator.uniform(-60, 60), generator.uniform(-180, 180))
+        elif kind == 2:
+            points[location_id] = (generator.uniform(-20, 20), generator.choice([-1, 1]) * generator.uniform(179, 180))
+        else:
+            points[location_id] = (generator.choice([-1, 1]) * generator.uniform(85, 90), generator.uniform(-180, 180))
+    return points
+
+
+def build(points, cell_degrees=0.05):
+    index = PointIndex(cell_degrees)
+    for location_id, (latitude, longitude) in points.items():
+        index.add(location_id, latitude, longitude)
+    return index
+
+
+QUERIES = [(51.5, -0.12), (0.0, 179.99), (0.0, -179.99), (89.9, 0.0), (-89.9, 45.0), (-33.9, 151.2), (10.0, 10.0)]
+
+
+@pytest.mark.parametrize("latitude, longitude", QUERIES)
+@pytest.mark.parametrize("k", [1, 10, 50])
+def test_nearest_matches_brute_force(points, latitude, longitude, k):
+    found = build(points).nearest(latitude, longitude, k)
+    assert [round(distance, 3) for _, distance in found] == brute_force(points, latitude, longitude, k)
+    assert all(round(haversine_m(latitude, longitude, *points[location_id]), 3) == round(distance, 3)
+               for location_id, distance in found)
+
+
+@pytest.mark.parametrize("radius_m", [500.0, 50_000.0, 2_000_000.0])
+def test_radius_matches_brute_force(points, radius_m):
+    index = build(points)
+    for latitude, longitude in QUERIES:
+        found = index.nearest(latitude, longitude, 100, radius_m)
+        assert [round(distance, 3) for _, distance in found] == brute_force(points, latitude, longitude, 100, radius_m)
+
+
+def test_removed_points_are_not_returned(points):
+    index = build(points, cell_degrees=1.0)
+    remaining = dict(points)
+    for location_id in list(points)[::2]:
+        index.remove(location_id)
+        del remaining[location_id]
+    for latitude, longitude in QUERIES:
+        found = index.nearest(latitude, longitude, 20)
+        assert {location_id for location_id, _ in found} <= remaining.keys()
+        assert [round(distance, 3) for _, distance in found] == brute_force(remaining, latitude, longitude, 20)
@@ -0,0 +1,91 @@
+import asyncio
+import time
+import uuid
+
+import httpx
+import pytest
+
+import geocoding
+import main
+from ocr import run_in_ocr_pool, shutdown_ocr_pool
+
+GEOCODE_SECONDS = 0.2
+OCR_SECONDS = 0.3
+
+
+class SlowGeocoder(geocoding.Geocoder):
+    """Answers every query after a network-like delay, recording how many overlap"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def search(self, query, limit=1):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(GEOCODE_SECONDS)
+        finally:
+            self.active -= 1
+        return [{"latitude": 1.0, "longitude": 2.0, "address": query}]
+
+
+async def fake_recognize(contents, count_locations=None):
+    # Stands in for Tesseract with a blocking call in the OCR process pool
+    await run_in_ocr_pool(time.sleep, OCR_SECONDS)
+    return {"text": "caption", "size": 1, "mode": "RGB", "passes": [], "policy": "test",
+            "timings_ms": {}, "wall_ms": 0}
+
+
+@pytest.fixture
+def slow_pipeline(monkeypatch):
+    geocoder = SlowGeocoder()
+    names = [f"Cafe {uuid.uuid4().hex[:8]}" for _ in range(4)]
+    monkeypatch.setattr(main, "SCREENSHOT_CACHE_MODE", "off")
+    monkeypatch.setattr(main, "recognize", fake_recognize)
+    monkeypatch.setattr(main, "extract_locations_from_text",
+                        lambda text: [{"name": name, "confidence": 0.9} for name in names])
+    monkeypatch.setattr(geocoding, "geocoder", geocoder)
+    yield geocoder
+    shutdown_ocr_pool()
+
+
+async def max_loop_lag(done: asyncio.Event) -> float:
+    """Largest delay of a 10 ms tick while ``done`` is not set"""
+    lag = 0.0
+    while not done.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lag = max(lag, time.perf_counter() - started - 0.01)
+    return lag
+
+
+def test_parse_screenshot_keeps_the_event_loop_free(slow_pipeline):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            email = f"ocr-{uuid.uuid4().hex}@example.com"
+            token = (await client.post("/register", json={"email": email, "password": "secret"})).json()["access_token"]
+            # Start the OCR pool outside the measurement; spawning workers is not the point here
+            await run_in_ocr_pool(time.sleep, 0)
+
+            done = asyncio.Event()
+            lag = asyncio.create_task(max_loop_lag(done))
+            started = time.perf_counter()
+            response = await client.post(
+                "/parse-screenshot",
+                headers={"Authorization": f"Bearer {token}"},
+                files={"file": ("shot.png", b"not decoded by the fake OCR", "image/png")},
+            )
+            elapsed = time.perf_counter() - started
+            done.set()
+            return response, elapsed, await lag
+
+    response, elapsed, lag = asyncio.run(run())
+    assert response.status_code == 200
+    assert len(response.json()["locations"]) == 4
+    # OCR and geocoding are awaited, so other coroutines kept running throughout
+    assert lag < 0.1
+    # The candidates were geocoded concurrently, not one after another
+    assert slow_pipeline.peak == 4
+    assert elapsed < OCR_SECONDS + 2 * GEOCODE_SECONDS
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+
+from ratelimit import SingleFlight, SQLiteTokenBucket, TokenBucket
+
+
+async def acquire_times(bucket, count):
+    started = time.monotonic()
+    times = []
+    for _ in range(count):
+        await bucket.acquire()
+        times.append(time.monotonic() - started)
+    return times
+
+
+def test_token_bucket_allows_a_burst_then_paces():
+    times = asyncio.run(acquire_times(TokenBucket(rate=20, burst=3), 7))
+    assert times[2] < 0.03
+    # Four more tokens at 20 per second
+    assert 0.18 <= times[-1] < 0.5
+
+
+def test_token_bucket_serves_concurrent_callers():
+    async def run():
+        bucket = TokenBucket(rate=50, burst=1)
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+        return time.monotonic() - started
+
+    assert 0.09 <= asyncio.run(run()) < 0.5
+
+
+def test_sqlite_token_bucket_shares_one_budget():
+    name = f"test-{time.time_ns()}"
+    first, second = SQLiteTokenBucket(name, rate=10, burst=1), SQLiteTokenBucket(name, rate=10, burst=1)
+
+    async def run():
+        started = time.monotonic()
+        await first.acquire()
+        await second.acquire()
+        await first.acquire()
+        return time.monotonic() - started
+
+    # Three tokens from one bucket of burst 1 at 10 per second
+    assert 0.18 <= asyncio.run(run()) < 0.6
+
+
+def test_singleflight_coalesces_concurrent_calls():
+    calls = []
+
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {"latitude": 1.0}
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("paris", lookup) for _ in range(10)))
+        # Once the call has finished, the next one starts afresh
+        await flight.do("paris", lookup)
+        return results
+
+    results = asyncio.run(run())
+    assert len(calls) == 2
+    assert all(result is results[0] for result in results)
+
+
+def test_singleflight_shares_exceptions():
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("paris", failing) for _ in range(3)), return_exceptions=True)
+
+    assert [str(error) for error in asyncio.run(run())] == ["upstream down"] * 3
+
+
+def test_singleflight_survives_a_cancelled_caller():
+    async def lookup():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.do("paris", lookup))
+        second = asyncio.ensure_future(flight.do("paris", lookup))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "done"
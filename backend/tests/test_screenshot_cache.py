@@ -0,0 +1,64 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+import cache
+from ocr import fingerprint_image, same_screenshot
+
+CAPTIONS = [
+    f"Day {day}: brunch at Cafe {name}, then sunset at {place} Beach" for day, name, place in zip(
+        range(1, 31),
+        ["Lola", "Mira", "Bodega", "Nook", "Olive", "Juniper", "Saffron", "Pistachio", "Harbor", "Linden"] * 3,
+        ["Venice", "Malibu", "Bondi", "Copacabana", "Waikiki", "Ipanema"] * 5,
+    )
+]
+
+
+def render(text: str, fmt: str = "PNG", quality: int = 90) -> bytes:
+    image = Image.new("RGB", (1080, 1350), (250, 250, 250))
+    ImageDraw.Draw(image).multiline_text((40, 900), text, fill=(20, 20, 20), font_size=36)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def fingerprints():
+    return [fingerprint_image(render(caption), "perceptual") for caption in CAPTIONS]
+
+
+def test_different_screenshots_sharing_a_perceptual_key_are_told_apart(fingerprints):
+    keys = [key for key, _ in fingerprints]
+    # The coarse key alone cannot tell these text screenshots apart
+    assert len(set(keys)) < len(keys)
+    for i, (key_a, signature_a) in enumerate(fingerprints):
+        for key_b, signature_b in fingerprints[:i]:
+            if key_a == key_b:
+                assert not same_screenshot(signature_a, signature_b)
+
+
+def test_reencoded_screenshot_is_the_same_screenshot(fingerprints):
+    for caption, (_, signature) in zip(CAPTIONS, fingerprints):
+        _, reencoded = fingerprint_image(render(caption, "JPEG", quality=60), "perceptual")
+        assert same_screenshot(signature, reencoded)
+
+
+def test_pixel_keys_need_no_signature():
+    key, signature = fingerprint_image(render(CAPTIONS[0]), "pixels")
+    assert key.startswith("px:") and signature is None
+    assert same_screenshot(None, None)
+    assert not same_screenshot(None, b"\x00")
+
+
+def test_cache_returns_the_stored_signature(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DB_PATH", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(cache, "_local", type(cache._local)())
+    screenshots = cache.ScreenshotCache(ttl=60, max_entries=10, max_bytes=10 ** 6)
+    key, signature = fingerprint_image(render(CAPTIONS[0]), "perceptual")
+    screenshots.put(key, "text", [{"name": "Venice Beach"}], {}, signature)
+
+    cached = screenshots.get(key)
+    assert cached["signature"] == signature
+    _, other = fingerprint_image(render(CAPTIONS[1]), "perceptual")
+    assert not same_screenshot(other, cached["signature"])
@@ -0,0 +1,65 @@
+import json
+
+from conftest import add_location
+from database import reader_engine
+from queries import stream_locations
+
+
+def add_places(client, count):
+    return [add_location(client, f"place {number}") for number in range(count)]
+
+
+def test_stream_releases_the_connection_between_pages(client):
+    saved = add_places(client, 7)
+    user_id = saved[0]["user_id"]
+
+    rows = stream_locations(user_id, ["name"], batch_size=3)
+    names = []
+    for row in rows:
+        # The generator is suspended here, as while a response chunk is being sent
+        assert reader_engine.pool.checkedout() == 0
+        names.append(row["name"])
+    assert names == [location["name"] for location in saved]
+    assert all(set(row) == {"name"} for row in stream_locations(user_id, ["name"], batch_size=3))
+
+
+def test_stream_resumes_after_id(client):
+    saved = add_places(client, 5)
+    user_id = saved[0]["user_id"]
+    rows = list(stream_locations(user_id, ["id"], after_id=saved[1]["id"], batch_size=2))
+    assert [row["id"] for row in rows] == [location["id"] for location in saved[2:]]
+
+
+def test_unpaginated_list_returns_every_row(client):
+    saved = add_places(client, 4)
+    listed = client.get("/locations", params={"fields": "id,name"}).json()
+    assert [row["id"] for row in listed] == [location["id"] for location in saved]
+
+
+def test_export_returns_every_row(client):
+    saved = add_places(client, 4)
+    export = client.get("/locations/export", params={"format": "ndjson", "fields": "name"})
+    assert export.status_code == 200
+    assert [json.loads(line) for line in export.text.splitlines()] == [
+        {"id": location["id"], "name": location["name"]} for location in saved
+    ]
+
+
+def test_bbox_filter_separates_users_the_rtree_cannot_tell_apart():
+    from database import Location, SessionLocal, User
+    from queries import iter_rows, select_locations
+
+    # Above 2**24 the R*Tree's 32-bit floats no longer hold every integer user id
+    db = SessionLocal()
+    user_ids = [2 ** 24 + 1, 2 ** 24 + 2]
+    for user_id in user_ids:
+        db.add(User(id=user_id, email=f"rtree-{user_id}@example.com", password_hash="x"))
+        db.flush()
+        db.add(Location(user_id=user_id, name=f"pin of {user_id}", latitude=10.0, longitude=20.0))
+    db.commit()
+    try:
+        for user_id in user_ids:
+            rows = list(iter_rows(db, select_locations(user_id, ["name"], bbox=(19.0, 9.0, 21.0, 11.0))))
+            assert rows == [{"name": f"pin of {user_id}"}]
+    finally:
+        db.close()
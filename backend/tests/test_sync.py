@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import add_location
+from database import SessionLocal
+from sync import prune_tombstones
+
+
+def add(client, name):
+    return add_location(client, name)["id"]
+
+
+def changes(client, since):
+    response = client.get("/locations/changes", params={"since": since})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_delta_sync_reports_upserts_and_deletes(client):
+    first = add(client, "first")
+    cursor = changes(client, 0)["cursor"]
+    second = add(client, "second")
+    assert client.delete(f"/locations/{first}").status_code == 200
+
+    delta = changes(client, cursor)
+    assert not delta["reset"]
+    assert [location["id"] for location in delta["upserts"]] == [second]
+    assert delta["deletes"] == [first]
+    assert delta["cursor"] > cursor
+    assert changes(client, delta["cursor"])["upserts"] == []
+
+
+def test_changes_answer_304_until_something_changes(client):
+    add(client, "first")
+    response = client.get("/locations/changes", params={"since": 0})
+    etag = response.headers["ETag"]
+    assert client.get("/locations/changes", params={"since": 0}, headers={"If-None-Match": etag}).status_code == 304
+    add(client, "second")
+    assert client.get("/locations/changes", params={"since": 0}, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_unknown_cursor_resets(client):
+    add(client, "first")
+    delta = changes(client, 10 ** 6)
+    assert delta["reset"]
+    assert [location["name"] for location in delta["upserts"]] == ["first"]
+
+
+def test_cursor_older_than_pruned_tombstones_resets(client):
+    kept = add(client, "kept")
+    deleted = add(client, "deleted")
+    stale_cursor = changes(client, 0)["cursor"]
+    assert client.delete(f"/locations/{deleted}").status_code == 200
+    current_cursor = changes(client, stale_cursor)["cursor"]
+
+    db = SessionLocal()
+    try:
+        assert prune_tombstones(db, datetime.utcnow() + timedelta(minutes=1)) >= 1
+    finally:
+        db.close()
+
+    # The deletion is gone, so a delta from before it would be wrong
+    delta = changes(client, stale_cursor)
+    assert delta["reset"]
+    assert [location["id"] for location in delta["upserts"]] == [kept]
+    assert delta["deletes"] == []
+
+    # Cursors at or after the pruned deletion still get deltas
+    added = add(client, "added")
+    delta = changes(client, current_cursor)
+    assert not delta["reset"]
+    assert [location["id"] for location in delta["upserts"]] == [added]
+
+
+def test_recent_tombstones_are_kept(client):
+    deleted = add(client, "deleted")
+    cursor = changes(client, 0)["cursor"]
+    assert client.delete(f"/locations/{deleted}").status_code == 200
+    db = SessionLocal()
+    try:
+        prune_tombstones(db, datetime.utcnow() - timedelta(days=1))
+    finally:
+        db.close()
+    assert changes(client, cursor)["deletes"] == [deleted]
+
+
+def test_nearby_index_rebuilds_after_pruned_deletions(client):
+    kept = add(client, "kept")
+    deleted = add(client, "deleted")
+    nearby = client.get("/locations/nearby", params={"lat": 1, "lon": 2, "k": 5}).json()
+    assert {location["id"] for location in nearby} == {kept, deleted}
+
+    client.delete(f"/locations/{deleted}")
+    db = SessionLocal()
+    try:
+        prune_tombstones(db, datetime.utcnow() + timedelta(minutes=1))
+    finally:
+        db.close()
+    nearby = client.get("/locations/nearby", params={"lat": 1, "lon": 2, "k": 5}).json()
+    assert [location["id"] for location in nearby] == [kept]
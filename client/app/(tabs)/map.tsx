@@ -5,7 +5,7 @@ import { StatusBar } from 'expo-status-bar';
 import * as Location from 'expo-location';
 import WebView from 'react-native-webview';
 import debounce from 'lodash/debounce';
-import { getLocations, addLocation, deleteLocation } from '../utils/api';
+import { getLocations, getLocationChanges, openLocationsSocket, addLocation, deleteLocation, geocodeSearch } from '../utils/api';
 import { useAuth } from '../contexts/AuthContext';
 
 // Conditional import for web-only packages
@@ -57,6 +57,10 @@ const MARKER_COLORS = {
   savedLocation: '#FF9500'    // Orange
 };
 
+// Reconnect delays for the location changes WebSocket: exponential backoff, with full jitter
+const SOCKET_RECONNECT_BASE_MS = 1000;
+const SOCKET_RECONNECT_MAX_MS = 30000;
+
 // Add RecenterButton component for web
 const RecenterButton = ({ position }: { position: [number, number] }) => {
   const map = useMap();
@@ -154,6 +158,7 @@ const MapScreen = () => {
   const [searchResults, setSearchResults] = useState<SearchResult[]>([]);
   const [selectedAddress, setSelectedAddress] = useState<SearchResult | null>(null);
   const webViewRef = useRef<WebView>(null);
+  const syncCursorRef = useRef(0);
 
   const checkLocationEnabled = async () => {
     try {
@@ -320,33 +325,24 @@ const MapScreen = () => {
         return;
       }
 
+      if (!authToken) {
+        setIsSearching(false);
+        return;
+      }
+
       setIsSearching(true);
       try {
-        const response = await fetch(
-          `https://nominatim.openstreetmap.org/search?format=json&q=${encodeURIComponent(
-            address
-          )}&limit=5&addressdetails=1`,
-          {
-            headers: {
-              'Accept': 'application/json',
-              'Accept-Language': 'en',
-              'User-Agent': 'Vibesy-App/1.0',
-              'Referer': 'https://vibesy.app'
-            }
-          }
-        );
-
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
+        // The backend answers from saved places and its shared cache before asking the geocoder
+        const data = await geocodeSearch(authToken, address, 5);
+        if (!data.complete && !data.results.length) {
+          // Superseded by a newer keystroke; its response will fill the list
+          return;
         }
-
-        const contentType = response.headers.get('content-type');
-        if (!contentType || !contentType.includes('application/json')) {
-          throw new Error(`Expected JSON but received ${contentType}`);
-        }
-
-        const data = await response.json();
-        setSearchResults(data);
+        setSearchResults(data.results.map((result: any) => ({
+          lat: String(result.latitude),
+          lon: String(result.longitude),
+          display_name: result.address || result.name,
+        })));
       } catch (error) {
         console.error('Error searching address:', error);
         // Don't show alert for every error to avoid spamming the user
@@ -359,8 +355,8 @@ const MapScreen = () => {
       } finally {
         setIsSearching(false);
       }
-    }, 1000), // Debounce for 1 second
-    [] // Empty dependency array since we don't need to recreate the debounced function
+    }, 300), // The server debounces too, so keep this short
+    [authToken]
   );
 
   // Add cleanup for debounced function
@@ -467,22 +463,95 @@ const MapScreen = () => {
 
   // Add listener to refresh locations when screen comes into focus
   useEffect(() => {
+    syncCursorRef.current = 0;
+
     const refreshOnFocus = async () => {
       if (authToken) {
         try {
-          const data = await getLocations(authToken);
-          setSavedLocations(data);
-          console.log(`Refreshed ${data.length} locations on map`);
+          // Only fetch what changed since the last poll
+          const changes = await getLocationChanges(authToken, syncCursorRef.current);
+          syncCursorRef.current = changes.cursor;
+          if (changes.reset || changes.upserts.length || changes.deletes.length) {
+            setSavedLocations(prev => {
+              const byId = new Map<string, SavedLocation>();
+              if (!changes.reset) {
+                prev.forEach(loc => byId.set(String(loc.id), loc));
+              }
+              changes.deletes.forEach((id: number) => byId.delete(String(id)));
+              changes.upserts.forEach((loc: SavedLocation) => byId.set(String(loc.id), loc));
+              return Array.from(byId.values());
+            });
+            console.log(`Synced ${changes.upserts.length} changed and ${changes.deletes.length} deleted locations on map`);
+          }
         } catch (e: any) {
           console.error('Failed to refresh locations:', e);
         }
       }
     };
 
-    // Refresh every 5 seconds when screen is visible
-    const interval = setInterval(refreshOnFocus, 5000);
+    // Changes are pushed over a WebSocket; each push triggers a delta sync.
+    // A dropped socket is reopened with backoff, and each (re)connect resumes
+    // from the last synced cursor so changes made while offline are fetched.
+    let socket: WebSocket | null = null;
+    let socketOpen = false;
+    let stopped = false;
+    let reconnectAttempts = 0;
+    let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+
+    const scheduleReconnect = () => {
+      const ceiling = Math.min(SOCKET_RECONNECT_MAX_MS, SOCKET_RECONNECT_BASE_MS * 2 ** reconnectAttempts);
+      reconnectAttempts += 1;
+      reconnectTimer = setTimeout(connect, Math.random() * ceiling);
+    };
+
+    const connect = async () => {
+      if (stopped || !authToken) return;
+      let opened: WebSocket;
+      try {
+        opened = await openLocationsSocket(authToken);
+      } catch (e: any) {
+        // Could not get a socket ticket (e.g. server unreachable); try again later
+        console.error('Failed to open location updates socket:', e);
+        if (!stopped) scheduleReconnect();
+        return;
+      }
+      if (stopped) {
+        opened.close();
+        return;
+      }
+      socket = opened;
+      socket.onopen = () => {
+        socketOpen = true;
+        reconnectAttempts = 0;
+        refreshOnFocus();
+      };
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type !== 'ping' && message.cursor !== syncCursorRef.current) {
+          refreshOnFocus();
+        }
+      };
+      socket.onclose = (event) => {
+        socketOpen = false;
+        socket = null;
+        // 1008: the server rejected the token, so reconnecting cannot succeed
+        if (stopped || event.code === 1008) return;
+        scheduleReconnect();
+      };
+    };
+    connect();
+
+    // Fall back to refreshing every 5 seconds while the socket is down
+    const interval = setInterval(() => {
+      if (!socketOpen) refreshOnFocus();
+    }, 5000);
     
-    return () => clearInterval(interval);
+    return () => {
+      stopped = true;
+      clearInterval(interval);
+      if (reconnectTimer) clearTimeout(reconnectTimer);
+      socket?.close();
+    };
   }, [authToken]);
 
   const generateMapHTML = () => {
@@ -71,6 +71,71 @@ export async function getLocations(token: string) {
   return res.json();
 }
 
+// Locations added, changed or deleted since a cursor returned by a previous call (0 = everything)
+export async function getLocationChanges(token: string, since: number) {
+  const res = await fetch(`${getApiBase()}/locations/changes?since=${since}`, {
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.json();
+}
+
+// Clusters of the user's locations in a viewport: bbox is [minLon, minLat, maxLon, maxLat]
+export async function getLocationClusters(token: string, bbox: number[], zoom: number) {
+  const res = await fetch(`${getApiBase()}/locations/clusters?bbox=${bbox.join(',')}&zoom=${zoom}`, {
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.json();
+}
+
+// The k saved locations nearest to a position, each with its distance_m
+export async function getNearbyLocations(token: string, latitude: number, longitude: number, k = 10, radiusM?: number) {
+  const radius = radiusM ? `&radius_m=${radiusM}` : '';
+  const res = await fetch(`${getApiBase()}/locations/nearby?lat=${latitude}&lon=${longitude}&k=${k}${radius}`, {
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.json();
+}
+
+// Saved locations matching a search box value, best match first (the last word may be partial)
+export async function searchLocations(token: string, query: string, limit = 20) {
+  const res = await fetch(`${getApiBase()}/locations/search?q=${encodeURIComponent(query)}&limit=${limit}`, {
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.json();
+}
+
+// Address autocomplete: saved places, gazetteer and cached geocoder results
+export async function geocodeSearch(token: string, query: string, limit = 5) {
+  const res = await fetch(`${getApiBase()}/geocode/search?q=${encodeURIComponent(query)}&limit=${limit}`, {
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.json();
+}
+
+// WebSocket that pushes the user's location changes as they happen. The token goes in a
+// header, never in the URL; browsers cannot set WebSocket headers, so on web a single-use
+// ticket is fetched first.
+export async function openLocationsSocket(token: string): Promise<WebSocket> {
+  const url = `${getApiBase().replace(/^http/, 'ws')}/ws/locations`;
+  if (Platform.OS !== 'web') {
+    // React Native's WebSocket accepts headers as a third argument
+    const NativeWebSocket = WebSocket as any;
+    return new NativeWebSocket(url, undefined, { headers: { 'Authorization': `Bearer ${token}` } });
+  }
+  const res = await fetch(`${getApiBase()}/ws/locations/ticket`, {
+    method: 'POST',
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!res.ok) throw new Error(await res.text());
+  const { ticket } = await res.json();
+  return new WebSocket(`${url}?ticket=${encodeURIComponent(ticket)}`);
+}
+
 export async function addLocation(token: string, location: any) {
   const res = await fetch(`${getApiBase()}/locations`, {
     method: 'POST',
@@ -158,6 +223,39 @@ export async function parseScreenshot(token: string, file: any) {
   return res.json();
 }
 
+// Starts a background import of a CSV / GeoJSON / KML file; poll getImportJob for progress
+export async function importLocations(token: string, file: any) {
+  const formData = new FormData();
+  const name = file.name || 'places.csv';
+
+  if (Platform.OS === 'web') {
+    const response = await fetch(file.uri);
+    formData.append('file', await response.blob(), name);
+  } else {
+    formData.append('file', {
+      uri: file.uri,
+      name,
+      type: file.type || 'application/octet-stream'
+    } as any);
+  }
+
+  const res = await fetch(`${getApiBase()}/locations/import`, {
+    method: 'POST',
+    headers: { 'Authorization': `Bearer ${token}` },
+    body: formData
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.json();
+}
+
+export async function getImportJob(token: string, jobId: number) {
+  const res = await fetch(`${getApiBase()}/locations/import/${jobId}`, {
+    headers: { 'Authorization': `Bearer ${token}` }
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.json();
+}
+
 export async function refreshLocations(token: string) {
   const res = await fetch(`${getApiBase()}/locations/refresh`, {
     headers: { 'Authorization': `Bearer ${token}` }